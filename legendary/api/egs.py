@@ -42,6 +42,8 @@ class EPCAPI:
 
         self.unauth_session = requests.session()
         self.unauth_session.headers['User-Agent'] = self._user_agent
+        # allow concurrent savegame chunk transfers
+        self.unauth_session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=16))
 
         self._oauth_basic = HTTPBasicAuth(self._user_basic, self._pw_basic)
 
@@ -0,0 +1,323 @@
+# coding: utf-8
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import zlib
+
+from collections import OrderedDict, defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import urlsplit
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+from legendary.lfs.chunk_store import ChunkStore
+from legendary.models.chunk import Chunk
+from legendary.models.manifest import Manifest
+from legendary.utils.rolling_hash import scan
+
+logger = logging.getLogger('ChunkServer')
+
+# CDN hosts the proxy may fetch from if no fixed upstream is set (in addition to ones from game metadata)
+KNOWN_CDN_HOSTS = {
+    'download.epicgames.com',
+    'download2.epicgames.com',
+    'download3.epicgames.com',
+    'download4.epicgames.com',
+    'epicgames-download1.akamaized.net',
+    'fastly-download.epicgames.com',
+    'egdownload.fastly-edge.com',
+    'cloudflare.epicgamescdn.com',
+}
+
+# chunk file names as used by the CDN, e.g. "ChunksV4/42/0123456789ABCDEF_<GUID>.chunk"
+_chunk_name_re = re.compile(r'([0-9A-F]{16})_([0-9A-F]{32})\.chunk$', re.IGNORECASE)
+
+
+def get_chunk_name(chunk_path):
+    """Returns the "<hash>_<guid>" part of a chunk path or URL (upper case), or None if it isn't one"""
+    if m := _chunk_name_re.search(chunk_path.partition('?')[0]):
+        return f'{m.group(1)}_{m.group(2)}'.upper()
+    return None
+
+
+class LRUCache:
+    """Simple thread-safe LRU cache of bytes objects with a total size limit"""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if (data := self._items.get(key)) is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_size:
+            return
+        with self._lock:
+            if (old := self._items.pop(key, None)) is not None:
+                self.size -= len(old)
+            self._items[key] = data
+            self.size += len(data)
+            while self.size > self.max_size:
+                _, evicted = self._items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class InstalledChunkSource:
+    """
+    Reconstructs chunks from the files of an installed game using the chunk parts in its manifest.
+    """
+    def __init__(self, install_path, manifest: Manifest):
+        self.install_path = install_path
+        self.chunks = dict()
+        # chunk name -> [(file name, offset in file, offset in chunk, size)]
+        self.parts = defaultdict(list)
+
+        chunk_names = dict()
+        for chunk in manifest.chunk_data_list.elements:
+            name = f'{chunk.hash:016X}_{"".join(f"{g:08X}" for g in chunk.guid)}'
+            chunk_names[chunk.guid_num] = name
+            self.chunks[name] = chunk
+
+        # each part of a chunk is only needed once, even if it's used by multiple files
+        seen = set()
+        for fm in manifest.file_manifest_list.elements:
+            for cp in fm.chunk_parts:
+                if (key := (cp.guid_num, cp.offset, cp.size)) in seen:
+                    continue
+                seen.add(key)
+                self.parts[chunk_names[cp.guid_num]].append((fm.filename, cp.file_offset, cp.offset, cp.size))
+
+    def __contains__(self, name):
+        return name in self.chunks
+
+    def get_chunk_data(self, name, overrides=None):
+        """
+        Returns the uncompressed chunk data, or None if it could not be reconstructed
+        (e.g. files were modified or parts of the chunk belong to files that are not installed)
+
+        :param name: chunk name
+        :param overrides: (file name, offset in file, offset in chunk, size) parts that are read instead of
+                          the default ones, to check the copy of the chunk's data in a specific file
+        """
+        chunk = self.chunks[name]
+        buf = bytearray(chunk.window_size)
+        view = memoryview(buf)
+
+        parts = self.parts[name]
+        if overrides:
+            # overrides are read last so they replace whatever other parts covered the same range
+            ranges = {(chunk_offset, size) for _, _, chunk_offset, size in overrides}
+            parts = [p for p in parts if (p[2], p[3]) not in ranges] + list(overrides)
+
+        try:
+            for filename, file_offset, chunk_offset, size in parts:
+                with open(os.path.join(self.install_path, filename), 'rb') as f:
+                    f.seek(file_offset)
+                    if f.readinto(view[chunk_offset:chunk_offset + size]) != size:
+                        logger.debug(f'File "{filename}" is too short for chunk {name}')
+                        return None
+        except OSError as e:
+            logger.debug(f'Reading chunk {name} from files failed with {e!r}')
+            return None
+
+        if hashlib.sha1(buf).digest() != chunk.sha_hash:
+            logger.debug(f'Reconstructed chunk {name} does not match its hash')
+            return None
+
+        return bytes(buf)
+
+    def get_chunk(self, name, path='', compress=False):
+        """Returns the chunk in the CDN's chunk file format"""
+        if name not in self.chunks or (data := self.get_chunk_data(name)) is None:
+            return None
+        chunk = self.chunks[name]
+        return Chunk.from_data(data, chunk.guid, chunk.hash, chunk.sha_hash).write(compress=compress)
+
+
+class ProxyChunkSource:
+    """
+    Fetches chunks from the actual CDN and keeps them in an on-disk chunk store.
+
+    The upstream URL is built from the request path: either relative to a fixed upstream base URL,
+    or (if none is set) with the first path component being the CDN host, e.g.
+    "/download.epicgames.com/Builds/.../ChunksV4/42/<hash>_<guid>.chunk".
+    In the latter case only hosts in allowed_hosts are contacted.
+    """
+    def __init__(self, store: ChunkStore, upstream_url=None, upstream_scheme='https', timeout=10.0,
+                 allowed_hosts=None):
+        self.store = store
+        self.upstream_url = upstream_url.rstrip('/') if upstream_url else None
+        self.upstream_scheme = upstream_scheme
+        self.allowed_hosts = {h.lower() for h in (KNOWN_CDN_HOSTS if allowed_hosts is None else allowed_hosts)}
+        self.timeout = timeout
+        self.session = requests.session()
+        self.session.headers.update({
+            'User-Agent': 'EpicGamesLauncher/11.0.1-14907503+++Portal+Release-Live Windows/10.0.19041.1.256.64bit'
+        })
+        self.session.mount(f'{upstream_scheme}://', HTTPAdapter(pool_maxsize=32))
+        self.fetched = self.fetched_bytes = self.hits = 0
+
+        # requests for chunks that are currently being fetched wait for that instead of fetching it again
+        self._in_flight = dict()
+        self._lock = threading.Lock()
+
+    def get_upstream_url(self, path):
+        """Returns the upstream URL for a request path, or None if it points to a host that is not allowed"""
+        path = path.lstrip('/')
+        if self.upstream_url:
+            return f'{self.upstream_url}/{path}'
+
+        url = f'{self.upstream_scheme}://{path}'
+        try:
+            netloc = urlsplit(url).netloc.lower()
+        except ValueError:
+            return None
+        # compare the entire netloc so credentials or a port can't be used to reach another host
+        if netloc not in self.allowed_hosts:
+            return None
+        return url
+
+    def get_chunk(self, name, path='', compress=False):
+        if (data := self.store.get(name)) is not None:
+            with self._lock:
+                self.hits += 1
+            return data
+
+        with self._lock:
+            if request := self._in_flight.get(name):
+                owner = False
+            else:
+                # [event, data] of the request fetching the chunk
+                request = self._in_flight[name] = [threading.Event(), None]
+                owner = True
+
+        if not owner:
+            request[0].wait(timeout=self.timeout * 3)
+            return request[1]
+
+        try:
+            request[1] = self._fetch(name, path)
+            return request[1]
+        finally:
+            with self._lock:
+                del self._in_flight[name]
+            request[0].set()
+
+    def _fetch(self, name, path):
+        if not (url := self.get_upstream_url(path)):
+            logger.warning(f'Refusing to fetch chunk {name} from a host that is not a known CDN: '
+                           f'"{path.lstrip("/").partition("/")[0]}"')
+            return None
+        logger.debug(f'Fetching {url}')
+        try:
+            r = self.session.get(url, timeout=self.timeout)
+            r.raise_for_status()
+        except Exception as e:
+            logger.warning(f'Fetching chunk {name} from upstream failed with {e!r}')
+            return None
+
+        data = r.content
+        # make sure we got the chunk we asked for before storing it
+        try:
+            chunk = Chunk.read_buffer(data)
+        except ValueError as e:
+            logger.warning(f'Upstream returned invalid data for chunk {name}: {e!r}')
+            return None
+        if ChunkStore.get_key(chunk.guid_num, chunk.hash) != name:
+            logger.warning(f'Upstream returned a different chunk than {name}')
+            return None
+        # the header may be intact even if the body is not, never store (and serve) broken chunks
+        if not self._verify_chunk(chunk):
+            logger.warning(f'Upstream returned corrupted data for chunk {name}')
+            return None
+
+        with self._lock:
+            self.fetched += 1
+            self.fetched_bytes += len(data)
+        self.store.put(name, data)
+        return data
+
+    @staticmethod
+    def _verify_chunk(chunk: Chunk):
+        """Checks the chunk's data against the hashes in its header"""
+        try:
+            data = chunk.data
+        except zlib.error:
+            return False
+        if len(data) != chunk.uncompressed_size:
+            return False
+        if chunk.hash_type & 0x2:
+            return hashlib.sha1(data).digest() == chunk.sha_hash
+        # no SHA-1 in the header, fall back to the (slower) rolling hash
+        return any(offset == 0 for offset, _ in scan(BytesIO(data), {chunk.hash}, len(data)))
+
+
+class _ChunkRequestHandler(BaseHTTPRequestHandler):
+    server: 'ChunkServer'
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        if not (name := get_chunk_name(self.path)):
+            self.send_error(404)
+            return
+
+        data = self.server.get_chunk(name, self.path)
+        if data is None:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} - {format % args}')
+
+
+class ChunkServer(ThreadingHTTPServer):
+    """
+    HTTP server answering chunk requests in the CDN's path layout, so it can be used as a base URL for downloads.
+    Chunks are looked up by their file name in each source in order, installed game sources ignore the path
+    prefix (e.g. "ChunksV4/<group>/"), a proxy source uses it to determine the upstream URL.
+    """
+    daemon_threads = True
+
+    def __init__(self, sources, bind_addr='127.0.0.1', port=8080, cache_size=256 * 1024 * 1024, compress=False):
+        self.sources = sources
+        self.compress = compress
+        self.cache = LRUCache(cache_size)
+        self.served = self.misses = 0
+        self._stats_lock = threading.Lock()
+        super().__init__((bind_addr, port), _ChunkRequestHandler)
+
+    def get_chunk(self, name, path=''):
+        data = self.cache.get(name)
+        if data is None:
+            for source in self.sources:
+                if (data := source.get_chunk(name, path, compress=self.compress)) is not None:
+                    self.cache.put(name, data)
+                    break
+
+        with self._stats_lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.served += 1
+        return data
@@ -8,17 +8,19 @@ import logging
 import os
 import shlex
 import subprocess
+import sys
 import time
 import webbrowser
 
 from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from logging.handlers import QueueListener
 from multiprocessing import freeze_support, Queue as MPQueue
 from platform import platform
 from sys import exit, stdout, platform as sys_platform
 
 from legendary import __version__, __codename__
-from legendary.core import LegendaryCore
 from legendary.models.exceptions import InvalidCredentialsError
 from legendary.models.game import SaveGameStatus, VerifyResult, Game
 from legendary.utils.cli import get_boolean_choice, get_int_choice, sdl_prompt, strtobool
@@ -40,6 +42,9 @@ logger = logging.getLogger('cli')
 
 class LegendaryCLI:
     def __init__(self, override_config=None, api_timeout=None):
+        # importing the core pulls in requests and the rest of legendary, so it is deferred
+        # until a subcommand actually needs it to keep --version/help and argparse fast.
+        from legendary.core import LegendaryCore
         self.core = LegendaryCore(override_config, timeout=api_timeout)
         self.logger = logging.getLogger('cli')
         self.logging_queue = None
@@ -58,11 +63,19 @@ class LegendaryCLI:
         self.core.update_aliases(force=False)
         name = name.strip()
         # resolve alias (if any) to real app name
-        return self.core.lgd.config.get(
+        app_name = self.core.lgd.config.get(
             section='Legendary.aliases', option=name,
             fallback=self.core.lgd.aliases.get(name.lower(), name)
         )
 
+        # suggest similar names if this doesn't appear to be a valid app name
+        if not self.core.lgd.get_game_meta(app_name) and not self.core.is_installed(app_name):
+            if suggestions := self.core.get_alias_suggestions(name):
+                logger.info(f'"{name}" is not a known app name or alias, did you mean: ' +
+                            ', '.join(f'"{alias}" ({app_name})' for app_name, alias, _ in suggestions))
+
+        return app_name
+
     @staticmethod
     def _print_json(data, pretty=False):
         if pretty:
@@ -217,7 +230,7 @@ class LegendaryCLI:
             dlc_list[citem_id] = sorted(dlc_list[citem_id], key=lambda d: d.app_title.lower())
 
         if args.csv or args.tsv:
-            writer = csv.writer(stdout, dialect='excel-tab' if args.tsv else 'excel', lineterminator='\n')
+            writer = csv.writer(sys.stdout, dialect='excel-tab' if args.tsv else 'excel', lineterminator='\n')
             writer.writerow(['App name', 'App title', 'Version', 'Is DLC'])
             for game in games:
                 writer.writerow((game.app_name, game.app_title, game.app_version(args.platform), False))
@@ -228,7 +241,7 @@ class LegendaryCLI:
         if args.json:
             _out = []
             for game in games:
-                _j = vars(game)
+                _j = dict(vars(game))
                 _j['dlcs'] = [vars(dlc) for dlc in dlc_list[game.catalog_item_id]]
                 _out.append(_j)
 
@@ -274,23 +287,21 @@ class LegendaryCLI:
                 logger.error('Login failed! Not checking for updates.')
             else:
                 # Update assets for all platforms currently installed
-                for app_platform in self.core.get_installed_platforms():
-                    self.core.get_assets(True, platform=app_platform)
+                self.core.update_assets(self.core.get_installed_platforms())
 
         games = sorted(self.core.get_installed_list(include_dlc=True),
                        key=lambda x: x.title.lower())
+        self.core.update_missing_install_sizes(games)
 
-        versions = dict()
+        versions = self.core.get_available_versions(games)
         for game in games:
-            try:
-                versions[game.app_name] = self.core.get_asset(game.app_name, platform=game.platform).build_version
-            except ValueError:
+            if game.app_name not in versions:
                 logger.warning(f'Metadata for "{game.app_name}" is missing, the game may have been removed from '
                                f'your account or not be in legendary\'s database yet, try rerunning the command '
                                f'with "--check-updates".')
 
         if args.csv or args.tsv:
-            writer = csv.writer(stdout, dialect='excel-tab' if args.tsv else 'excel', lineterminator='\n')
+            writer = csv.writer(sys.stdout, dialect='excel-tab' if args.tsv else 'excel', lineterminator='\n')
             writer.writerow(['App name', 'App title', 'Installed version', 'Available version',
                              'Update available', 'Install size', 'Install path', 'Platform'])
             writer.writerows((game.app_name, game.title, game.version, versions[game.app_name],
@@ -300,7 +311,13 @@ class LegendaryCLI:
             return
 
         if args.json:
-            return self._print_json([vars(g) for g in games], args.pretty_json)
+            _out = []
+            for game in games:
+                _j = dict(vars(game))
+                _j['available_version'] = versions.get(game.app_name)
+                _j['update_available'] = game.app_name in versions and versions[game.app_name] != game.version
+                _out.append(_j)
+            return self._print_json(_out, args.pretty_json)
 
         installed_dlcs = defaultdict(list)
         for game in games.copy():
@@ -317,12 +334,6 @@ class LegendaryCLI:
 
         print('\nInstalled games:')
         for game in games:
-            if game.install_size == 0 and self.core.lgd.lock_installed():
-                logger.debug(f'Updating missing size for {game.app_name}')
-                m = self.core.load_manifest(self.core.get_installed_manifest(game.app_name)[0])
-                game.install_size = sum(fm.file_size for fm in m.file_manifest_list.elements)
-                self.core.install_game(game)
-
             print(f' * {game.title} (App name: {game.app_name} | Version: {game.version} | '
                   f'Platform: {game.platform} | {game.install_size / (1024 * 1024 * 1024):.02f} GiB)')
             if args.include_dir:
@@ -380,7 +391,7 @@ class LegendaryCLI:
             for fm in files:
                 print(f'{fm.hash.hex()} *{fm.filename}')
         elif args.csv or args.tsv:
-            writer = csv.writer(stdout, dialect='excel-tab' if args.tsv else 'excel', lineterminator='\n')
+            writer = csv.writer(sys.stdout, dialect='excel-tab' if args.tsv else 'excel', lineterminator='\n')
             writer.writerow(['path', 'hash', 'size', 'install_tags'])
             writer.writerows((fm.filename, fm.hash.hex(), fm.file_size, '|'.join(fm.install_tags)) for fm in files)
         elif args.json:
@@ -464,7 +475,8 @@ class LegendaryCLI:
 
         logger.info(f'Got {len(latest_save)} remote save game(s)')
 
-        # evaluate current save state for each game.
+        # evaluate current save state for each game, resolving save paths may require user input
+        sync_games = []
         for igame in igames:
             game = self.core.get_game(igame.app_name)
             if not game or not (game.supports_cloud_saves or game.supports_mac_cloud_saves):
@@ -516,8 +528,20 @@ class LegendaryCLI:
                 igame.save_path = save_path
                 self.core.lgd.set_installed_game(igame.app_name, igame)
 
-            res, (dt_l, dt_r) = self.core.check_savegame_state(igame.save_path, latest_save.get(igame.app_name))
+            if igame.save_path:
+                sync_games.append(igame)
+
+        max_parallel = max(1, args.max_parallel)
+        # comparing local and remote state means hashing files and fetching manifests, do it for all games at once
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            states = executor.map(lambda ig: self.core.check_savegame_state(ig.save_path, latest_save.get(ig.app_name)),
+                                  sync_games)
+            states = list(states)
 
+        # decide what to do for each game (this may prompt), the transfers themselves are run afterwards
+        transfers = []
+        for igame, (res, (dt_l, dt_r)) in zip(sync_games, states):
+            logger.info(f'Save game state for "{igame.title}" ({igame.app_name}):')
             if res == SaveGameStatus.NO_SAVE:
                 logger.info('No cloud or local savegame found.')
                 continue
@@ -544,9 +568,9 @@ class LegendaryCLI:
                         logger.info('Not downloading...')
                         continue
 
-                logger.info('Downloading remote savegame...')
-                self.core.download_saves(igame.app_name, save_dir=igame.save_path, clean_dir=True,
-                                         manifest_name=latest_save[igame.app_name].manifest_name)
+                transfers.append((igame, 'Downloading remote savegame', partial(
+                    self.core.download_saves, igame.app_name, save_dir=igame.save_path, clean_dir=True,
+                    manifest_name=latest_save[igame.app_name].manifest_name)))
             elif res == SaveGameStatus.LOCAL_NEWER or args.force_upload:
                 if res == SaveGameStatus.LOCAL_NEWER:
                     logger.info(f'Local save for "{igame.title}" is newer')
@@ -564,8 +588,42 @@ class LegendaryCLI:
                     if not get_boolean_choice(f'Upload local save?'):
                         logger.info('Not uploading...')
                         continue
-                logger.info('Uploading local savegame...')
-                self.core.upload_save(igame.app_name, igame.save_path, dt_l, args.disable_filters)
+
+                transfers.append((igame, 'Uploading local savegame', partial(
+                    self.core.upload_save, igame.app_name, igame.save_path, dt_l, args.disable_filters,
+                    incremental=args.incremental, content_defined_chunking=args.content_defined_chunking)))
+
+        if not transfers:
+            return
+
+        logger.info(f'Transferring saves for {len(transfers)} game(s)...')
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            futures = dict()
+            for igame, action, job in transfers:
+                logger.info(f'{action} for "{igame.title}"...')
+                futures[executor.submit(job)] = igame
+
+            failed = []
+            for future in as_completed(futures):
+                igame = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed.append(igame)
+                    logger.error(f'Syncing saves for "{igame.title}" failed with {e!r}')
+                    continue
+
+                # upload_save returns False if any file failed to upload (the details have been logged already)
+                if result is False:
+                    failed.append(igame)
+                    logger.error(f'Syncing saves for "{igame.title}" failed.')
+                else:
+                    logger.debug(f'Finished syncing saves for "{igame.title}"')
+
+        if failed:
+            logger.error(f'Syncing saves failed for {len(failed)} game(s): '
+                         f'{", ".join(igame.title for igame in failed)}')
+            exit(1)
 
     def launch_game(self, args, extra):
         app_name = self._resolve_aliases(args.app_name)
@@ -606,16 +664,45 @@ class LegendaryCLI:
 
         # override with config value
         args.offline = self.core.is_offline_game(app_name) or args.offline
-        if not args.offline:
-            logger.info('Logging in...')
-            if not self.core.login():
-                logger.error('Login failed, cannot continue!')
-                exit(1)
-
-            if not args.skip_version_check and not self.core.is_noupdate_game(app_name):
-                logger.info('Checking for updates...')
+        timings = dict()
+        preflight_start = time.perf_counter()
+
+        def check_latest_version():
+            _start = time.perf_counter()
+            _latest = self.core.get_asset(app_name, update=True, platform=igame.platform)
+            timings['asset update'] = time.perf_counter() - _start
+            return _latest
+
+        # The asset update check and the launch tokens only depend on being logged in,
+        # so they are run concurrently. Legendary/Overlay update checks run in the background.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            latest_future = None
+            if not args.offline:
+                logger.info('Logging in...')
+                if not self.core.login(background_update_checks=True):
+                    logger.error('Login failed, cannot continue!')
+                    exit(1)
+                timings['login'] = time.perf_counter() - preflight_start
+
+                if not args.skip_version_check and not self.core.is_noupdate_game(app_name):
+                    logger.info('Checking for updates...')
+                    latest_future = executor.submit(check_latest_version)
+
+            _start = time.perf_counter()
+            params = self.core.get_launch_parameters(app_name=app_name, offline=args.offline,
+                                                     extra_args=extra, user=args.user_name_override,
+                                                     wine_bin=args.wine_bin, wine_pfx=args.wine_pfx,
+                                                     language=args.language, wrapper=args.wrapper,
+                                                     disable_wine=args.no_wine,
+                                                     executable_override=args.executable_override,
+                                                     crossover_app=args.crossover_app,
+                                                     crossover_bottle=args.crossover_bottle,
+                                                     addon_app_name=addon_app_name)
+            timings['launch parameters'] = time.perf_counter() - _start
+
+            if latest_future:
                 try:
-                    latest = self.core.get_asset(app_name, update=True, platform=igame.platform)
+                    latest = latest_future.result()
                 except ValueError:
                     logger.fatal(f'Metadata for "{app_name}" does not exist, cannot launch!')
                     exit(1)
@@ -624,15 +711,8 @@ class LegendaryCLI:
                     logger.error('Game is out of date, please update or launch with update check skipping!')
                     exit(1)
 
-        params = self.core.get_launch_parameters(app_name=app_name, offline=args.offline,
-                                                 extra_args=extra, user=args.user_name_override,
-                                                 wine_bin=args.wine_bin, wine_pfx=args.wine_pfx,
-                                                 language=args.language, wrapper=args.wrapper,
-                                                 disable_wine=args.no_wine,
-                                                 executable_override=args.executable_override,
-                                                 crossover_app=args.crossover_app,
-                                                 crossover_bottle=args.crossover_bottle,
-                                                 addon_app_name=addon_app_name)
+        timings['total'] = time.perf_counter() - preflight_start
+        logger.debug('Launch preflight timings: ' + ', '.join(f'{k}: {v * 1000:.0f} ms' for k, v in timings.items()))
 
         if args.set_defaults:
             self.core.lgd.config[app_name] = dict()
@@ -843,6 +923,10 @@ class LegendaryCLI:
         if args.file_prefix or args.file_exclude_prefix:
             args.no_install = True
 
+        if args.seed_path and not os.path.isdir(args.seed_path):
+            logger.error(f'Seed path "{args.seed_path}" does not exist or is not a directory!')
+            exit(1)
+
         if args.update_only:
             if not self.core.is_installed(args.app_name):
                 logger.error(f'Update requested for "{args.app_name}", but app not installed!')
@@ -979,10 +1063,22 @@ class LegendaryCLI:
                                                           override_delta_manifest=args.override_delta_manifest,
                                                           preferred_cdn=args.preferred_cdn,
                                                           disable_https=args.disable_https,
-                                                          bind_ip=args.bind_ip)
+                                                          bind_ip=args.bind_ip,
+                                                          chunk_proxy=args.chunk_proxy,
+                                                          chunk_store=args.chunk_store,
+                                                          populate_chunk_store=args.populate_chunk_store,
+                                                          seed_path=args.seed_path,
+                                                          seed_manifest=args.seed_manifest,
+                                                          verify_seed=args.verify_seed,
+                                                          salvage=args.salvage,
+                                                          salvage_paths=args.salvage_paths,
+                                                          repair_chunks=args.repair_chunks,
+                                                          dedup=not args.no_dedup,
+                                                          dedup_hardlinks=args.dedup_hardlinks)
 
         # game is either up-to-date or hasn't changed, so we have nothing to do
-        if not analysis.dl_size:
+        if not any((analysis.dl_size, analysis.store_size, analysis.seed_size, analysis.salvage_size,
+                    analysis.zero_size)):
             old_igame = self.core.get_installed_game(game.app_name)
             logger.info('Download size is 0, the game is either already up to date or has not changed. Exiting...')
             if old_igame and args.repair_mode and os.path.exists(repair_file):
@@ -1012,11 +1108,29 @@ class LegendaryCLI:
             exit(0)
 
         logger.info(f'Install size: {analysis.install_size / 1024 / 1024:.02f} MiB')
-        compression = (1 - (analysis.dl_size / analysis.uncompressed_dl_size)) * 100
+        if analysis.uncompressed_dl_size:
+            compression = (1 - (analysis.dl_size / analysis.uncompressed_dl_size)) * 100
+        else:
+            compression = 0
         logger.info(f'Download size: {analysis.dl_size / 1024 / 1024:.02f} MiB '
                     f'(Compression savings: {compression:.01f}%)')
         logger.info(f'Reusable size: {analysis.reuse_size / 1024 / 1024:.02f} MiB (chunks) / '
                     f'{analysis.unchanged / 1024 / 1024:.02f} MiB (unchanged / skipped)')
+        if analysis.store_size:
+            logger.info(f'From chunk store: {analysis.store_size / 1024 / 1024:.02f} MiB '
+                        f'({analysis.num_chunks_store} chunks)')
+        if analysis.seed_size:
+            logger.info(f'From seed installation: {analysis.seed_size / 1024 / 1024:.02f} MiB')
+        if analysis.salvage_size:
+            logger.info(f'Salvaged from local files: {analysis.salvage_size / 1024 / 1024:.02f} MiB')
+        if analysis.zero_size:
+            logger.info(f'Zero-filled: {analysis.zero_size / 1024 / 1024:.02f} MiB (not downloaded)')
+        if analysis.dedup_files:
+            logger.info(f'Duplicate files: {analysis.dedup_files} ({analysis.dedup_size / 1024 / 1024:.02f} MiB), '
+                        f'these will be copied instead of written')
+        if analysis.patched_files:
+            logger.info(f'Repairing {analysis.patched_files} file(s) in place, '
+                        f'{analysis.patch_size / 1024 / 1024:.02f} MiB have to be rewritten')
         logger.info('Downloads are resumable, you can interrupt the download with '
                     'CTRL-C and resume it using the same command later on.')
 
@@ -1057,6 +1171,8 @@ class LegendaryCLI:
 
             dlm.start()
             dlm.join()
+            if dlm.chunk_store:
+                dlm.chunk_store.unpin()
         except Exception as e:
             end_t = time.time()
             logger.info(f'Installation failed after {end_t - start_t:.02f} seconds.')
@@ -1382,6 +1498,8 @@ class LegendaryCLI:
         if ratio < 0.95:
             logger.warning('Some files are missing from the game installation, install may not '
                            'match latest Epic Games Store version or might be corrupted.')
+            logger.info(f'Running "legendary repair {args.app_name} --salvage" will reuse as much of the '
+                        f'existing data as possible.')
         else:
             logger.info(f'{"DLC" if game.is_dlc else "Game"} install appears to be complete.')
 
@@ -2585,6 +2703,121 @@ class LegendaryCLI:
             self.core.lgd.config.set(app_name, 'crossover_bottle', args.crossover_bottle)
             logger.info('Saved choices to configuration.')
 
+    def daemon(self, args):
+        from legendary.daemon import LegendaryDaemon, DaemonClient, daemon_supported
+
+        if not daemon_supported():
+            logger.error('The daemon is only supported on systems with Unix domain sockets.')
+            return
+
+        client = DaemonClient(args.socket_path, timeout=5.0)
+        if args.status or args.stop:
+            if not (info := client.ping()):
+                logger.info('No daemon is running.')
+                return
+            if args.stop:
+                client.call('shutdown')
+                logger.info(f'Daemon (PID {info["pid"]}) is shutting down.')
+            else:
+                logger.info(f'Daemon (PID {info["pid"]}, version {info["version"]}) is running, '
+                            f'uptime: {info["uptime"] / 60:.1f} minutes, logged in: {info["logged_in"]}')
+            return
+
+        # log in once up front so the session is ready for the first client
+        try:
+            if not self.core.login():
+                logger.warning('Login failed, commands requiring authentication will fail until you log in.')
+        except ValueError:
+            logger.warning('Not logged in, commands requiring authentication will fail until you log in.')
+
+        try:
+            server = LegendaryDaemon(self, build_parser(), socket_path=args.socket_path)
+        except RuntimeError as e:
+            logger.error(str(e))
+            return
+
+        try:
+            server.serve()
+        except KeyboardInterrupt:
+            logger.info('Shutting down daemon...')
+
+    def serve(self, args):
+        from urllib.parse import urlsplit
+        from legendary.chunk_server import ChunkServer, InstalledChunkSource, ProxyChunkSource, KNOWN_CDN_HOSTS
+        from legendary.lfs.chunk_store import ChunkStore
+
+        if args.proxy and not args.app_names:
+            igames = []
+        elif args.app_names:
+            igames = []
+            for app_name in args.app_names:
+                app_name = self._resolve_aliases(app_name)
+                if not (igame := self.core.get_installed_game(app_name)):
+                    logger.error(f'Game "{app_name}" is not installed, skipping...')
+                    continue
+                igames.append(igame)
+        else:
+            igames = self.core.get_installed_list()
+
+        sources = []
+        for igame in igames:
+            manifest_data, _ = self.core.get_installed_manifest(igame.app_name)
+            if not manifest_data:
+                logger.error(f'Manifest for "{igame.title}" is missing, skipping...')
+                continue
+            manifest = self.core.load_manifest(manifest_data)
+            sources.append(InstalledChunkSource(igame.install_path, manifest))
+            logger.info(f'Serving {len(sources[-1].chunks)} chunks of "{igame.title}" ({igame.app_name}) '
+                        f'version {igame.version}')
+
+        if args.proxy:
+            store_path = args.store_path or os.path.join(self.core.lgd.path, 'chunk_proxy')
+            try:
+                store = ChunkStore(store_path, max_size=args.store_size * 1024 * 1024)
+            except ValueError as e:
+                logger.error(f'Cannot use chunk store for proxying: {e}')
+                return
+            # without a fixed upstream only hosts of known CDNs (including ones games were downloaded from) are used
+            allowed_hosts = set(KNOWN_CDN_HOSTS)
+            for app_name in self.core.lgd.get_game_app_names():
+                if game := self.core.lgd.get_game_meta(app_name):
+                    allowed_hosts.update(urlsplit(url).netloc for url in game.base_urls)
+            sources.append(ProxyChunkSource(store, upstream_url=args.upstream_url,
+                                            upstream_scheme='http' if args.upstream_http else 'https',
+                                            allowed_hosts=allowed_hosts))
+            logger.info(f'Proxying chunks, store "{store_path}" contains {len(store)} chunks '
+                        f'({store.size / 1024 / 1024:.02f} MiB)')
+
+        if not sources:
+            logger.error('Nothing to serve.')
+            return
+
+        try:
+            server = ChunkServer(sources, args.bind_addr, args.port, cache_size=args.cache_size * 1024 * 1024,
+                                 compress=args.compress)
+        except OSError as e:
+            logger.error(f'Starting server failed with {e!r}')
+            return
+
+        usage = f'--chunk-proxy http://<this machine>:{args.port}' if args.proxy and not args.upstream_url \
+            else f'--base-url http://<this machine>:{args.port}'
+        if args.bind_addr in ('127.0.0.1', '::1', 'localhost'):
+            logger.info(f'Listening on http://{args.bind_addr}:{args.port}/ (only reachable from this machine, '
+                        f'use "--bind 0.0.0.0" to make it available on the local network)')
+        else:
+            logger.info(f'Listening on http://{args.bind_addr}:{args.port}/, use it on other machines with '
+                        f'"legendary install <App Name> {usage}"')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info(f'Shutting down, served {server.served} chunks ({server.misses} unavailable).')
+            if args.proxy:
+                proxy = sources[-1]
+                logger.info(f'Proxy fetched {proxy.fetched} chunks ({proxy.fetched_bytes / 1024 / 1024:.02f} MiB) '
+                            f'from upstream, {proxy.hits} requests were served from the store.')
+        finally:
+            server.server_close()
+
     def move(self, args):
         if not self.core.lgd.lock_installed():
             logger.fatal('Failed to acquire installed data lock, only one instance of Legendary may '
@@ -2627,11 +2860,7 @@ class LegendaryCLI:
         logger.info('Finished.')
 
 
-def main():
-    # Set output encoding to UTF-8 if not outputting to a terminal
-    if not stdout.isatty():
-        stdout.reconfigure(encoding='utf-8')
-
+def build_parser():
     parser = argparse.ArgumentParser(description=f'Legendary v{__version__} - "{__codename__}"')
     parser.register('action', 'parsers', HiddenAliasSubparsersAction)
 
@@ -2648,6 +2877,8 @@ def main():
     parser.add_argument('-A', '--api-timeout', dest='api_timeout', action='store',
                         type=float, default=10, metavar='<seconds>',
                         help='API HTTP request timeout (default: 10 seconds)')
+    parser.add_argument('--no-daemon', dest='no_daemon', action='store_true',
+                        help='Do not forward commands to a running legendary daemon')
 
     # all the commands
     subparsers = parser.add_subparsers(title='Commands', dest='subparser_name', metavar='<command>')
@@ -2657,6 +2888,8 @@ def main():
     clean_saves_parser = subparsers.add_parser('clean-saves', help='Clean cloud saves')
     clean_parser = subparsers.add_parser('cleanup', help='Remove old temporary, metadata, and manifest files')
     cx_parser = subparsers.add_parser('crossover', help='Setup CrossOver for launching games (macOS only)')
+    daemon_parser = subparsers.add_parser('daemon', help='Run a background service that keeps legendary '
+                                                          'loaded and logged in for faster commands')
     download_saves_parser = subparsers.add_parser('download-saves', help='Download all cloud saves')
     egl_sync_parser = subparsers.add_parser('egl-sync', help='Setup or run Epic Games Launcher sync')
     eos_overlay_parser = subparsers.add_parser('eos-overlay', help='Manage EOS Overlay install')
@@ -2675,6 +2908,8 @@ def main():
     list_installed_parser = subparsers.add_parser('list-installed', help='List installed games')
     list_saves_parser = subparsers.add_parser('list-saves', help='List available cloud saves')
     move_parser = subparsers.add_parser('move', help='Move specified app name to a new location')
+    serve_parser = subparsers.add_parser('serve', help='Serve chunks of installed games to other machines '
+                                                        'on the local network')
     status_parser = subparsers.add_parser('status', help='Show legendary status information')
     sync_saves_parser = subparsers.add_parser('sync-saves', help='Sync cloud saves')
     uninstall_parser = subparsers.add_parser('uninstall', help='Uninstall (delete) a game')
@@ -2719,6 +2954,8 @@ def main():
 
     move_parser.add_argument('app_name', metavar='<App Name>', help='Name of the app')
     move_parser.add_argument('new_path', metavar='<New Base Path>', help='Directory to move game folder to')
+    serve_parser.add_argument('app_names', nargs='*', metavar='<App Name>',
+                              help='Name(s) of the app(s) to serve (default: all installed games)')
 
     # Flags
     auth_parser.add_argument('--import', dest='import_egs_auth', action='store_true',
@@ -2779,6 +3016,9 @@ def main():
                                 help='Repair installed game by checking and redownloading corrupted/missing files')
     install_parser.add_argument('--repair-and-update', dest='repair_and_update', action='store_true',
                                 help='Update game to the latest version when repairing')
+    install_parser.add_argument('--repair-chunks', dest='repair_chunks', action='store_true',
+                                help='Repair only: Verify the individual chunks of corrupted files and only '
+                                     'download and rewrite the corrupted parts in place')
     install_parser.add_argument('--ignore-free-space', dest='ignore_space', action='store_true',
                                 help='Do not abort if not enough free space is available')
     install_parser.add_argument('--disable-delta-manifests', dest='disable_delta', action='store_true',
@@ -2799,6 +3039,34 @@ def main():
                                 help='Do not ask about installing DLCs.')
     install_parser.add_argument('--bind', dest='bind_ip', action='store', metavar='<IPs>', type=str,
                                 help='Comma-separated list of IPs to bind to for downloading')
+    install_parser.add_argument('--chunk-store', dest='chunk_store', action='store', metavar='<path>',
+                                help='Local chunk store to copy chunks from instead of downloading them')
+    install_parser.add_argument('--populate-chunk-store', dest='populate_chunk_store', action='store_true',
+                                help='Add downloaded chunks to the local chunk store')
+    install_parser.add_argument('--seed-path', dest='seed_path', action='store', metavar='<path>',
+                                help='Copy data from another installation of the game (e.g. a backup or an EGL '
+                                     'install), only data that is missing there will be downloaded')
+    install_parser.add_argument('--seed-manifest', dest='seed_manifest', action='store', metavar='<uri>',
+                                help='Manifest of the seed installation (default: from its ".egstore" folder, '
+                                     'or the same build as the one being installed)')
+    install_parser.add_argument('--verify-seed', dest='verify_seed', action='store_true',
+                                help='Verify whole files of the seed installation up front, instead of checking '
+                                     'each chunk copied from it')
+    install_parser.add_argument('--no-dedup', dest='no_dedup', action='store_true',
+                                help='Write files with identical contents separately instead of copying '
+                                     '(or cloning, if supported by the filesystem) the first one')
+    install_parser.add_argument('--dedup-hardlinks', dest='dedup_hardlinks', action='store_true',
+                                help='Use hardlinks for files with identical contents, saves disk space on '
+                                     'filesystems without copy-on-write support (do not use if you modify game files)')
+    install_parser.add_argument('--salvage', dest='salvage', action='store_true',
+                                help='Search existing files that will be replaced (e.g. when repairing) for data '
+                                     'that can be reused, even if it has been moved within the file '
+                                     '(searching is considerably faster if numpy is installed)')
+    install_parser.add_argument('--salvage-path', dest='salvage_paths', action='append', metavar='<path>',
+                                help='Additional file or directory to search for reusable data (may be specified '
+                                     'multiple times), e.g. an old copy of the game without a manifest')
+    install_parser.add_argument('--chunk-proxy', dest='chunk_proxy', action='store', metavar='<url>',
+                                help='Download chunks through a caching proxy (started with "legendary serve --proxy")')
 
     uninstall_parser.add_argument('--keep-files', dest='keep_files', action='store_true',
                                   help='Keep files but remove game from Legendary database')
@@ -2911,6 +3179,15 @@ def main():
                                    help='Override savegame path (requires single app name to be specified)')
     sync_saves_parser.add_argument('--disable-filters', dest='disable_filters', action='store_true',
                                    help='Disable save game file filtering')
+    sync_saves_parser.add_argument('--incremental', dest='incremental', action='store_true',
+                                   help='Only upload chunks for files that changed since the latest cloud save')
+    sync_saves_parser.add_argument('--content-defined-chunking', dest='content_defined_chunking',
+                                   action='store_true',
+                                   help='Place chunk boundaries based on file contents, so that more chunks '
+                                        'can be reused when files grow or shrink (implies --incremental)')
+    sync_saves_parser.add_argument('--max-parallel', dest='max_parallel', action='store', type=int, default=4,
+                                   metavar='<num>',
+                                   help='Number of games to check and sync concurrently (default: 4)')
     sync_saves_parser.add_argument('--accept-path', dest='accept_path', action='store_true',
                                    help=argparse.SUPPRESS)
 
@@ -3010,48 +3287,45 @@ def main():
     cx_parser.add_argument('--crossover-bottle', dest='crossover_bottle', action='store', metavar='<bottle name>',
                            help='Specify bottle to skip interactive selection')
 
+    daemon_parser.add_argument('--status', dest='status', action='store_true',
+                               help='Check whether a daemon is running and exit')
+    daemon_parser.add_argument('--stop', dest='stop', action='store_true',
+                               help='Stop the running daemon')
+    daemon_parser.add_argument('--socket', dest='socket_path', action='store', metavar='<path>',
+                               help='Socket path to use (default: $XDG_RUNTIME_DIR/legendary-<config hash>.sock, '
+                                    'or daemon.sock in the config directory if XDG_RUNTIME_DIR is not set)')
+
     move_parser.add_argument('--skip-move', dest='skip_move', action='store_true',
                              help='Only change legendary database, do not move files (e.g. if already moved)')
 
-    args, extra = parser.parse_known_args()
-
-    if args.version:
-        print(f'legendary version "{__version__}", codename "{__codename__}"')
-        exit(0)
-
-    if not args.subparser_name or args.full_help:
-        print(parser.format_help())
-
-        if args.full_help:
-            # Commands that should not be shown in full help/list of commands (e.g. aliases)
-            _hidden_commands = {'download', 'update', 'repair', 'get-token',
-                                'import-game', 'verify-game', 'list-games'}
-            # Print the help for all of the subparsers. Thanks stackoverflow!
-            print('Individual command help:')
-            subparsers = next(a for a in parser._actions if isinstance(a, argparse._SubParsersAction))
-            for choice, subparser in subparsers.choices.items():
-                if choice in _hidden_commands:
-                    continue
-                print(f'\nCommand: {choice}')
-                print(subparser.format_help())
-        elif os.name == 'nt':
-            from legendary.lfs.windows_helpers import double_clicked
-            if double_clicked():
-                print('Please note that this is not the intended way to run Legendary.')
-                print('Follow https://github.com/derrod/legendary/wiki/Setup-Instructions to set it up properly')
-                subprocess.Popen(['cmd', '/K', 'echo>nul'])
-        return
-
-    cli = LegendaryCLI(override_config=args.config_file, api_timeout=args.api_timeout)
-    ql = cli.setup_threaded_logging()
-
-    config_ll = cli.core.lgd.config.get('Legendary', 'log_level', fallback='info')
-    if config_ll == 'debug' or args.debug:
-        logging.getLogger().setLevel(level=logging.DEBUG)
-        # keep requests quiet
-        logging.getLogger('requests').setLevel(logging.WARNING)
-        logging.getLogger('urllib3').setLevel(logging.WARNING)
-
+    serve_parser.add_argument('--bind', dest='bind_addr', action='store', metavar='<address>', default='127.0.0.1',
+                              help='Address to listen on (default: 127.0.0.1, i.e. only this machine; '
+                                   'use 0.0.0.0 to serve other machines on the network)')
+    serve_parser.add_argument('--port', dest='port', action='store', metavar='<port>', type=int, default=8080,
+                              help='Port to listen on (default: 8080)')
+    serve_parser.add_argument('--cache-size', dest='cache_size', action='store', metavar='<size>', type=int,
+                              default=256, help='Size of the in-memory cache for recently served chunks '
+                                                'in MiB (default: 256)')
+    serve_parser.add_argument('--compress', dest='compress', action='store_true',
+                              help='Compress served chunks (saves bandwidth at the cost of CPU time)')
+    serve_parser.add_argument('--proxy', dest='proxy', action='store_true',
+                              help='Fetch chunks that are not available locally from the CDN and keep them in an '
+                                   'on-disk store (use with "install --chunk-proxy http://<this machine>:<port>")')
+    serve_parser.add_argument('--store-path', dest='store_path', action='store', metavar='<path>',
+                              help='Directory for the proxy\'s chunk store (default: <config dir>/chunk_proxy)')
+    serve_parser.add_argument('--store-size', dest='store_size', action='store', metavar='<size>', type=int,
+                              default=20480, help='Maximum size of the proxy\'s chunk store in MiB, least recently '
+                                                  'used chunks are removed when it is full (default: 20480)')
+    serve_parser.add_argument('--upstream', dest='upstream_url', action='store', metavar='<url>',
+                              help='Fixed upstream base URL for the proxy, requests are relative to it instead of '
+                                   'starting with the CDN hostname (which must be a known Epic CDN)')
+    serve_parser.add_argument('--upstream-http', dest='upstream_http', action='store_true',
+                              help='Fetch from the CDN via plaintext HTTP (e.g. for use with a lan cache)')
+
+    return parser
+
+
+def run_command(cli, args, extra):
     if hasattr(args, 'platform'):
         if not args.platform:
             os_default = 'Mac' if sys_platform == 'darwin' else 'Windows'
@@ -3113,9 +3387,67 @@ def main():
             cli.crossover_setup(args)
         elif args.subparser_name == 'move':
             cli.move(args)
+        elif args.subparser_name == 'daemon':
+            cli.daemon(args)
+        elif args.subparser_name == 'serve':
+            cli.serve(args)
     except KeyboardInterrupt:
         logger.info('Command was aborted via KeyboardInterrupt, cleaning up...')
 
+
+def main():
+    # Set output encoding to UTF-8 if not outputting to a terminal
+    if not stdout.isatty():
+        stdout.reconfigure(encoding='utf-8')
+
+    parser = build_parser()
+    args, extra = parser.parse_known_args()
+
+    if args.version:
+        print(f'legendary version "{__version__}", codename "{__codename__}"')
+        exit(0)
+
+    if not args.subparser_name or args.full_help:
+        print(parser.format_help())
+
+        if args.full_help:
+            # Commands that should not be shown in full help/list of commands (e.g. aliases)
+            _hidden_commands = {'download', 'update', 'repair', 'get-token',
+                                'import-game', 'verify-game', 'list-games'}
+            # Print the help for all of the subparsers. Thanks stackoverflow!
+            print('Individual command help:')
+            subparsers = next(a for a in parser._actions if isinstance(a, argparse._SubParsersAction))
+            for choice, subparser in subparsers.choices.items():
+                if choice in _hidden_commands:
+                    continue
+                print(f'\nCommand: {choice}')
+                print(subparser.format_help())
+        elif os.name == 'nt':
+            from legendary.lfs.windows_helpers import double_clicked
+            if double_clicked():
+                print('Please note that this is not the intended way to run Legendary.')
+                print('Follow https://github.com/derrod/legendary/wiki/Setup-Instructions to set it up properly')
+                subprocess.Popen(['cmd', '/K', 'echo>nul'])
+        return
+
+    # thin client mode: let an already running daemon handle simple commands
+    if not args.no_daemon and not args.config_file and not args.debug:
+        from legendary.daemon import forward_command
+        if (exit_code := forward_command(sys.argv[1:], args.subparser_name)) is not None:
+            exit(exit_code)
+
+    cli = LegendaryCLI(override_config=args.config_file, api_timeout=args.api_timeout)
+    ql = cli.setup_threaded_logging()
+
+    config_ll = cli.core.lgd.config.get('Legendary', 'log_level', fallback='info')
+    if config_ll == 'debug' or args.debug:
+        logging.getLogger().setLevel(level=logging.DEBUG)
+        # keep requests quiet
+        logging.getLogger('requests').setLevel(logging.WARNING)
+        logging.getLogger('urllib3').setLevel(logging.WARNING)
+
+    run_command(cli, args, extra)
+
     # Disable the update message if JSON/TSV/CSV outputs are used
     disable_update_message = False
     if hasattr(args, 'json'):
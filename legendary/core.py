@@ -5,26 +5,24 @@ import shlex
 import shutil
 
 from base64 import b64decode
-from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import timezone
 from hashlib import sha1
 from locale import getdefaultlocale
 from multiprocessing import Queue
 from platform import system
-from requests import session
-from requests.exceptions import HTTPError, ConnectionError
 from sys import platform as sys_platform
+from threading import Thread
+from time import perf_counter, sleep
+from typing import TYPE_CHECKING
 from uuid import uuid4
 from urllib.parse import urlencode, parse_qsl, urlparse
 
 from legendary import __version__
-from legendary.api.egs import EPCAPI
-from legendary.api.lgd import LGDAPI
-from legendary.downloader.mp.manager import DLManager
 from legendary.lfs.egl import EPCLFS
 from legendary.lfs.lgndry import LGDLFS
-from legendary.lfs.utils import clean_filename, delete_folder, delete_filelist, get_dir_size
+from legendary.lfs.utils import clean_filename, delete_folder, delete_filelist, get_dir_size, validate_files
 from legendary.models.downloading import AnalysisResult, ConditionCheckResult
 from legendary.models.egl import EGLManifest
 from legendary.models.exceptions import *
@@ -33,14 +31,20 @@ from legendary.models.json_manifest import JSONManifest
 from legendary.models.manifest import Manifest, ManifestMeta
 from legendary.models.chunk import Chunk
 from legendary.lfs.crossover import *
-from legendary.utils.egl_crypt import decrypt_epic_data
+from legendary.utils.aliasing import TrigramIndex
 from legendary.utils.env import is_windows_mac_or_pyi
 from legendary.lfs.eos import EOSOverlayApp, query_registry_entries
 from legendary.utils.game_workarounds import is_opt_enabled, update_workarounds, get_exe_override
-from legendary.utils.savegame_helper import SaveGameHelper
 from legendary.utils.selective_dl import games as sdl_games
 from legendary.lfs.wine_helpers import read_registry, get_shell_folders, case_insensitive_path_search
 
+# the downloader (shared memory, worker processes), savegame packer and EGL crypto are only
+# needed by a handful of commands, they are imported where used to keep CLI startup fast.
+if TYPE_CHECKING:
+    from legendary.api.egs import EPCAPI
+    from legendary.api.lgd import LGDAPI
+    from legendary.downloader.mp.manager import DLManager
+
 
 # ToDo: instead of true/false return values for success/failure actually raise an exception that the CLI/GUI
 #  can handle to give the user more details. (Not required yet since there's no GUI so log output is fine)
@@ -56,10 +60,13 @@ class LegendaryCore:
 
     def __init__(self, override_config=None, timeout=10.0):
         self.log = logging.getLogger('Core')
-        self.egs = EPCAPI(timeout=timeout)
+        # the API clients (and with them requests) are created on first use, so commands that work
+        # offline, e.g. list-installed or launch --offline, don't have to import them.
+        self._egs = None
+        self._lgdapi = None
+        self._api_timeout = timeout
         self.lgd = LGDLFS(config_file=override_config)
         self.egl = EPCLFS()
-        self.lgdapi = LGDAPI()
 
         # on non-Windows load the programdata path from config
         if os.name != 'nt':
@@ -79,8 +86,6 @@ class LegendaryCore:
             try:
                 self.language_code, self.country_code = locale.split('-' if '-' in locale else '_')
                 self.log.debug(f'Set locale to {self.language_code}-{self.country_code}')
-                # adjust egs api language as well
-                self.egs.language_code, self.egs.country_code = self.language_code, self.country_code
             except Exception as e:
                 self.log.warning(f'Getting locale failed: {e!r}, falling back to using en-US.')
         elif system() != 'Darwin':  # macOS doesn't have a default locale we can query
@@ -91,6 +96,24 @@ class LegendaryCore:
         self.webview_killswitch = False
         self.overlay_update_available = False
         self.logged_in = False
+        self._update_check_thread = None
+        self._alias_index = None
+        # number of savegame chunks to download concurrently
+        self._save_download_window = 8
+
+    @property
+    def egs(self) -> 'EPCAPI':
+        if self._egs is None:
+            from legendary.api.egs import EPCAPI
+            self._egs = EPCAPI(lc=self.language_code, cc=self.country_code, timeout=self._api_timeout)
+        return self._egs
+
+    @property
+    def lgdapi(self) -> 'LGDAPI':
+        if self._lgdapi is None:
+            from legendary.api.lgd import LGDAPI
+            self._lgdapi = LGDAPI()
+        return self._lgdapi
 
     def auth_sid(self, sid) -> str:
         """
@@ -98,6 +121,8 @@ class LegendaryCore:
         :param sid: session id
         :return: exchange code
         """
+        from requests import session
+
         s = session()
         s.headers.update({
             'X-Epic-Event-Action': 'login',
@@ -157,6 +182,7 @@ class LegendaryCore:
         raw_data = b64decode(remember_me_data)
         # data is encrypted
         if raw_data[0] != '{':
+            from legendary.utils.egl_crypt import decrypt_epic_data
             for data_key in self.egl.data_keys:
                 try:
                     decrypted_data = decrypt_epic_data(data_key, raw_data)
@@ -180,12 +206,14 @@ class LegendaryCore:
             self.log.error(f'Logging in failed with {e!r}, please try again.')
             return False
 
-    def _login(self, lock, force_refresh=False) -> bool:
+    def _login(self, lock, force_refresh=False, run_update_checks=True) -> bool:
         """
         Attempts logging in with existing credentials.
 
         raises ValueError if no existing credentials or InvalidCredentialsError if the API return an error
         """
+        from requests.exceptions import HTTPError, ConnectionError
+
         if not lock.data:
             raise ValueError('No saved credentials')
         elif self.logged_in and lock.data['expires_at']:
@@ -199,22 +227,12 @@ class LegendaryCore:
             else:
                 self.logged_in = False
 
-        # run update check
-        if self.update_check_enabled():
-            try:
-                self.check_for_updates()
-            except Exception as e:
-                self.log.warning(f'Checking for Legendary updates failed: {e!r}')
+        if run_update_checks:
+            self.run_update_checks()
         else:
+            # cached config may contain updated client credentials, so it has to be applied before logging in
             self.apply_lgd_config()
 
-        # check for overlay updates
-        if self.is_overlay_installed():
-            try:
-                self.check_for_overlay_updates()
-            except Exception as e:
-                self.log.warning(f'Checking for EOS Overlay updates failed: {e!r}')
-
         if lock.data['expires_at'] and not force_refresh:
             dt_exp = datetime.fromisoformat(lock.data['expires_at'][:-1])
             dt_now = datetime.utcnow()
@@ -249,9 +267,43 @@ class LegendaryCore:
         self.logged_in = True
         return True
 
-    def login(self, force_refresh=False) -> bool:
+    def login(self, force_refresh=False, background_update_checks=False) -> bool:
+        """
+        Log in using stored credentials.
+
+        :param force_refresh: Always get a new session instead of trying to re-use the current one
+        :param background_update_checks: Run Legendary/Overlay update checks in a background thread
+                                         after logging in instead of before (keeps them off the critical path)
+        :return: True if logged in successfully
+        """
         with self.lgd.userdata_lock as lock:
-            return self._login(lock, force_refresh=force_refresh)
+            if not self._login(lock, force_refresh=force_refresh,
+                               run_update_checks=not background_update_checks):
+                return False
+
+        if background_update_checks and not self._update_check_thread:
+            # config is not re-applied here, new API parameters will be used on the next run
+            self._update_check_thread = Thread(target=self.run_update_checks, kwargs=dict(apply_config=False),
+                                               daemon=True)
+            self._update_check_thread.start()
+        return True
+
+    def run_update_checks(self, apply_config=True):
+        # run update check
+        if self.update_check_enabled():
+            try:
+                self.check_for_updates(apply_config=apply_config)
+            except Exception as e:
+                self.log.warning(f'Checking for Legendary updates failed: {e!r}')
+        elif apply_config:
+            self.apply_lgd_config()
+
+        # check for overlay updates
+        if self.is_overlay_installed():
+            try:
+                self.check_for_overlay_updates()
+            except Exception as e:
+                self.log.warning(f'Checking for EOS Overlay updates failed: {e!r}')
 
     def update_check_enabled(self):
         return not self.lgd.config.getboolean('Legendary', 'disable_update_check', fallback=False)
@@ -262,7 +314,7 @@ class LegendaryCore:
         return not self.lgd.config.getboolean('Legendary', 'disable_update_notice',
                                               fallback=not is_windows_mac_or_pyi())
 
-    def check_for_updates(self, force=False):
+    def check_for_updates(self, force=False, apply_config=True):
         def version_tuple(v):
             return tuple(map(int, (v.split('.'))))
 
@@ -274,7 +326,8 @@ class LegendaryCore:
 
         web_version = version_info['release_info']['version']
         self.update_available = version_tuple(web_version) > version_tuple(__version__)
-        self.apply_lgd_config(version_info)
+        if apply_config:
+            self.apply_lgd_config(version_info)
 
     def apply_lgd_config(self, version_info=None):
         """Applies configuration options returned by update API"""
@@ -343,12 +396,31 @@ class LegendaryCore:
         _aliases_enabled = not self.lgd.config.getboolean('Legendary', 'disable_auto_aliasing', fallback=False)
         if _aliases_enabled and (force or not self.lgd.aliases):
             self.lgd.generate_aliases()
+            self._alias_index = None
+
+    def get_alias_suggestions(self, name, limit=5) -> List[tuple]:
+        """
+        Fuzzy search for app names and aliases similar to name
+
+        :param name: name that could not be resolved
+        :param limit: maximum number of suggestions
+        :return: list of tuples in format (app name, matched name, score), best match first
+        """
+        if self._alias_index is None:
+            names = dict(self.lgd.aliases)
+            names.update((app_name.lower(), app_name) for app_name in self.lgd.get_game_app_names())
+            if self.lgd.config.has_section('Legendary.aliases'):
+                names.update((alias.lower(), app_name)
+                             for alias, app_name in self.lgd.config['Legendary.aliases'].items())
+            self._alias_index = TrigramIndex(names)
+
+        return self._alias_index.search(name, limit=limit)
 
     def get_assets(self, update_assets=False, platform='Windows') -> List[GameAsset]:
         # do not save and always fetch list when platform is overridden
         if not self.lgd.assets or update_assets or platform not in self.lgd.assets:
-            # if not logged in, return empty list
-            if not self.egs.user:
+            # if not logged in, return empty list (the API client only exists once something needed it)
+            if self._egs is None or not self.egs.user:
                 return []
 
             assets = self.lgd.assets.copy() if self.lgd.assets else dict()
@@ -366,6 +438,43 @@ class LegendaryCore:
 
         return self.lgd.assets[platform]
 
+    def update_assets(self, platforms) -> None:
+        """
+        Fetch assets for multiple platforms concurrently and save them in one go
+
+        :param platforms: platforms to fetch assets for
+        """
+        # if not logged in, do nothing
+        if not self.egs.user or not platforms:
+            return
+
+        platforms = sorted(platforms)
+        with ThreadPoolExecutor(max_workers=len(platforms)) as executor:
+            results = list(executor.map(lambda p: self.egs.get_game_assets(platform=p), platforms))
+
+        assets = self.lgd.assets.copy() if self.lgd.assets else dict()
+        for platform, platform_assets in zip(platforms, results):
+            assets[platform] = [GameAsset.from_egs_json(a) for a in platform_assets]
+
+        # only save (and write to disk) if there were changes
+        if self.lgd.assets != assets:
+            self.lgd.assets = assets
+
+    def get_available_versions(self, games: List[InstalledGame]) -> Dict[str, str]:
+        """
+        Look up the latest available build version for installed games in a single pass
+
+        :param games: installed games to look up
+        :return: dict mapping app names to available build version, games without assets are omitted
+        """
+        if missing_platforms := {g.platform for g in games} - set(self.lgd.assets or ()):
+            self.update_assets(missing_platforms)
+
+        latest = {platform: {a.app_name: a.build_version for a in platform_assets}
+                  for platform, platform_assets in (self.lgd.assets or dict()).items()}
+        return {game.app_name: version for game in games
+                if (version := latest.get(game.platform, {}).get(game.app_name)) is not None}
+
     def get_asset(self, app_name, platform='Windows', update=False) -> GameAsset:
         if update or platform not in self.lgd.assets:
             self.get_assets(update_assets=True, platform=platform)
@@ -762,9 +871,19 @@ class LegendaryCore:
                                  f'input: {install.launch_parameters}')
 
         game_token = ''
+        ovt = None
         if not offline:
-            self.log.info('Getting authentication token...')
-            game_token = self.egs.get_game_token()['code']
+            # the exchange code and ownership token are independent, so fetch them concurrently
+            t_start = perf_counter()
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                self.log.info('Getting authentication token...')
+                token_future = executor.submit(self.egs.get_game_token)
+                if install.requires_ot:
+                    self.log.info('Getting ownership token.')
+                    ovt_future = executor.submit(self.egs.get_ownership_token, game.namespace, game.catalog_item_id)
+                    ovt = ovt_future.result()
+                game_token = token_future.result()['code']
+            self.log.debug(f'Fetching launch tokens took {(perf_counter() - t_start) * 1000:.0f} ms')
         elif not install.can_run_offline:
             self.log.warning('Game is not approved for offline use and may not work correctly.')
 
@@ -778,9 +897,7 @@ class LegendaryCore:
             f'-epicapp={app_name}',
             '-epicenv=Prod'])
 
-        if install.requires_ot and not offline:
-            self.log.info('Getting ownership token.')
-            ovt = self.egs.get_ownership_token(game.namespace, game.catalog_item_id)
+        if ovt is not None:
             ovt_path = os.path.join(self.lgd.get_tmp_path(), f'{game.namespace}{game.catalog_item_id}.ovt')
             with open(ovt_path, 'wb') as f:
                 f.write(ovt)
@@ -838,7 +955,8 @@ class LegendaryCore:
                 continue
             f_parts = fname.split('/')
             _saves.append(SaveGameFile(app_name=f_parts[2], filename=fname, manifest_name=f_parts[4],
-                                       datetime=datetime.fromisoformat(f['lastModified'][:-1])))
+                                       datetime=datetime.fromisoformat(f['lastModified'][:-1]),
+                                       read_link=f.get('readLink')))
 
         return _saves
 
@@ -962,11 +1080,13 @@ class LegendaryCore:
         return absolute_path
 
     def check_savegame_state(self, path: str, save: SaveGameFile) -> (SaveGameStatus, (datetime, datetime)):
-        latest = 0
+        # the directory is only walked once, the results are used for the timestamps and the file comparison
+        local_files = dict()
         for _dir, _, _files in os.walk(path):
             for _file in _files:
-                s = os.stat(os.path.join(_dir, _file))
-                latest = max(latest, s.st_mtime)
+                file_path = os.path.join(_dir, _file)
+                local_files[os.path.relpath(file_path, path).replace('\\', '/')] = os.stat(file_path)
+        latest = max((st.st_mtime for st in local_files.values()), default=0)
 
         if not latest and not save:
             return SaveGameStatus.NO_SAVE, (None, None)
@@ -982,8 +1102,17 @@ class LegendaryCore:
 
         self.log.debug(f'Local save date: {str(dt_local)}, Remote save date: {str(dt_remote)}')
 
-        # Ideally we check the files themselves based on manifest,
-        # this is mostly a guess but should be accurate enough.
+        # Compare the files themselves against the remote manifest if possible,
+        # timestamps are then only used to determine which side is newer.
+        if (identical := self._save_matches_remote(path, save, local_files)) is not None:
+            if identical:
+                return SaveGameStatus.SAME_AGE, (dt_local, dt_remote)
+            elif dt_local > dt_remote:
+                return SaveGameStatus.LOCAL_NEWER, (dt_local, dt_remote)
+            else:
+                return SaveGameStatus.REMOTE_NEWER, (dt_local, dt_remote)
+
+        # Otherwise fall back to timestamps only, this is mostly a guess but should be accurate enough.
         if abs((dt_local - dt_remote).total_seconds()) < 60:
             return SaveGameStatus.SAME_AGE, (dt_local, dt_remote)
         elif dt_local > dt_remote:
@@ -991,8 +1120,96 @@ class LegendaryCore:
         else:
             return SaveGameStatus.REMOTE_NEWER, (dt_local, dt_remote)
 
+    def get_save_filters(self, app_name):
+        """
+        Get cloud save file inclusion and exclusion filters for an app
+
+        :return: tuple of include and exclude pattern lists (or None if not set)
+        """
+        game = self.lgd.get_game_meta(app_name)
+        custom_attr = game.metadata['customAttributes']
+        include_f = exclude_f = None
+        if (_include := custom_attr.get('CloudIncludeList', {}).get('value', None)) is not None:
+            include_f = _include.split(',')
+        if (_exclude := custom_attr.get('CloudExcludeList', {}).get('value', None)) is not None:
+            exclude_f = _exclude.split(',')
+        return include_f, exclude_f
+
+    def _save_matches_remote(self, path, save: SaveGameFile, local_files: dict):
+        """
+        Compare local save files against the files in the remote save manifest.
+        Local hashes and the remote file list are cached in the save index, so files are only
+        hashed again if their size or mtime changed, and the manifest is only fetched once.
+
+        :param path: save directory
+        :param save: remote save
+        :param local_files: relative path -> os.stat_result of the files in the save directory
+        :return: True if the files are identical, False if not, None if the comparison failed
+        """
+        from legendary.utils.savegame_helper import SaveGameHelper, get_file_sha1
+
+        index = self.lgd.get_save_index(save.app_name) or dict()
+        remote = index.get('remote', {})
+        if remote.get('manifest') != save.manifest_name:
+            if not save.read_link:
+                return None
+            try:
+                r = self.egs.unauth_session.get(save.read_link, timeout=self.egs.request_timeout)
+                r.raise_for_status()
+                manifest = self.load_manifest(r.content)
+            except Exception as e:
+                self.log.warning(f'Fetching remote save manifest failed with {e!r}, comparing timestamps only.')
+                return None
+            remote = dict(manifest=save.manifest_name,
+                          files={fm.filename: fm.hash.hex() for fm in manifest.file_manifest_list.elements})
+
+        include_f, exclude_f = self.get_save_filters(save.app_name)
+        cached = index.get('local', {})
+        local = dict()
+        for filename in SaveGameHelper().filter_files(local_files, include_f, exclude_f):
+            file_path = os.path.join(path, filename)
+            st = local_files[filename]
+            if (entry := cached.get(filename)) and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                local[filename] = entry
+            else:
+                self.log.debug(f'Hashing changed save file "{filename}"')
+                local[filename] = [st.st_size, st.st_mtime_ns, get_file_sha1(file_path).hex()]
+
+        self.lgd.set_save_index(save.app_name, dict(local=local, remote=remote))
+        return {fn: entry[2] for fn, entry in local.items()} == remote['files']
+
+    def get_latest_save_manifest(self, app_name):
+        """
+        Fetch the newest savegame manifest for an app from the cloud save service
+
+        :param app_name: app name
+        :return: tuple of Manifest (or None) and set of chunk paths (as in ChunkInfo.path) that exist remotely
+        """
+        files = self.egs.get_user_cloud_saves(app_name=app_name)['files']
+        # manifest names are timestamps, so the last one is the newest
+        if not (manifests := sorted(fname for fname in files if fname.endswith('.manifest'))):
+            return None, set()
+
+        fname = manifests[-1]
+        r = self.egs.unauth_session.get(files[fname]['readLink'], timeout=self.egs.request_timeout)
+        if r.status_code != 200 or not r.content:
+            self.log.warning(f'Downloading previous save manifest failed (status {r.status_code}), '
+                             f'uploading full save.')
+            return None, set()
+
+        prefix = '/'.join(fname.split('/', 3)[:3]) + '/'
+        remote_chunks = {path[len(prefix):] for path in files
+                         if path.startswith(prefix) and not path.endswith('.manifest')}
+        return self.load_manifest(r.content), remote_chunks
+
     def upload_save(self, app_name, save_dir, local_dt: datetime = None,
-                    disable_filtering: bool = False):
+                    disable_filtering: bool = False, incremental: bool = False,
+                    content_defined_chunking: bool = False) -> bool:
+        """
+        Package and upload the savegame in save_dir
+
+        :return: True if the save was uploaded (or there was nothing to upload), False if uploading failed
+        """
         game = self.lgd.get_game_meta(app_name)
         custom_attr = game.metadata['customAttributes']
         save_path = custom_attr.get('CloudSaveFolder', {}).get('value')
@@ -1000,33 +1217,73 @@ class LegendaryCore:
 
         include_f = exclude_f = None
         if not disable_filtering:
-            # get file inclusion and exclusion filters if they exist
-            if (_include := custom_attr.get('CloudIncludeList', {}).get('value', None)) is not None:
-                include_f = _include.split(',')
-            if (_exclude := custom_attr.get('CloudExcludeList', {}).get('value', None)) is not None:
-                exclude_f = _exclude.split(',')
+            include_f, exclude_f = self.get_save_filters(app_name)
 
         if not save_path and not save_path_mac:
             raise ValueError('Game does not support cloud saves')
 
+        previous_manifest = remote_chunks = None
+        # content-defined chunking is only useful if chunks of the previous save can be reused
+        if incremental or content_defined_chunking:
+            self.log.info('Fetching latest cloud save manifest for incremental upload...')
+            previous_manifest, remote_chunks = self.get_latest_save_manifest(app_name)
+
+        from legendary.utils.savegame_helper import SaveGameHelper
         sgh = SaveGameHelper()
         files = sgh.package_savegame(save_dir, app_name, self.egs.user.get('account_id'),
-                                     save_path, save_path_mac, include_f, exclude_f, local_dt)
+                                     save_path, save_path_mac, include_f, exclude_f, local_dt,
+                                     previous_manifest=previous_manifest, previous_chunks=remote_chunks,
+                                     content_defined_chunking=content_defined_chunking)
 
         if not files:
             self.log.info('No files to upload. If you believe this is incorrect run command with "--disable-filters"')
-            return
+            return True
 
         self.log.debug(f'Packed files: {str(files)}, creating cloud files...')
         resp = self.egs.create_game_cloud_saves(app_name, list(files.keys()))
 
-        self.log.info('Starting upload...')
-        for remote_path, file_info in resp['files'].items():
-            self.log.debug(f'Uploading "{remote_path}"')
-            f = files.get(remote_path)
-            self.egs.unauth_session.put(file_info['writeLink'], data=f.read())
+        # Upload chunks concurrently, the manifest is only uploaded once all chunks are there
+        # so that an interrupted upload never results in a broken save being visible.
+        chunk_uploads = {path: info for path, info in resp['files'].items() if not path.endswith('.manifest')}
+        manifest_uploads = {path: info for path, info in resp['files'].items() if path.endswith('.manifest')}
+
+        self.log.info(f'Starting upload of {len(chunk_uploads)} chunk(s)...')
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {executor.submit(self._upload_save_file, path, info['writeLink'], files[path]): path
+                       for path, info in chunk_uploads.items()}
+            failed = [futures[future] for future in as_completed(futures) if not future.result()]
 
+        if failed:
+            self.log.error(f'Uploading {len(failed)} chunk(s) failed, not uploading manifest. '
+                           f'Please try again later.')
+        else:
+            for path, info in manifest_uploads.items():
+                if not self._upload_save_file(path, info['writeLink'], files[path]):
+                    failed.append(path)
+
+        for f in files.values():
+            f.close()
+
+        if failed:
+            return False
         self.log.info('Finished uploading savegame.')
+        return True
+
+    def _upload_save_file(self, remote_path, write_link, f, max_retries=3) -> bool:
+        """Upload a single savegame file, the request body is streamed from the (temporary) file object"""
+        for attempt in range(max_retries):
+            if attempt:
+                sleep(2 ** attempt)
+            self.log.debug(f'Uploading "{remote_path}"')
+            try:
+                f.seek(0)
+                r = self.egs.unauth_session.put(write_link, data=f, timeout=self.egs.request_timeout)
+                r.raise_for_status()
+                return True
+            except Exception as e:
+                self.log.warning(f'Uploading "{remote_path}" failed with {e!r}'
+                                 + (', retrying...' if attempt + 1 < max_retries else ''))
+        return False
 
     def download_saves(self, app_name='', manifest_name='', save_dir='', clean_dir=False):
         save_path = os.path.join(self.get_default_install_dir(), '.saves')
@@ -1049,17 +1306,11 @@ class LegendaryCore:
                     os.makedirs(_save_dir)
 
             if app_name and clean_dir:
-                game = self.lgd.get_game_meta(app_name)
-                custom_attr = game.metadata['customAttributes']
-                include_f = exclude_f = None
-
                 # Make sure to only delete files that match the include/exclude filters.
                 # This is particularly import for games that store save games in their install dir...
-                if (_include := custom_attr.get('CloudIncludeList', {}).get('value', None)) is not None:
-                    include_f = _include.split(',')
-                if (_exclude := custom_attr.get('CloudExcludeList', {}).get('value', None)) is not None:
-                    exclude_f = _exclude.split(',')
+                include_f, exclude_f = self.get_save_filters(app_name)
 
+                from legendary.utils.savegame_helper import SaveGameHelper
                 sgh = SaveGameHelper()
                 save_files = sgh.get_deletion_list(_save_dir, include_f, exclude_f)
                 self.log.info('Deleting old save files...')
@@ -1078,8 +1329,8 @@ class LegendaryCore:
 
             m = self.load_manifest(r.content)
 
-            # download chunks required for extraction
-            chunks = dict()
+            # map chunks to their remote paths
+            chunk_files = dict()
             for chunk in m.chunk_data_list.elements:
                 cpath_p = fname.split('/', 3)[:3]
                 cpath_p.append(chunk.path)
@@ -1087,16 +1338,9 @@ class LegendaryCore:
                 if cpath not in files:
                     self.log.warning(f'Chunk {cpath} not in file list, save data may be incomplete!')
                     continue
+                chunk_files[chunk.guid_num] = (cpath, files[cpath]['readLink'])
 
-                self.log.debug(f'Downloading chunk "{cpath}"')
-                r = self.egs.unauth_session.get(files[cpath]['readLink'])
-                if r.status_code != 200:
-                    self.log.error(f'Download failed, status code: {r.status_code}')
-                    break
-                c = Chunk.read_buffer(r.content)
-                chunks[c.guid_num] = c.data
-
-            if not chunks:
+            if not chunk_files:
                 if manifest_name:
                     self.log.fatal(f'No chunks were available, aborting. Try running '
                                    f'"legendary clean-saves {app_name}" and try again.')
@@ -1106,29 +1350,74 @@ class LegendaryCore:
                                    f'to remove this broken save from your account.')
                     continue
 
-            for fm in m.file_manifest_list.elements:
-                dirs, fname = os.path.split(fm.filename)
-                fdir = os.path.join(_save_dir, dirs)
-                fpath = os.path.join(fdir, fname)
-                if not os.path.exists(fdir):
-                    os.makedirs(fdir)
-
-                self.log.debug(f'Writing "{fpath}"...')
-                with open(fpath, 'wb') as fh:
-                    for cp in fm.chunk_parts:
-                        if cp.guid_num not in chunks:
-                            self.log.error(f'Chunk part for {fname} is missing, file may be corrupted!')
-                        else:
-                            fh.write(chunks[cp.guid_num][cp.offset:cp.offset + cp.size])
-
-                # set modified time to savegame creation timestamp
-                m_date = datetime.strptime(f_parts[4], '%Y.%m.%d-%H.%M.%S.manifest')
-                m_date = m_date.replace(tzinfo=timezone.utc).astimezone(self.local_timezone)
-                os.utime(fpath, (m_date.timestamp(), m_date.timestamp()))
+            refcounts = Counter(cp.guid_num for fm in m.file_manifest_list.elements for cp in fm.chunk_parts)
+            # chunks are downloaded in the order they are first needed
+            pending = deque(g for g in dict.fromkeys(cp.guid_num for fm in m.file_manifest_list.elements
+                                                     for cp in fm.chunk_parts) if g in chunk_files)
+            in_flight = dict()
+            chunks = dict()
+
+            def get_chunk_data(guid_num):
+                # keep the download window filled
+                while pending and len(in_flight) < self._save_download_window:
+                    _guid_num = pending.popleft()
+                    in_flight[_guid_num] = executor.submit(self._download_save_chunk, *chunk_files[_guid_num])
+                if guid_num in in_flight:
+                    chunks[guid_num] = in_flight.pop(guid_num).result()
+                return chunks.get(guid_num)
+
+            # files are written as soon as the chunks they need have arrived,
+            # chunks are dropped once no remaining file part references them.
+            with ThreadPoolExecutor(max_workers=self._save_download_window) as executor:
+                for fm in m.file_manifest_list.elements:
+                    dirs, fname = os.path.split(fm.filename)
+                    fdir = os.path.join(_save_dir, dirs)
+                    fpath = os.path.join(fdir, fname)
+                    if not os.path.exists(fdir):
+                        os.makedirs(fdir)
+
+                    self.log.debug(f'Writing "{fpath}"...')
+                    with open(fpath, 'wb') as fh:
+                        for cp in fm.chunk_parts:
+                            if (chunk_data := get_chunk_data(cp.guid_num)) is None:
+                                self.log.error(f'Chunk part for {fname} is missing, file may be corrupted!')
+                            else:
+                                fh.write(memoryview(chunk_data)[cp.offset:cp.offset + cp.size])
+
+                            refcounts[cp.guid_num] -= 1
+                            if not refcounts[cp.guid_num]:
+                                chunks.pop(cp.guid_num, None)
+
+                    # set modified time to savegame creation timestamp
+                    m_date = datetime.strptime(f_parts[4], '%Y.%m.%d-%H.%M.%S.manifest')
+                    m_date = m_date.replace(tzinfo=timezone.utc).astimezone(self.local_timezone)
+                    os.utime(fpath, (m_date.timestamp(), m_date.timestamp()))
 
         self.log.info('Successfully completed savegame download.')
 
-    def clean_saves(self, app_name='', delete_incomplete=False):
+    def _download_save_chunk(self, remote_path, read_link):
+        """Download and decompress a single savegame chunk, returns None on failure"""
+        self.log.debug(f'Downloading chunk "{remote_path}"')
+        try:
+            r = self.egs.unauth_session.get(read_link, timeout=self.egs.request_timeout)
+            if r.status_code != 200:
+                self.log.error(f'Download failed, status code: {r.status_code}')
+                return None
+            return Chunk.read_buffer(r.content).data
+        except Exception as e:
+            self.log.error(f'Downloading chunk "{remote_path}" failed with {e!r}')
+            return None
+
+    def _fetch_save_chunk_list(self, read_link):
+        """
+        Downloads a save manifest and returns the HTTP status code and its chunk list (if any)
+        """
+        r = self.egs.unauth_session.get(read_link, timeout=self.egs.request_timeout)
+        if r.status_code != 200 or not r.content:
+            return r.status_code, None
+        return r.status_code, self.load_manifest_chunk_list(r.content).chunk_data_list
+
+    def clean_saves(self, app_name='', delete_incomplete=False, max_workers=8):
         savegames = self.egs.get_user_cloud_saves(app_name=app_name)
         files = savegames['files']
         deletion_list = []
@@ -1136,53 +1425,55 @@ class LegendaryCore:
         do_not_delete = set()
 
         # check if all chunks for manifests are there
-        for fname, f in files.items():
-            if '.manifest' not in fname:
-                continue
+        manifests = [(fname, f) for fname, f in files.items() if '.manifest' in fname]
+        self.log.info(f'Checking {len(manifests)} save manifest(s)...')
 
-            app_name = fname.split('/', 3)[2]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(self._fetch_save_chunk_list, f['readLink']): fname
+                       for fname, f in manifests}
 
-            self.log.info(f'Checking {app_name} "{fname.split("/", 2)[2]}"...')
-            # download manifest
-            r = self.egs.unauth_session.get(f['readLink'])
+            for num, future in enumerate(as_completed(futures), start=1):
+                fname = futures[future]
+                app_name = fname.split('/', 3)[2]
+                self.log.info(f'[{num}/{len(futures)}] Checking {app_name} "{fname.split("/", 2)[2]}"...')
 
-            if r.status_code == 404:
-                self.log.error('Manifest is missing! Marking for deletion.')
-                deletion_list.append(fname)
-                continue
-            elif r.status_code != 200:
-                self.log.warning(f'Download failed, status code: {r.status_code}. Skipping...')
-                do_not_delete.add(app_name)
-                continue
+                try:
+                    status_code, cdl = future.result()
+                except Exception as e:
+                    self.log.warning(f'Download failed with {e!r}. Skipping...')
+                    do_not_delete.add(app_name)
+                    continue
 
-            if not r.content:
-                self.log.error('Manifest is empty! Marking for deletion.')
-                deletion_list.append(fname)
-                continue
+                if status_code == 404:
+                    self.log.error('Manifest is missing! Marking for deletion.')
+                    deletion_list.append(fname)
+                    continue
+                elif status_code != 200:
+                    self.log.warning(f'Download failed, status code: {status_code}. Skipping...')
+                    do_not_delete.add(app_name)
+                    continue
+                elif cdl is None:
+                    self.log.error('Manifest is empty! Marking for deletion.')
+                    deletion_list.append(fname)
+                    continue
 
-            m = self.load_manifest(r.content)
-            # check if all required chunks are present
-            chunk_fnames = set()
-            missing_chunks = 0
-            total_chunks = m.chunk_data_list.count
-            for chunk in m.chunk_data_list.elements:
-                cpath_p = fname.split('/', 3)[:3]
-                cpath_p.append(chunk.path)
-                cpath = '/'.join(cpath_p)
-                chunk_fnames.add(cpath)
-                if cpath not in files:
-                    missing_chunks += 1
+                # check if all required chunks are present
+                cpath_p = '/'.join(fname.split('/', 3)[:3])
+                chunk_paths = [f'{cpath_p}/{chunk.path}' for chunk in cdl.elements]
+                chunk_fnames = set(chunk_paths)
+                missing_chunks = sum(cpath not in files for cpath in chunk_paths)
+                total_chunks = len(chunk_paths)
 
-            if (0 < missing_chunks < total_chunks and delete_incomplete) or missing_chunks == total_chunks:
-                self.log.error('Chunk(s) missing, marking manifest for deletion.')
-                deletion_list.append(fname)
-                continue
-            elif 0 < missing_chunks < total_chunks:
-                self.log.error(f'Some chunk(s) missing, optionally run "legendary download-saves" to obtain a backup '
-                               f'of the corrupted save, then re-run this command with "--delete-incomplete" to remove '
-                               f'it from the cloud save service.')
+                if (0 < missing_chunks < total_chunks and delete_incomplete) or missing_chunks == total_chunks:
+                    self.log.error('Chunk(s) missing, marking manifest for deletion.')
+                    deletion_list.append(fname)
+                    continue
+                elif 0 < missing_chunks < total_chunks:
+                    self.log.error(f'Some chunk(s) missing, optionally run "legendary download-saves" to obtain a '
+                                   f'backup of the corrupted save, then re-run this command with '
+                                   f'"--delete-incomplete" to remove it from the cloud save service.')
 
-            used_chunks |= chunk_fnames
+                used_chunks |= chunk_fnames
 
         # check for orphaned chunks (not used in any manifests)
         for fname, f in files.items():
@@ -1195,11 +1486,26 @@ class LegendaryCore:
             deletion_list.append(fname)
 
         if deletion_list:
-            self.log.info('Deleting unused/broken files...')
-            for fname in deletion_list:
-                self.log.debug(f'Deleting {fname}')
-                self.egs.delete_game_cloud_save_file(fname)
-            self.log.info(f'Deleted {len(deletion_list)} files.')
+            self.log.info(f'Deleting {len(deletion_list)} unused/broken files...')
+            deleted = 0
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(self.egs.delete_game_cloud_save_file, fname): fname
+                           for fname in deletion_list}
+
+                for num, future in enumerate(as_completed(futures), start=1):
+                    fname = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        self.log.error(f'Deleting {fname} failed with {e!r}')
+                    else:
+                        self.log.debug(f'Deleted {fname}')
+                        deleted += 1
+
+                    if num % 50 == 0:
+                        self.log.info(f'[{num}/{len(futures)}] Deleting files...')
+
+            self.log.info(f'Deleted {deleted} files.')
         else:
             self.log.info('Nothing to delete.')
 
@@ -1239,6 +1545,26 @@ class LegendaryCore:
         else:
             return Manifest.read_all(data)
 
+    @staticmethod
+    def load_manifest_chunk_list(data: bytes) -> Manifest:
+        if data[0:1] == b'{':
+            return JSONManifest.read_chunk_list(data)
+        else:
+            return Manifest.read_chunk_list(data)
+
+    def _save_manifest(self, app_name, manifest_data: bytes, manifest: Manifest, platform='Windows'):
+        """
+        Saves manifest data to disk, optionally converting JSON manifests to the (much faster to load) binary format
+        """
+        if isinstance(manifest, JSONManifest) and self.lgd.config.getboolean('Legendary', 'convert_json_manifests',
+                                                                             fallback=False):
+            try:
+                manifest_data = manifest.to_binary()
+            except Exception as e:
+                self.log.warning(f'Converting JSON manifest to binary failed with {e!r}, saving original.')
+
+        self.lgd.save_manifest(app_name, manifest_data, version=manifest.meta.build_version, platform=platform)
+
     def get_installed_manifest(self, app_name):
         igame = self._get_installed_game(app_name)
         old_bytes = self.lgd.load_manifest(app_name, igame.version, igame.platform)
@@ -1320,6 +1646,47 @@ class LegendaryCore:
         r = self.egs.unauth_session.get(f'{base_url}/Deltas/{new_build_id}/{old_build_id}.delta')
         return r.content if r.status_code == 200 else None
 
+    def get_seed_manifest(self, seed_path, seed_manifest=None):
+        """
+        Load the manifest of a seed installation, either from the specified URI or
+        from the installation's ".egstore" folder (if it has been installed by EGL).
+
+        :param seed_path: path of the seed installation
+        :param seed_manifest: manifest URI/path (optional)
+        :return: Manifest or None if none was found
+        """
+        if seed_manifest:
+            self.log.info(f'Loading seed manifest "{seed_manifest}"...')
+            manifest_data, _ = self.get_uri_manifest(seed_manifest)
+            return self.load_manifest(manifest_data)
+
+        egstore = os.path.join(seed_path, '.egstore')
+        if not os.path.isdir(egstore):
+            return None
+
+        manifests = [os.path.join(egstore, f) for f in os.listdir(egstore) if f.endswith('.manifest')]
+        if not manifests:
+            return None
+
+        # if there are several, the most recent one should belong to the installed build
+        manifest_path = max(manifests, key=os.path.getmtime)
+        self.log.info(f'Using seed manifest from EGL installation: "{manifest_path}"')
+        with open(manifest_path, 'rb') as f:
+            return self.load_manifest(f.read())
+
+    def verify_seed_files(self, seed_path, seed_manifest: Manifest) -> set:
+        """Returns the set of files in the seed installation that match its manifest"""
+        self.log.info(f'Verifying {len(seed_manifest.file_manifest_list.elements)} files of seed installation...')
+        file_list = [(fm.filename, fm.sha_hash.hex()) for fm in seed_manifest.file_manifest_list.elements]
+        valid = set()
+        for result, path, _, _ in validate_files(seed_path, file_list):
+            if result == VerifyResult.HASH_MATCH:
+                valid.add(path)
+            else:
+                self.log.debug(f'Seed file "{path}" cannot be used: {result.name}')
+        self.log.info(f'{len(valid)} files of the seed installation can be used.')
+        return valid
+
     def prepare_download(self, game: Game, base_game: Game = None, base_path: str = '',
                          status_q: Queue = None, max_shm: int = 0, max_workers: int = 0,
                          force: bool = False, disable_patching: bool = False,
@@ -1331,7 +1698,13 @@ class LegendaryCore:
                          repair: bool = False, repair_use_latest: bool = False,
                          disable_delta: bool = False, override_delta_manifest: str = '',
                          egl_guid: str = '', preferred_cdn: str = None,
-                         disable_https: bool = False, bind_ip: str = None) -> (DLManager, AnalysisResult, ManifestMeta):
+                         disable_https: bool = False, bind_ip: str = None,
+                         chunk_proxy: str = None, chunk_store: str = None,
+                         populate_chunk_store: bool = False, seed_path: str = None,
+                         seed_manifest: str = None, verify_seed: bool = False,
+                         salvage: bool = False, salvage_paths: list = None,
+                         repair_chunks: bool = False, dedup: bool = True,
+                         dedup_hardlinks: bool = False) -> ('DLManager', AnalysisResult, ManifestMeta):
         # load old manifest
         old_manifest = None
 
@@ -1373,9 +1746,7 @@ class LegendaryCore:
         new_manifest = self.load_manifest(new_manifest_data)
         self.log.debug(f'Base urls: {base_urls}')
         # save manifest with version name as well for testing/downgrading/etc.
-        self.lgd.save_manifest(game.app_name, new_manifest_data,
-                               version=new_manifest.meta.build_version,
-                               platform=platform)
+        self._save_manifest(game.app_name, new_manifest_data, new_manifest, platform=platform)
 
         # check if we should use a delta manifest or not
         disable_delta = disable_delta or ((override_old_manifest or override_manifest) and not override_delta_manifest)
@@ -1484,6 +1855,11 @@ class LegendaryCore:
         scheme, cdn_host = base_url.split('/')[0:3:2]
         self.log.info(f'Selected CDN: {cdn_host} ({scheme.strip(":")})')
 
+        if chunk_proxy or (chunk_proxy := self.lgd.config.get('Legendary', 'chunk_proxy', fallback=None)):
+            # caching proxies ("legendary serve --proxy") expect the upstream host and path after their own URL
+            base_url = f'{chunk_proxy.rstrip("/")}/{base_url.partition("://")[2]}'
+            self.log.info(f'Downloading via chunk proxy: {chunk_proxy}')
+
         if not max_shm:
             max_shm = self.lgd.config.getint('Legendary', 'max_memory', fallback=2048)
 
@@ -1496,15 +1872,45 @@ class LegendaryCore:
         if not max_workers:
             max_workers = self.lgd.config.getint('Legendary', 'max_workers', fallback=0)
 
+        store = None
+        if chunk_store or (chunk_store := self.lgd.config.get('Legendary', 'chunk_store', fallback=None)):
+            from legendary.lfs.chunk_store import ChunkStore
+            store_size = self.lgd.config.getint('Legendary', 'chunk_store_max_size', fallback=20480)
+            try:
+                store = ChunkStore(chunk_store, max_size=store_size * 1024 * 1024,
+                                   data_format=ChunkStore.FORMAT_RAW)
+            except ValueError as e:
+                self.log.error(f'Not using local chunk store: {e}')
+            else:
+                populate_chunk_store = populate_chunk_store or self.lgd.config.getboolean(
+                    'Legendary', 'populate_chunk_store', fallback=False)
+                self.log.info(f'Using local chunk store "{chunk_store}" ({len(store)} chunks, '
+                              f'{store.size / 1024 / 1024:.02f} MiB)')
+
+        seed_manifest_obj = seed_files = None
+        if seed_path:
+            seed_manifest_obj = self.get_seed_manifest(seed_path, seed_manifest) or new_manifest
+            if seed_manifest_obj is new_manifest:
+                self.log.warning('No manifest found for seed installation, assuming it is the same build '
+                                 '(data copied from it is verified against the new manifest).')
+            if verify_seed:
+                seed_files = self.verify_seed_files(seed_path, seed_manifest_obj)
+
+        from legendary.downloader.mp.manager import DLManager
         dlm = DLManager(install_path, base_url, resume_file=resume_file, status_q=status_q,
                         max_shared_memory=max_shm * 1024 * 1024, max_workers=max_workers,
-                        dl_timeout=dl_timeout, bind_ip=bind_ip)
+                        dl_timeout=dl_timeout, bind_ip=bind_ip,
+                        chunk_store=store, populate_chunk_store=populate_chunk_store)
         anlres = dlm.run_analysis(manifest=new_manifest, old_manifest=old_manifest,
                                   patch=not disable_patching, resume=not force,
                                   file_prefix_filter=file_prefix_filter,
                                   file_exclude_filter=file_exclude_filter,
                                   file_install_tag=file_install_tag,
-                                  processing_optimization=process_opt)
+                                  processing_optimization=process_opt,
+                                  seed_manifest=seed_manifest_obj, seed_path=seed_path,
+                                  seed_files=seed_files, salvage=salvage,
+                                  salvage_paths=salvage_paths, chunk_repair=repair and repair_chunks,
+                                  dedup=dedup, dedup_hardlinks=dedup_hardlinks)
 
         prereq = None
         if new_manifest.meta.prereq_ids:
@@ -1663,6 +2069,24 @@ class LegendaryCore:
         else:
             return os.path.expanduser(self.lgd.config.get('Legendary', 'install_dir', fallback='~/Games'))
 
+    def update_missing_install_sizes(self, games: List[InstalledGame]) -> None:
+        """
+        Calculate and save install size for games installed by old versions that did not store it,
+        so that the manifest only has to be parsed once.
+        """
+        if not (missing := [g for g in games if g.install_size == 0]) or not self.lgd.lock_installed():
+            return
+
+        for game in missing:
+            self.log.debug(f'Updating missing size for {game.app_name}')
+            try:
+                manifest = self.load_manifest(self.get_installed_manifest(game.app_name)[0])
+            except Exception as e:
+                self.log.warning(f'Loading manifest for "{game.app_name}" failed: {e!r}')
+                continue
+            game.install_size = sum(fm.file_size for fm in manifest.file_manifest_list.elements)
+            self.install_game(game)
+
     def install_game(self, installed_game: InstalledGame) -> dict:
         if self.egl_sync_enabled and not installed_game.is_dlc and installed_game.platform.startswith('Win'):
             if not installed_game.egl_guid:
@@ -1773,8 +2197,7 @@ class LegendaryCore:
 
         # parse and save manifest to disk for verification step of import
         new_manifest = self.load_manifest(manifest_data)
-        self.lgd.save_manifest(game.app_name, manifest_data,
-                               version=new_manifest.meta.build_version, platform=platform)
+        self._save_manifest(game.app_name, manifest_data, new_manifest, platform=platform)
         install_size = sum(fm.file_size for fm in new_manifest.file_manifest_list.elements)
 
         prereq = None
@@ -1848,9 +2271,7 @@ class LegendaryCore:
         with open(manifest_filename, 'rb') as f:
             manifest_data = f.read()
         new_manifest = self.load_manifest(manifest_data)
-        self.lgd.save_manifest(lgd_igame.app_name, manifest_data,
-                               version=new_manifest.meta.build_version,
-                               platform='Windows')
+        self._save_manifest(lgd_igame.app_name, manifest_data, new_manifest, platform='Windows')
 
         # transfer install tag choices to config
         if lgd_igame.install_tags:
@@ -2048,6 +2469,7 @@ class LegendaryCore:
         else:
             path = path or os.path.join(self.get_default_install_dir(), '.overlay')
 
+        from legendary.downloader.mp.manager import DLManager
         dlm = DLManager(path, base_urls[0])
         analysis_result = dlm.run_analysis(manifest=manifest)
 
@@ -2097,6 +2519,7 @@ class LegendaryCore:
         if os.path.exists(path):
             raise FileExistsError(f'Bottle {bottle_name} already exists')
 
+        from legendary.downloader.mp.manager import DLManager
         dlm = DLManager(path, base_url)
         analysis_result = dlm.run_analysis(manifest=manifest)
 
@@ -2151,4 +2574,7 @@ class LegendaryCore:
         """
         Do cleanup, config saving, and exit.
         """
+        # let background update checks finish writing their cache files
+        if self._update_check_thread:
+            self._update_check_thread.join(timeout=self.egs.request_timeout)
         self.lgd.save_config()
@@ -0,0 +1,331 @@
+# coding: utf-8
+
+import hashlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import sys
+import time
+
+from legendary import __version__
+from legendary.lfs.lgndry import get_config_path
+
+logger = logging.getLogger('Daemon')
+
+# Commands that are non-interactive and only produce output, these can safely be run by the daemon
+# on behalf of a client. Everything else (installs, launching, prompts) is always run locally.
+FORWARDABLE_COMMANDS = {
+    'get-token', 'info', 'list', 'list-games', 'list-files',
+    'list-installed', 'list-saves', 'status',
+}
+# seconds to wait for the daemon to answer a forwarded command before giving up and running it locally
+FORWARD_TIMEOUT = 60.0
+# seconds a forwarded command waits for another one to finish, after that the client runs it locally instead
+BUSY_TIMEOUT = 5.0
+
+
+def get_socket_path():
+    if socket_path := os.environ.get('LEGENDARY_DAEMON_SOCKET'):
+        return socket_path
+    elif runtime_dir := os.environ.get('XDG_RUNTIME_DIR'):
+        # the runtime dir is shared by all config dirs, each of them gets its own daemon
+        config_hash = hashlib.sha1(_normalize_path(get_config_path()).encode('utf-8')).hexdigest()[:12]
+        return os.path.join(runtime_dir, f'legendary-{config_hash}.sock')
+    return os.path.join(get_config_path(), 'daemon.sock')
+
+
+def _normalize_path(path):
+    return os.path.normcase(os.path.realpath(path))
+
+
+def daemon_supported():
+    return hasattr(socket, 'AF_UNIX') and os.name != 'nt'
+
+
+class _RecordCollector(logging.Handler):
+    """Collects log records emitted by the thread running a forwarded command, so the client can replay them"""
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.thread = threading.get_ident()
+
+    def emit(self, record):
+        if record.thread == self.thread:
+            self.records.append([record.name, record.levelno, record.getMessage()])
+
+
+class _ThreadStdout(io.TextIOBase):
+    """
+    Replacement for sys.stdout that writes to a stream set for the current thread (if any),
+    so the output of forwarded commands doesn't mix with that of other threads.
+    """
+    def __init__(self, default):
+        super().__init__()
+        self.default = default
+        self.local = threading.local()
+
+    @property
+    def stream(self):
+        return getattr(self.local, 'stream', None) or self.default
+
+    def write(self, s):
+        return self.stream.write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, item):
+        return getattr(self.default, item)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    server: 'LegendaryDaemon'
+
+    def handle(self):
+        while line := self.rfile.readline():
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                self._respond(None, error=dict(code=-32700, message=f'Parse error: {e!r}'))
+                continue
+
+            req_id = request.get('id')
+            method = request.get('method', '')
+            params = request.get('params') or dict()
+
+            if not (handler := getattr(self.server, f'rpc_{method.replace("-", "_")}', None)):
+                self._respond(req_id, error=dict(code=-32601, message=f'Method "{method}" not found'))
+                continue
+
+            try:
+                result = handler(**params)
+            except Exception as e:
+                logger.warning(f'RPC call "{method}" failed with {e!r}')
+                self._respond(req_id, error=dict(code=-32000, message=repr(e)))
+            else:
+                self._respond(req_id, result=result)
+
+    def _respond(self, req_id, result=None, error=None):
+        response = dict(jsonrpc='2.0', id=req_id)
+        if error:
+            response['error'] = error
+        else:
+            response['result'] = result
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+        self.wfile.flush()
+
+
+class LegendaryDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Long-running server that keeps a LegendaryCLI (and with it the core, config, metadata
+    and authenticated API session) alive and runs commands for thin clients.
+
+    The API is JSON-RPC 2.0 style with one JSON object per line over a Unix socket.
+    """
+    daemon_threads = True
+
+    def __init__(self, cli, parser, socket_path=None):
+        self.cli = cli
+        self.parser = parser
+        self.socket_path = socket_path or get_socket_path()
+        self.config_path = _normalize_path(self.cli.core.lgd.path)
+        self.started = time.time()
+        # LegendaryCore is not thread-safe, commands are run one at a time
+        self.command_lock = threading.Lock()
+        self._stdout = None
+        self._file_ids = {path: self._get_file_id(path) for path in self._get_watched_files()}
+
+        if os.path.exists(self.socket_path):
+            if DaemonClient(self.socket_path, timeout=5.0).ping():
+                raise RuntimeError(f'Another daemon is already listening on "{self.socket_path}"')
+            os.remove(self.socket_path)
+
+        # the socket gives access to authenticated commands (e.g. get-token), so it must never be accessible
+        # by other users, not even between binding and changing its permissions
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(self.socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def _get_watched_files(self):
+        lgd = self.cli.core.lgd
+        return {
+            os.path.join(lgd.path, 'installed.json'): lgd.reload_installed,
+            lgd.config_path: lgd.reload_config,
+            os.path.join(lgd.path, 'aliases.json'): lgd.reload_aliases,
+            os.path.join(lgd.path, 'user.json'): self._reload_userdata,
+            os.path.join(lgd.path, 'entitlements.json'): lgd.invalidate_cached_data,
+            os.path.join(lgd.path, 'assets.json'): lgd.invalidate_cached_data,
+        }
+
+    @staticmethod
+    def _get_file_id(path):
+        try:
+            st = os.stat(path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def _reload_userdata(self):
+        # the current session may belong to an account that has since been logged out or replaced
+        self.cli.core.lgd.invalidate_cached_data()
+        self.cli.core.logged_in = False
+
+    def _refresh_state(self):
+        # other (non-forwarded) legendary instances may have logged in, installed games, or changed the config
+        watched = self._get_watched_files()
+        reloaded = set()
+        for path, reload in watched.items():
+            if (file_id := self._get_file_id(path)) == self._file_ids.get(path):
+                continue
+            logger.debug(f'"{os.path.basename(path)}" changed on disk, reloading...')
+            self._file_ids[path] = file_id
+            if reload not in reloaded:
+                reload()
+                reloaded.add(reload)
+        # aliases may have been enabled or disabled in the config
+        if watched[self.cli.core.lgd.config_path] in reloaded:
+            self.cli.core.lgd.reload_aliases()
+
+    def serve(self):
+        logger.info(f'Listening on "{self.socket_path}"')
+        self._stdout = sys.stdout = _ThreadStdout(sys.stdout)
+        try:
+            self.serve_forever()
+        finally:
+            sys.stdout = self._stdout.default
+            self.server_close()
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+    def rpc_ping(self):
+        return dict(version=__version__, pid=os.getpid(), uptime=time.time() - self.started,
+                    logged_in=self.cli.core.logged_in)
+
+    def rpc_shutdown(self):
+        logger.info('Shutdown requested by client.')
+        threading.Thread(target=self.shutdown, daemon=True).start()
+        return True
+
+    def rpc_resolve_alias(self, name):
+        with self.command_lock:
+            return self.cli._resolve_aliases(name)
+
+    def rpc_get_installed_list(self):
+        with self.command_lock:
+            self._refresh_state()
+            return [vars(igame) for igame in self.cli.core.get_installed_list()]
+
+    def rpc_run(self, argv, cwd=None, config_path=None):
+        """
+        Parses and runs a CLI command, returns its exit code, stdout and log messages.
+
+        :param argv: command line arguments
+        :param cwd: working directory of the client, relative paths in arguments are resolved against it
+        :param config_path: config directory of the client, has to match the daemon's
+        """
+        from legendary.cli import run_command
+
+        if config_path and _normalize_path(config_path) != self.config_path:
+            raise ValueError(f'Daemon uses a different config directory ("{self.config_path}")')
+
+        args, extra = self.parser.parse_known_args(argv)
+        if args.subparser_name not in FORWARDABLE_COMMANDS:
+            raise ValueError(f'Command "{args.subparser_name}" cannot be run by the daemon')
+        # prompts cannot be answered remotely
+        args.yes = True
+
+        out = io.StringIO()
+        collector = _RecordCollector()
+        root = logging.getLogger()
+        exit_code = 0
+
+        if not self.command_lock.acquire(timeout=BUSY_TIMEOUT):
+            raise RuntimeError('Daemon is busy running another command')
+        # commands are run one at a time, so changing the working directory for one is safe
+        prev_cwd = os.getcwd()
+        root.addHandler(collector)
+        if self._stdout:
+            self._stdout.local.stream = out
+        try:
+            self._refresh_state()
+            if cwd:
+                os.chdir(cwd)
+            run_command(self.cli, args, extra)
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        finally:
+            os.chdir(prev_cwd)
+            if self._stdout:
+                self._stdout.local.stream = None
+            root.removeHandler(collector)
+            self.command_lock.release()
+
+        return dict(exit_code=exit_code, stdout=out.getvalue(), log=collector.records)
+
+
+class DaemonClient:
+    def __init__(self, socket_path=None, timeout=30.0, connect_timeout=2.0):
+        self.socket_path = socket_path or get_socket_path()
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._id = 0
+
+    def call(self, method, **params):
+        self._id += 1
+        request = dict(jsonrpc='2.0', id=self._id, method=method, params=params)
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(self.connect_timeout)
+            s.connect(self.socket_path)
+            s.settimeout(self.timeout)
+            s.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            with s.makefile('rb') as f:
+                response = json.loads(f.readline())
+
+        if error := response.get('error'):
+            raise RuntimeError(error['message'])
+        return response['result']
+
+    def ping(self):
+        try:
+            return self.call('ping')
+        except (OSError, ValueError, RuntimeError):
+            return None
+
+
+def forward_command(argv, subcommand):
+    """
+    Runs a command in a running daemon if possible.
+
+    :param argv: command line arguments (without program name)
+    :param subcommand: parsed subcommand name
+    :return: exit code, or None if the command has to be run locally
+    """
+    if not daemon_supported() or subcommand not in FORWARDABLE_COMMANDS:
+        return None
+    if not os.path.exists(socket_path := get_socket_path()):
+        return None
+
+    try:
+        # a busy or hung daemon must not block the CLI, a timeout (socket.timeout is an OSError) runs it locally
+        result = DaemonClient(socket_path, timeout=FORWARD_TIMEOUT).call('run', argv=argv, cwd=os.getcwd(),
+                                                                        config_path=get_config_path())
+    except (OSError, ValueError, RuntimeError) as e:
+        logger.debug(f'Forwarding command to daemon failed with {e!r}, running locally...')
+        return None
+
+    for name, level, msg in result['log']:
+        logging.getLogger(name).log(level, msg)
+    print(result['stdout'], end='')
+    return result['exit_code']
@@ -2,19 +2,22 @@
 
 # please don't look at this code too hard, it's a mess.
 
+import hashlib
 import logging
 import os
 import time
 
 from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from logging.handlers import QueueHandler
 from multiprocessing import cpu_count, Process, Queue as MPQueue
 from multiprocessing.shared_memory import SharedMemory
-from queue import Empty
+from queue import Empty, Full, Queue
 from sys import exit
-from threading import Condition, Thread
+from threading import Condition, Lock, Thread
 
 from legendary.downloader.mp.workers import DLWorker, FileWorker
+from legendary.lfs.chunk_store import ChunkStore
 from legendary.models.downloading import *
 from legendary.models.manifest import ManifestComparison, Manifest
 
@@ -22,7 +25,8 @@ from legendary.models.manifest import ManifestComparison, Manifest
 class DLManager(Process):
     def __init__(self, download_dir, base_url, cache_dir=None, status_q=None,
                  max_workers=0, update_interval=1.0, dl_timeout=10, resume_file=None,
-                 max_shared_memory=1024 * 1024 * 1024, bind_ip=None):
+                 max_shared_memory=1024 * 1024 * 1024, bind_ip=None,
+                 chunk_store: ChunkStore = None, populate_chunk_store=False):
         super().__init__(name='DLManager')
         self.log = logging.getLogger('DLM')
         self.proc_debug = False
@@ -35,6 +39,8 @@ class DLManager(Process):
         self.logging_queue = None
         self.dl_worker_queue = None
         self.writer_queue = None
+        self.writer_batch = []
+        self.writer_batch_size = 64
         self.dl_result_q = None
         self.writer_result_q = None
 
@@ -62,6 +68,14 @@ class DLManager(Process):
         self.resume_file = resume_file
         self.hash_map = dict()
 
+        # Local chunk store, chunks found in it are copied instead of downloaded
+        self.chunk_store = chunk_store
+        self.populate_chunk_store = populate_chunk_store
+        self.store_queue = None
+        # shared memory offsets of chunks waiting to be stored -> whether the writer is done with them
+        self.store_pending = dict()
+        self.store_lock = None
+
         # cross-thread runtime information
         self.running = True
         self.active_tasks = 0
@@ -75,6 +89,8 @@ class DLManager(Process):
         self.bytes_written_since_last = 0
         # bytes read since last report
         self.bytes_read_since_last = 0
+        # zero-filled bytes that were skipped instead of written
+        self.bytes_sparse = 0
         # chunks written since last report
         self.num_processed_since_last = 0
         self.num_tasks_processed_since_last = 0
@@ -82,7 +98,10 @@ class DLManager(Process):
     def run_analysis(self, manifest: Manifest, old_manifest: Manifest = None,
                      patch=True, resume=True, file_prefix_filter=None,
                      file_exclude_filter=None, file_install_tag=None,
-                     processing_optimization=False) -> AnalysisResult:
+                     processing_optimization=False, seed_manifest: Manifest = None,
+                     seed_path: str = None, seed_files: set = None, salvage=False,
+                     salvage_paths: list = None, chunk_repair=False, dedup=True,
+                     dedup_hardlinks=False) -> AnalysisResult:
         """
         Run analysis on manifest and old manifest (if not None) and return a result
         with a summary resources required in order to install the provided manifest.
@@ -95,6 +114,15 @@ class DLManager(Process):
         :param file_exclude_filter: Exclude files with this prefix from download
         :param file_install_tag: Only install files with the specified tag
         :param processing_optimization: Attempt to optimize processing order and RAM usage
+        :param seed_manifest: Manifest of another installation to copy chunk data from (if applicable)
+        :param seed_path: Directory of the other installation
+        :param seed_files: Verified files of the seed installation that can be used (default: all files with the
+                           expected size, chunks copied from them are checked against their hashes first)
+        :param salvage: Search existing local files that will be (re-)written for chunk data
+        :param salvage_paths: Additional files or directories to search for chunk data
+        :param chunk_repair: Verify chunks of existing files and only rewrite corrupted parts in place
+        :param dedup: Only write files with identical contents once and copy them afterwards
+        :param dedup_hardlinks: Use hardlinks instead of copies for files with identical contents
         :return: AnalysisResult
         """
 
@@ -294,11 +322,48 @@ class DLManager(Process):
             opt_delta = time.time() - s_time
             self.log.debug(f'Processing optimizations took {opt_delta:.01f} seconds.')
 
+        # files with identical contents are only written once, the first one in processing order
+        # is written normally and the others are copied from it (using reflinks if possible).
+        duplicates = dict()
+        if dedup:
+            sources = dict()
+            for fm in fmlist:
+                if fm.filename in mc.unchanged or not fm.chunk_parts:
+                    continue
+                if source := sources.get((fm.sha_hash, fm.file_size)):
+                    duplicates[fm.filename] = source
+                    for cp in fm.chunk_parts:
+                        references[cp.guid_num] -= 1
+                    analysis_res.dedup_size += fm.file_size
+                else:
+                    sources[(fm.sha_hash, fm.file_size)] = fm.filename
+
+            analysis_res.dedup_files = len(duplicates)
+            if duplicates:
+                self.log.debug(f'{len(duplicates)} files ({analysis_res.dedup_size / 1024 / 1024:.02f} MiB) '
+                               f'are duplicates and will be copied.')
+
+        # chunks that only contain zeros (e.g. padding in large files) don't have to be downloaded at all
+        zero_hashes = {size: hashlib.sha1(bytes(size)).digest()
+                       for size in {c.window_size for c in manifest.chunk_data_list.elements}}
+        zero_chunks = {c.guid_num for c in manifest.chunk_data_list.elements
+                       if c.sha_hash == zero_hashes[c.window_size]}
+        if zero_chunks:
+            for fm in fmlist:
+                if fm.filename in mc.unchanged or fm.filename in duplicates:
+                    continue
+                for cp in fm.chunk_parts:
+                    if cp.guid_num in zero_chunks:
+                        references[cp.guid_num] -= 1
+            self.log.debug(f'{len(zero_chunks)} chunks only contain zeros.')
+
         # determine reusable chunks and prepare lookup table for reusable ones
         re_usable = defaultdict(dict)
         if old_manifest and mc.changed and patch:
             self.log.debug('Analyzing manifests for re-usable chunks...')
             for changed in mc.changed:
+                if changed in duplicates:
+                    continue
                 old_file = old_manifest.file_manifest_list.get_file_by_path(changed)
                 new_file = manifest.file_manifest_list.get_file_by_path(changed)
 
@@ -318,6 +383,121 @@ class DLManager(Process):
                             analysis_res.reuse_size += cp.size
                             break
 
+        # determine which parts of existing files are intact and do not have to be rewritten
+        patch_ok = dict()
+        if chunk_repair:
+            patch_ok = self._chunk_repair_analysis(manifest, mc, fmlist, references, re_usable, duplicates)
+            # files without any parts to rewrite are skipped entirely and not counted as patched
+            for fm in fmlist:
+                if fm.filename not in patch_ok:
+                    continue
+                rewrite = [cp.size for cp in fm.chunk_parts
+                           if (cp.guid_num, cp.offset, cp.size) not in patch_ok[fm.filename]]
+                if rewrite:
+                    analysis_res.patched_files += 1
+                    analysis_res.patch_size += sum(rewrite)
+
+        # determine chunk parts that can be copied from files of a seed installation
+        seed_usable = defaultdict(dict)
+        if seed_manifest and seed_path:
+            self.log.debug(f'Analyzing seed installation "{seed_path}" for re-usable chunks...')
+            seed_chunks = defaultdict(list)
+            for fm in seed_manifest.file_manifest_list.elements:
+                if seed_files is not None and fm.filename not in seed_files:
+                    continue
+                full_path = os.path.join(seed_path, fm.filename)
+                try:
+                    if os.path.getsize(full_path) != fm.file_size:
+                        continue
+                except OSError:
+                    continue
+                for cp in fm.chunk_parts:
+                    seed_chunks[cp.guid_num].append((fm.filename, cp.file_offset, cp.offset, cp.offset + cp.size))
+
+            # files that have not been verified as a whole only match by size (and possibly belong to a different
+            # build if the seed manifest is just assumed), so the chunks copied from them are checked first.
+            # (seed file, guid) pairs that fail the check are excluded and the chunk parts are assigned again.
+            bad_sources = set()
+            verified = set()
+            while True:
+                needed = dict()
+                for fm in fmlist:
+                    if fm.filename in mc.unchanged or fm.filename in duplicates:
+                        continue
+                    existing_chunks = re_usable.get(fm.filename, None)
+                    intact_chunks = patch_ok.get(fm.filename, None)
+                    for cp in fm.chunk_parts:
+                        key = (cp.guid_num, cp.offset, cp.size)
+                        if (existing_chunks and key in existing_chunks) or (intact_chunks and key in intact_chunks):
+                            continue
+                        elif cp.guid_num in zero_chunks:
+                            continue
+                        for seed_file, file_o, cp_o, cp_end_o in seed_chunks.get(cp.guid_num, ()):
+                            # check if the chunk part is wholly contained in the seed file's chunk part
+                            if (seed_file, cp.guid_num) in bad_sources:
+                                continue
+                            if cp_o <= cp.offset and (cp.offset + cp.size) <= cp_end_o:
+                                seed_usable[fm.filename][key] = (os.path.join(seed_path, seed_file),
+                                                                 file_o + (cp.offset - cp_o))
+                                needed[seed_file, cp.guid_num] = None
+                                break
+
+                to_check = needed.keys() - verified
+                if seed_files is not None or not to_check:
+                    break
+                bad = self._check_seed_chunks(seed_manifest, seed_path, to_check)
+                verified |= to_check - bad
+                if not bad:
+                    break
+                self.log.debug(f'{len(bad)} chunk(s) in seed files are invalid, re-assigning...')
+                bad_sources |= bad
+                seed_usable.clear()
+
+            for fm in fmlist:
+                for cp in fm.chunk_parts:
+                    if (cp.guid_num, cp.offset, cp.size) in seed_usable.get(fm.filename, ()):
+                        references[cp.guid_num] -= 1
+                        analysis_res.seed_size += cp.size
+
+            self.log.debug(f'{analysis_res.seed_size / 1024 / 1024:.02f} MiB can be copied from seed installation.')
+
+        # determine chunks that can be copied from the local chunk store
+        store_paths = dict()
+        if self.chunk_store and len(self.chunk_store):
+            for chunk in manifest.chunk_data_list.elements:
+                if references[chunk.guid_num] < 1:
+                    continue
+                key = ChunkStore.get_key(chunk.guid_num, chunk.hash)
+                # chunk data is stored uncompressed, so the size has to match
+                if self.chunk_store.get_size(key) == chunk.window_size:
+                    store_paths[chunk.guid_num] = key
+
+            # other processes using the store may have evicted entries in the meantime, so once they are
+            # protected from eviction check that they still exist
+            self.chunk_store.pin(store_paths.values())
+            for guid, key in list(store_paths.items()):
+                path = store_paths[guid] = self.chunk_store.get_path(key)
+                try:
+                    if os.path.getsize(path) != self.chunk_store.get_size(key):
+                        del store_paths[guid]
+                        continue
+                except OSError:
+                    del store_paths[guid]
+                    continue
+                self.chunk_store.touch(key)
+            self.log.debug(f'{len(store_paths)} chunks are available in the local chunk store.')
+            analysis_res.num_chunks_store = len(store_paths)
+
+        # search local files for data of chunks that would otherwise have to be downloaded
+        salvage_usable = defaultdict(dict)
+        # files that are a salvage source and will be overwritten, these have to be written to a temporary file
+        salvage_tmp = set()
+        if salvage or salvage_paths:
+            salvage_usable, salvage_tmp = self._salvage_analysis(manifest, mc, fmlist, references, store_paths,
+                                                                 re_usable, seed_usable, salvage, salvage_paths,
+                                                                 patch_ok.keys() | duplicates.keys())
+            analysis_res.salvage_size = sum(size for parts in salvage_usable.values() for _, _, size in parts)
+
         last_cache_size = current_cache_size = 0
         # set to determine whether a file is currently cached or not
         cached = set()
@@ -336,19 +516,49 @@ class DLManager(Process):
             elif not current_file.chunk_parts:
                 self.tasks.append(FileTask(current_file.filename, flags=TaskFlags.CREATE_EMPTY_FILE))
                 continue
+            elif current_file.filename in duplicates:
+                self.tasks.append(FileTask(current_file.filename, old_file=duplicates[current_file.filename],
+                                           flags=TaskFlags.LINK_FILE if dedup_hardlinks else TaskFlags.COPY_FILE))
+                if current_file.executable:
+                    self.tasks.append(FileTask(current_file.filename, flags=TaskFlags.MAKE_EXECUTABLE))
+                continue
 
             existing_chunks = re_usable.get(current_file.filename, None)
+            seed_chunks = seed_usable.get(current_file.filename, None)
+            salvaged_chunks = salvage_usable.get(current_file.filename, None)
+            intact_chunks = patch_ok.get(current_file.filename, None)
             chunk_tasks = []
             reused = 0
 
             for cp in current_file.chunk_parts:
-                ct = ChunkTask(cp.guid_num, cp.offset, cp.size)
+                if intact_chunks is not None:
+                    # patching in place, intact parts are skipped and the rest is written to where it belongs
+                    if (cp.guid_num, cp.offset, cp.size) in intact_chunks:
+                        continue
+                    ct = ChunkTask(cp.guid_num, cp.offset, cp.size, file_offset=cp.file_offset)
+                else:
+                    ct = ChunkTask(cp.guid_num, cp.offset, cp.size)
+
+                if cp.guid_num in zero_chunks:
+                    ct.zero = True
+                    analysis_res.zero_size += cp.size
+                    chunk_tasks.append(ct)
+                    continue
 
                 # re-use the chunk from the existing file if we can
                 if existing_chunks and (cp.guid_num, cp.offset, cp.size) in existing_chunks:
                     reused += 1
                     ct.chunk_file = current_file.filename
                     ct.chunk_offset = existing_chunks[(cp.guid_num, cp.offset, cp.size)]
+                elif seed_chunks and (cp.guid_num, cp.offset, cp.size) in seed_chunks:
+                    # absolute path, so the writer will read it from the seed rather than the install dir
+                    ct.chunk_file, ct.chunk_offset = seed_chunks[(cp.guid_num, cp.offset, cp.size)]
+                elif salvaged_chunks and (cp.guid_num, cp.offset, cp.size) in salvaged_chunks:
+                    ct.chunk_file, ct.chunk_offset = salvaged_chunks[(cp.guid_num, cp.offset, cp.size)]
+                elif cp.guid_num in store_paths:
+                    # absolute path, so the writer will read it from the store rather than the install dir
+                    ct.chunk_file = store_paths[cp.guid_num]
+                    analysis_res.store_size += cp.size
                 else:
                     # add to DL list if not already in it
                     if cp.guid_num not in chunks_in_dl_list:
@@ -375,8 +585,16 @@ class DLManager(Process):
 
                 chunk_tasks.append(ct)
 
-            if reused:
-                self.log.debug(f' + Reusing {reused} chunks from: {current_file.filename}')
+            if intact_chunks is not None:
+                if not chunk_tasks:
+                    continue
+                self.log.debug(f' + Patching {len(chunk_tasks)} chunk parts in: {current_file.filename}')
+                self.tasks.append(FileTask(current_file.filename, flags=TaskFlags.OPEN_FILE | TaskFlags.PATCH_FILE))
+                self.tasks.extend(chunk_tasks)
+                self.tasks.append(FileTask(current_file.filename, flags=TaskFlags.CLOSE_FILE))
+            elif reused or current_file.filename in salvage_tmp:
+                if reused:
+                    self.log.debug(f' + Reusing {reused} chunks from: {current_file.filename}')
                 # open temporary file that will contain download + old file contents
                 self.tasks.append(FileTask(current_file.filename + u'.tmp', flags=TaskFlags.OPEN_FILE))
                 self.tasks.extend(chunk_tasks)
@@ -433,6 +651,200 @@ class DLManager(Process):
 
         return analysis_res
 
+    def _chunk_repair_analysis(self, manifest, mc, fmlist, references, re_usable, duplicates):
+        """
+        Reassembles the chunks used by existing files that are going to be rewritten and checks them
+        against their SHA-1 hashes, so that only the parts belonging to corrupted chunks have to be rewritten.
+
+        :return: dict of file name -> set of intact (guid, offset, size) chunk parts, for files that can be patched
+        """
+        from legendary.chunk_server import InstalledChunkSource
+
+        candidates = []
+        for fm in fmlist:
+            if fm.filename in mc.unchanged or fm.filename in re_usable or fm.filename in duplicates:
+                continue
+            elif not fm.chunk_parts:
+                continue
+            try:
+                # files of the wrong size would require moving data around, those are rewritten completely
+                if os.path.getsize(os.path.join(self.dl_dir, fm.filename)) == fm.file_size:
+                    candidates.append(fm)
+            except OSError:
+                continue
+
+        if not candidates:
+            return dict()
+
+        self.log.info(f'Verifying chunks of {len(candidates)} existing file(s)...')
+        source = InstalledChunkSource(self.dl_dir, manifest)
+        guids = {cp.guid_num for fm in candidates for cp in fm.chunk_parts}
+        chunks = [manifest.chunk_data_list.get_chunk_by_guid_num(guid) for guid in guids]
+
+        names = {chunk.guid_num: ChunkStore.get_key(chunk.guid_num, chunk.hash) for chunk in chunks}
+
+        # each file's copy of a chunk's data has to be checked, parts of a chunk can be shared between files and
+        # the default reconstruction only reads every part from one of them. Files that only contain the parts
+        # that are read by default anyway share one check.
+        checks = dict()
+        file_checks = dict()
+        for fm in candidates:
+            own_parts = defaultdict(list)
+            for cp in fm.chunk_parts:
+                own_parts[cp.guid_num].append((fm.filename, cp.file_offset, cp.offset, cp.size))
+            for guid, parts in own_parts.items():
+                name = names[guid]
+                if set(parts) <= set(source.parts[name]):
+                    key = (name, None)
+                else:
+                    key = (name, tuple(parts))
+                checks[key] = None
+                file_checks[fm.filename, guid] = key
+
+        def check_chunk(key):
+            name, overrides = key
+            return key, source.get_chunk_data(name, overrides) is not None
+
+        # hashing releases the GIL, so this works fine with threads
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, 8)) as executor:
+            checks.update(executor.map(check_chunk, list(checks)))
+        self.log.info(f'{sum(checks.values())} of {len(checks)} chunk checks succeeded.')
+
+        patch_ok = dict()
+        for fm in candidates:
+            ok_parts = patch_ok[fm.filename] = set()
+            for cp in fm.chunk_parts:
+                if checks[file_checks[fm.filename, cp.guid_num]]:
+                    ok_parts.add((cp.guid_num, cp.offset, cp.size))
+                    references[cp.guid_num] -= 1
+
+        return patch_ok
+
+    def _check_seed_chunks(self, seed_manifest, seed_path, sources):
+        """
+        Checks the data of chunks in the files of a seed installation against their SHA-1 hashes.
+
+        :param sources: (seed file name, chunk guid) pairs to check
+        :return: set of pairs whose data does not match
+        """
+        from legendary.chunk_server import InstalledChunkSource
+
+        self.log.info(f'Verifying {len(sources)} chunk(s) in seed installation...')
+        source = InstalledChunkSource(seed_path, seed_manifest)
+        file_parts = defaultdict(list)
+        for fm in seed_manifest.file_manifest_list.elements:
+            for cp in fm.chunk_parts:
+                if (fm.filename, cp.guid_num) in sources:
+                    file_parts[fm.filename, cp.guid_num].append((fm.filename, cp.file_offset, cp.offset, cp.size))
+
+        # as when repairing, a file's own parts have to be checked even if the default ones come from another file
+        checks = dict()
+        for (filename, guid), parts in file_parts.items():
+            chunk = seed_manifest.chunk_data_list.get_chunk_by_guid_num(guid)
+            name = ChunkStore.get_key(guid, chunk.hash)
+            if set(parts) <= set(source.parts[name]):
+                checks[filename, guid] = (name, None)
+            else:
+                checks[filename, guid] = (name, tuple(parts))
+
+        def check_chunk(key):
+            name, overrides = key
+            return key, source.get_chunk_data(name, overrides) is not None
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, 8)) as executor:
+            results = dict(executor.map(check_chunk, set(checks.values())))
+        return {pair for pair, key in checks.items() if not results[key]}
+
+    def _salvage_analysis(self, manifest, mc, fmlist, references, store_paths,
+                          re_usable, seed_usable, salvage, salvage_paths, excluded):
+        """
+        Searches local files for chunks that are still needed and assigns them to chunk parts.
+
+        :return: (file name -> {(guid, offset, size): (path, offset)}, set of files that have to be written to a
+                 temporary file first because they use themselves as a source)
+        """
+        salvage_usable = defaultdict(dict)
+        salvage_tmp = set()
+
+        # files that are going to be written, in order (files patched in place or copied from duplicates
+        # are neither sources nor targets)
+        order = {fm.filename: i for i, fm in enumerate(fm for fm in fmlist if fm.filename not in mc.unchanged
+                                                       and fm.filename not in excluded)}
+        # absolute path -> file name of files that will be written
+        targets = dict()
+        paths = []
+
+        if salvage:
+            for filename in order:
+                full_path = os.path.join(self.dl_dir, filename)
+                if os.path.isfile(full_path):
+                    paths.append(full_path)
+                    targets[os.path.normcase(os.path.abspath(full_path))] = filename
+
+        for salvage_path in salvage_paths or []:
+            if os.path.isfile(salvage_path):
+                paths.append(os.path.abspath(salvage_path))
+                continue
+            for dirpath, _, filenames in os.walk(salvage_path):
+                paths.extend(os.path.abspath(os.path.join(dirpath, fn)) for fn in filenames)
+
+        # remove duplicates but keep the order, also take note of targets in additional salvage paths
+        paths = list(dict.fromkeys(os.path.abspath(p) for p in paths))
+        dl_dir = os.path.normcase(os.path.abspath(self.dl_dir))
+        excluded = {os.path.normcase(os.path.abspath(os.path.join(self.dl_dir, fn))) for fn in excluded}
+        paths = [p for p in paths if os.path.normcase(p) not in excluded]
+        for path in paths:
+            norm_path = os.path.normcase(path)
+            if norm_path not in targets and norm_path.startswith(dl_dir + os.sep):
+                filename = os.path.relpath(path, self.dl_dir).replace(os.sep, '/')
+                for fm_name in order:
+                    if os.path.normcase(fm_name) == os.path.normcase(filename):
+                        targets[norm_path] = fm_name
+                        break
+
+        wanted = [c for c in manifest.chunk_data_list.elements
+                  if references[c.guid_num] > 0 and c.guid_num not in store_paths]
+        if not wanted or not paths:
+            return salvage_usable, salvage_tmp
+
+        from legendary.lfs.salvage import find_chunks
+        found = find_chunks(paths, wanted)
+
+        for fm in fmlist:
+            if fm.filename not in order:
+                continue
+            existing_chunks = re_usable.get(fm.filename, None)
+            seed_chunks = seed_usable.get(fm.filename, None)
+            for cp in fm.chunk_parts:
+                key = (cp.guid_num, cp.offset, cp.size)
+                if cp.guid_num not in found:
+                    continue
+                if (existing_chunks and key in existing_chunks) or (seed_chunks and key in seed_chunks):
+                    continue
+
+                # a source that is going to be overwritten can only be used until it has been written itself,
+                # prefer locations that don't require writing the file to a temporary file first
+                location = self_location = None
+                for path, offset in found[cp.guid_num]:
+                    target = targets.get(os.path.normcase(path))
+                    if target == fm.filename:
+                        self_location = self_location or (path, offset)
+                    elif not target or order[target] > order[fm.filename]:
+                        location = (path, offset)
+                        break
+
+                if not location:
+                    if not self_location:
+                        continue
+                    location = self_location
+                    salvage_tmp.add(fm.filename)
+
+                path, offset = location
+                references[cp.guid_num] -= 1
+                salvage_usable[fm.filename][key] = (path, offset + cp.offset)
+
+        return salvage_usable, salvage_tmp
+
     def download_job_manager(self, task_cond: Condition, shm_cond: Condition):
         while self.chunks_to_dl and self.running:
             while self.active_tasks < self.max_workers * 2 and self.chunks_to_dl:
@@ -447,9 +859,9 @@ class DLManager(Process):
                 chunk = self.chunk_data_list.get_chunk_by_guid(c_guid)
                 self.log.debug(f'Adding {chunk.guid_num} (active: {self.active_tasks})')
                 try:
-                    self.dl_worker_queue.put(DownloaderTask(url=self.base_url + '/' + chunk.path,
-                                                            chunk_guid=c_guid, shm=sms),
-                                             timeout=1.0)
+                    self.dl_worker_queue.put(pack_downloader_task(DownloaderTask(
+                        url=self.base_url + '/' + chunk.path, chunk_guid=c_guid, shm=sms
+                    )), timeout=1.0)
                 except Exception as e:
                     self.log.warning(f'Failed to add to download queue: {e!r}')
                     self.chunks_to_dl.appendleft(c_guid)
@@ -471,16 +883,28 @@ class DLManager(Process):
 
         self.log.debug('Download Job Manager quitting...')
 
+    def queue_writer_task(self, task: WriterTask):
+        # writer tasks are sent in batches, sending each one separately makes IPC the bottleneck for small files
+        self.writer_batch.append(task)
+        if len(self.writer_batch) >= self.writer_batch_size:
+            self.flush_writer_tasks()
+
+    def flush_writer_tasks(self):
+        if self.writer_batch:
+            self.writer_queue.put(pack_writer_tasks(self.writer_batch))
+            self.writer_batch = []
+
     def dl_results_handler(self, task_cond: Condition):
         in_buffer = dict()
 
-        task = self.tasks.popleft()
+        # nothing to do, e.g. when repairing files that turned out to be intact
+        task = self.tasks.popleft() if self.tasks else None
         current_file = ''
 
         while task and self.running:
             if isinstance(task, FileTask):  # this wasn't necessarily a good idea...
                 try:
-                    self.writer_queue.put(WriterTask(**task.__dict__), timeout=1.0)
+                    self.queue_writer_task(WriterTask(task.filename, task.flags, old_file=task.old_file))
                     if task.flags & TaskFlags.OPEN_FILE:
                         current_file = task.filename
                 except Exception as e:
@@ -494,24 +918,27 @@ class DLManager(Process):
                     break
                 continue
 
-            while (task.chunk_guid in in_buffer) or task.chunk_file:
+            while (task.chunk_guid in in_buffer) or task.chunk_file or task.zero:
                 res_shm = None
-                if not task.chunk_file:  # not re-using from an old file
+                flags = TaskFlags.RELEASE_MEMORY if task.cleanup else TaskFlags.NONE
+                if task.zero:
+                    flags = TaskFlags.ZERO_FILL
+                elif not task.chunk_file:  # not re-using from an old file
                     res_shm = in_buffer[task.chunk_guid].shm
 
                 try:
                     self.log.debug(f'Adding {task.chunk_guid} to writer queue')
-                    self.writer_queue.put(WriterTask(
+                    self.queue_writer_task(WriterTask(
                         filename=current_file, shared_memory=res_shm,
                         chunk_offset=task.chunk_offset, chunk_size=task.chunk_size,
-                        chunk_guid=task.chunk_guid, old_file=task.chunk_file,
-                        flags=TaskFlags.RELEASE_MEMORY if task.cleanup else TaskFlags.NONE
-                    ), timeout=1.0)
+                        chunk_guid=task.chunk_guid, old_file=task.chunk_file, file_offset=task.file_offset,
+                        flags=flags
+                    ))
                 except Exception as e:
                     self.log.warning(f'Adding to queue failed: {e!r}')
                     break
 
-                if task.cleanup and not task.chunk_file:
+                if task.cleanup and not task.chunk_file and not task.zero:
                     del in_buffer[task.chunk_guid]
 
                 try:
@@ -522,8 +949,10 @@ class DLManager(Process):
                     task = None
                     break
             else:  # only enter blocking code if the loop did not break
+                # the writer has to get everything that's ready before waiting for downloads
+                self.flush_writer_tasks()
                 try:
-                    res = self.dl_result_q.get(timeout=1)
+                    res = unpack_downloader_task(self.dl_result_q.get(timeout=1))
                     self.active_tasks -= 1
                     with task_cond:
                         task_cond.notify()
@@ -533,11 +962,24 @@ class DLManager(Process):
                         in_buffer[res.chunk_guid] = res
                         self.bytes_downloaded_since_last += res.size_downloaded
                         self.bytes_decompressed_since_last += res.size_decompressed
+
+                        if self.store_queue:
+                            chunk = self.chunk_data_list.get_chunk_by_guid_num(res.chunk_guid)
+                            key = ChunkStore.get_key(res.chunk_guid, chunk.hash)
+                            # the shared memory is not released until the store writer has copied the data
+                            with self.store_lock:
+                                self.store_pending[res.shm.offset] = False
+                            try:
+                                self.store_queue.put_nowait((key, res.shm, res.size_decompressed))
+                            except Full:
+                                self.log.debug(f'Chunk store queue is full, not storing {key}')
+                                with self.store_lock:
+                                    del self.store_pending[res.shm.offset]
                     else:
                         self.log.error(f'Download for {res.chunk_guid} failed, retrying...')
                         try:
-                            # since the result is a subclass of the task we can simply resubmit the result object
-                            self.dl_worker_queue.put(res, timeout=1.0)
+                            # since the result is a subclass of the task we can simply resubmit the result
+                            self.dl_worker_queue.put(pack_downloader_task(res), timeout=1.0)
                             self.active_tasks += 1
                         except Exception as e:
                             self.log.warning(f'Failed adding retry task to queue! {e!r}')
@@ -548,48 +990,79 @@ class DLManager(Process):
                 except Exception as e:
                     self.log.warning(f'Unhandled exception when trying to read download result queue: {e!r}')
 
+        self.flush_writer_tasks()
         self.log.debug('Download result handler quitting...')
 
+    def chunk_store_writer(self, shm_cond: Condition):
+        while (item := self.store_queue.get()) is not None:
+            key, shm, size = item
+            data = bytes(self.shared_memory.buf[shm.offset:shm.offset + size])
+            # the writer may already be done with the chunk, in that case the memory is released here
+            with self.store_lock:
+                release = self.store_pending.pop(shm.offset)
+            if release:
+                self.sms.appendleft(shm)
+                with shm_cond:
+                    shm_cond.notify()
+            self.chunk_store.put(key, data)
+        self.log.debug('Chunk store writer quitting...')
+
     def fw_results_handler(self, shm_cond: Condition):
         while self.running:
             try:
-                res = self.writer_result_q.get(timeout=1.0)
-
-                if isinstance(res, TerminateWorkerTask):
-                    self.log.debug('Got termination command in FW result handler')
-                    break
+                results = self.writer_result_q.get(timeout=1.0)
+            except Empty:
+                continue
+            except Exception as e:
+                self.log.warning(f'Exception when trying to read writer result queue: {e!r}')
+                continue
 
-                self.num_tasks_processed_since_last += 1
+            if isinstance(results, TerminateWorkerTask):
+                self.log.debug('Got termination command in FW result handler')
+                break
 
-                if res.flags & TaskFlags.CLOSE_FILE and self.resume_file and res.success:
-                    if res.filename.endswith('.tmp'):
-                        res.filename = res.filename[:-4]
+            for res in unpack_writer_tasks(results):
+                self.handle_writer_result(res, shm_cond)
 
-                    file_hash = self.hash_map[res.filename]
-                    # write last completed file to super simple resume file
-                    with open(self.resume_file, 'a', encoding='utf-8') as rf:
-                        rf.write(f'{file_hash}:{res.filename}\n')
+        self.log.debug('Writer result handler quitting...')
 
-                if not res.success:
-                    # todo make this kill the installation process or at least skip the file and mark it as failed
-                    self.log.fatal(f'Writing for {res.filename} failed!')
-                if res.flags & TaskFlags.RELEASE_MEMORY:
+    def handle_writer_result(self, res: WriterTaskResult, shm_cond: Condition):
+        try:
+            self.num_tasks_processed_since_last += 1
+
+            done_flags = TaskFlags.CLOSE_FILE | TaskFlags.COPY_FILE | TaskFlags.LINK_FILE
+            if res.flags & done_flags and self.resume_file and res.success:
+                if res.filename.endswith('.tmp'):
+                    res.filename = res.filename[:-4]
+
+                file_hash = self.hash_map[res.filename]
+                # write last completed file to super simple resume file
+                with open(self.resume_file, 'a', encoding='utf-8') as rf:
+                    rf.write(f'{file_hash}:{res.filename}\n')
+
+            if not res.success:
+                # todo make this kill the installation process or at least skip the file and mark it as failed
+                self.log.fatal(f'Writing for {res.filename} failed!')
+            if res.flags & TaskFlags.RELEASE_MEMORY:
+                with self.store_lock:
+                    # chunks that still have to be copied to the chunk store are released by the store writer
+                    release = res.shared_memory.offset not in self.store_pending
+                    if not release:
+                        self.store_pending[res.shared_memory.offset] = True
+                if release:
                     self.sms.appendleft(res.shared_memory)
                     with shm_cond:
                         shm_cond.notify()
 
-                if res.chunk_guid:
-                    self.bytes_written_since_last += res.size
-                    # if there's no shared memory we must have read from disk.
-                    if not res.shared_memory:
-                        self.bytes_read_since_last += res.size
-                    self.num_processed_since_last += 1
-
-            except Empty:
-                continue
-            except Exception as e:
-                self.log.warning(f'Exception when trying to read writer result queue: {e!r}')
-        self.log.debug('Writer result handler quitting...')
+            if res.chunk_guid:
+                self.bytes_written_since_last += res.size - res.skipped
+                self.bytes_sparse += res.skipped
+                # if there's no shared memory we must have read from disk.
+                if not res.shared_memory and not res.flags & TaskFlags.ZERO_FILL:
+                    self.bytes_read_since_last += res.size
+                self.num_processed_since_last += 1
+        except Exception as e:
+            self.log.warning(f'Exception when handling writer result: {e!r}')
 
     def run(self):
         if not self.analysis:
@@ -699,6 +1172,11 @@ class DLManager(Process):
         self.threads.append(Thread(target=self.download_job_manager, args=(task_cond, shm_cond)))
         self.threads.append(Thread(target=self.dl_results_handler, args=(task_cond,)))
         self.threads.append(Thread(target=self.fw_results_handler, args=(shm_cond,)))
+        self.store_lock = Lock()
+        if self.chunk_store is not None and self.populate_chunk_store:
+            # storing is best effort, if the disk can't keep up chunks are skipped rather than slowing the download
+            self.store_queue = Queue(maxsize=64)
+            self.threads.append(Thread(target=self.chunk_store_writer, args=(shm_cond,), daemon=True))
 
         for t in self.threads:
             t.start()
@@ -751,7 +1229,8 @@ class DLManager(Process):
                           f'Running for {rt_hours:02d}:{rt_minutes:02d}:{rt_seconds:02d}, '
                           f'ETA: {hours:02d}:{minutes:02d}:{seconds:02d}')
             self.log.info(f' - Downloaded: {total_dl / 1024 / 1024:.02f} MiB, '
-                          f'Written: {total_write / 1024 / 1024:.02f} MiB')
+                          f'Written: {total_write / 1024 / 1024:.02f} MiB, '
+                          f'Skipped (zeros): {self.bytes_sparse / 1024 / 1024:.02f} MiB')
             self.log.info(f' - Cache usage: {total_used:.02f} MiB, active tasks: {self.active_tasks}')
             self.log.info(f' + Download\t- {dl_speed / 1024 / 1024:.02f} MiB/s (raw) '
                           f'/ {dl_unc_speed / 1024 / 1024:.02f} MiB/s (decompressed)')
@@ -775,6 +1254,8 @@ class DLManager(Process):
 
         self.log.info('Waiting for installation to finish...')
         self.writer_queue.put_nowait(TerminateWorkerTask())
+        if self.store_queue:
+            self.store_queue.put(None)
 
         writer_p.join(timeout=10.0)
         if writer_p.exitcode is None:
@@ -804,6 +1285,8 @@ class DLManager(Process):
         self.shared_memory.unlink()
         self.shared_memory = None
 
+        if self.bytes_sparse:
+            self.log.info(f'Skipped writing {self.bytes_sparse / 1024 / 1024:.02f} MiB of zero-filled data.')
         self.log.info('All done! Download manager quitting...')
         # finally, exit the process.
         exit(0)
@@ -1,12 +1,15 @@
 # coding: utf-8
 
 import os
+import shutil
+import sys
 import time
 import logging
 
 from logging.handlers import QueueHandler
 from multiprocessing import Process
 from multiprocessing.shared_memory import SharedMemory
+from collections import deque
 from queue import Empty
 
 import requests
@@ -14,11 +17,98 @@ from requests.adapters import HTTPAdapter, DEFAULT_POOLBLOCK
 
 from legendary.models.chunk import Chunk
 from legendary.models.downloading import (
-    DownloaderTask, DownloaderTaskResult,
-    WriterTask, WriterTaskResult,
-    TerminateWorkerTask, TaskFlags
+    DownloaderTaskResult, WriterTaskResult,
+    TerminateWorkerTask, TaskFlags,
+    pack_downloader_task, unpack_downloader_task,
+    pack_writer_tasks, unpack_writer_tasks
 )
 
+if sys.platform == 'linux':
+    import fcntl
+else:
+    fcntl = None
+
+# ioctl for creating a copy-on-write clone of a file (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+def copy_file(src, dst):
+    """
+    Copies a file, using a copy-on-write clone (reflink) if the filesystem supports it.
+    Falls back to copy_file_range (which lets the kernel/filesystem do the copy) or a regular copy.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if fcntl:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0 and (copied := os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)):
+                    remaining -= copied
+                if remaining <= 0:
+                    return
+            except OSError:
+                pass
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+
+def _result(task, success, size=0, skipped=0):
+    """Fills in a task that was decoded as a result (see unpack_writer_tasks) so it can be sent back"""
+    task.success = success
+    task.size = size
+    task.skipped = skipped
+    return task
+
+
+_zeros = bytes(1024 * 1024)
+# zero-filled ranges smaller than this are written normally, holes are allocated in blocks anyway
+SPARSE_MIN_SIZE = 4096
+
+
+# limits for collecting data before writing it with a single writev() call
+MAX_WRITE_BUFFERS = 512
+MAX_WRITE_SIZE = 16 * 1024 * 1024
+
+
+def write_buffers(f, buffers):
+    """Writes a list of bytes-like objects to an unbuffered file, using as few system calls as possible"""
+    if not hasattr(os, 'writev'):
+        for buf in buffers:
+            view = memoryview(buf)
+            while view:
+                view = view[f.write(view):]
+        return
+
+    fd = f.fileno()
+    buffers = [memoryview(buf) for buf in buffers]
+    i = 0
+    while i < len(buffers):
+        written = os.writev(fd, buffers[i:i + MAX_WRITE_BUFFERS])
+        # skip over completely written buffers and continue with the rest of a partially written one
+        while i < len(buffers) and written >= len(buffers[i]):
+            written -= len(buffers[i])
+            i += 1
+        if written:
+            buffers[i] = buffers[i][written:]
+
+
+def is_zero(data):
+    """Checks whether data (bytes-like) only contains null bytes"""
+    # startswith() boils down to a memcmp, this is much faster than any(), count() or comparing memoryviews
+    for i in range(0, len(data), len(_zeros)):
+        if not _zeros.startswith(data[i:i + len(_zeros)]):
+            return False
+    return True
+
 
 class BindingHTTPAdapter(HTTPAdapter):
     def __init__(self, addr):
@@ -68,7 +158,7 @@ class DLWorker(Process):
         empty = False
         while True:
             try:
-                job: DownloaderTask = self.q.get(timeout=10.0)
+                job = self.q.get(timeout=10.0)
                 empty = False
             except Empty:
                 if not empty:
@@ -80,6 +170,8 @@ class DLWorker(Process):
                 logger.debug('Worker received termination signal, shutting down...')
                 break
 
+            # the task is decoded as a (failed) result that is filled in and sent back once done
+            job: DownloaderTaskResult = unpack_downloader_task(job, as_result=True)
             tries = 0
             compressed = 0
             chunk = None
@@ -114,14 +206,15 @@ class DLWorker(Process):
             except Exception as e:
                 logger.error(f'Job for {job.chunk_guid} failed with: {e!r}, fetching next one...')
                 # add failed job to result queue to be requeued
-                self.o_q.put(DownloaderTaskResult(success=False, **job.__dict__))
+                self.o_q.put(pack_downloader_task(job))
+                continue
             except KeyboardInterrupt:
                 logger.warning('Immediate exit requested, quitting...')
                 break
 
             if not chunk:
                 logger.warning('Chunk somehow None?')
-                self.o_q.put(DownloaderTaskResult(success=False, **job.__dict__))
+                self.o_q.put(pack_downloader_task(job))
                 continue
 
             # decompress stuff
@@ -133,11 +226,14 @@ class DLWorker(Process):
 
                 self.shm.buf[job.shm.offset:job.shm.offset + size] = data
                 del chunk
-                self.o_q.put(DownloaderTaskResult(success=True, size_decompressed=size,
-                                                  size_downloaded=compressed, **job.__dict__))
+                job.success = True
+                job.size_decompressed = size
+                job.size_downloaded = compressed
+                self.o_q.put(pack_downloader_task(job))
             except Exception as e:
                 logger.warning(f'Job for {job.chunk_guid} failed with: {e!r}, fetching next one...')
-                self.o_q.put(DownloaderTaskResult(success=False, **job.__dict__))
+                job.success = False
+                self.o_q.put(pack_downloader_task(job))
                 continue
             except KeyboardInterrupt:
                 logger.warning('Immediate exit requested, quitting...')
@@ -169,52 +265,117 @@ class FileWorker(Process):
 
         last_filename = ''
         current_file = None
+        # whether zero-filled ranges can be skipped in the current file, and whether the last write was skipped
+        sparse = sparse_tail = False
+        # directories that have already been created
+        created_dirs = set()
+        # tasks are received (and results sent) in batches to cut down on IPC overhead
+        batch = deque()
+        results = []
+        # data of consecutive chunk writes is collected and written with a single system call, the results of
+        # those tasks may only be sent afterwards since they release the shared memory the data is read from
+        pending = []
+        pending_results = []
+        pending_size = 0
+
+        def flush_writes():
+            nonlocal pending_size
+            if not pending:
+                return
+            try:
+                write_buffers(current_file, pending)
+            except Exception as e:
+                logger.warning(f'Something in writing a file failed: {e!r}')
+                for res in pending_results:
+                    res.success = False
+            results.extend(pending_results)
+            pending.clear()
+            pending_results.clear()
+            pending_size = 0
+
+        def flush_results():
+            if results:
+                self.o_q.put(pack_writer_tasks(results))
+                results.clear()
 
         while True:
             try:
-                try:
-                    j: WriterTask = self.q.get(timeout=10.0)
-                except Empty:
-                    logger.warning('Writer queue empty!')
-                    continue
+                if not batch:
+                    # write out everything and report back before waiting for more tasks
+                    flush_writes()
+                    flush_results()
+                    try:
+                        item = self.q.get(timeout=10.0)
+                    except Empty:
+                        logger.warning('Writer queue empty!')
+                        continue
+                    if isinstance(item, bytes):
+                        # tasks are decoded as (failed) results that are filled in and sent back once done
+                        batch.extend(unpack_writer_tasks(item, as_results=True))
+                    else:
+                        batch.append(item)
+
+                j: WriterTaskResult = batch.popleft()
 
                 if isinstance(j, TerminateWorkerTask):
+                    flush_writes()
                     if current_file:
                         current_file.close()
+                    flush_results()
                     logger.debug('Worker received termination signal, shutting down...')
                     # send termination task to results halnder as well
                     self.o_q.put(TerminateWorkerTask())
                     break
 
+                # everything other than sequential writes to the current file needs collected data to be written first
+                if pending and (j.flags & ~TaskFlags.RELEASE_MEMORY or j.file_offset is not None):
+                    flush_writes()
+
                 # make directories if required
-                path = os.path.split(j.filename)[0]
-                if not os.path.exists(os.path.join(self.base_path, path)):
-                    os.makedirs(os.path.join(self.base_path, path))
+                path = os.path.join(self.base_path, os.path.split(j.filename)[0])
+                if path not in created_dirs:
+                    os.makedirs(path, exist_ok=True)
+                    created_dirs.add(path)
 
                 full_path = os.path.join(self.base_path, j.filename)
 
                 if j.flags & TaskFlags.CREATE_EMPTY_FILE:  # just create an empty file
                     open(full_path, 'a').close()
-                    self.o_q.put(WriterTaskResult(success=True, **j.__dict__))
+                    results.append(_result(j, True))
                     continue
                 elif j.flags & TaskFlags.OPEN_FILE:
                     if current_file:
                         logger.warning(f'Opening new file {j.filename} without closing previous! {last_filename}')
                         current_file.close()
 
-                    current_file = open(full_path, 'wb')
+                    if not j.flags & TaskFlags.PATCH_FILE:
+                        # do not write through a hardlink created by deduplication, that would change both files
+                        try:
+                            if os.stat(full_path).st_nlink > 1:
+                                os.remove(full_path)
+                        except OSError:
+                            pass
+
+                    # unbuffered, writes are collected and written in one go instead
+                    current_file = open(full_path, 'r+b' if j.flags & TaskFlags.PATCH_FILE else 'wb', buffering=0)
                     last_filename = j.filename
+                    # when patching in place existing data has to be overwritten with zeros
+                    sparse = not j.flags & TaskFlags.PATCH_FILE
+                    sparse_tail = False
 
-                    self.o_q.put(WriterTaskResult(success=True, **j.__dict__))
+                    results.append(_result(j, True))
                     continue
                 elif j.flags & TaskFlags.CLOSE_FILE:
                     if current_file:
+                        if sparse_tail:
+                            # the file ends with a hole, extend it to the correct size
+                            current_file.truncate()
                         current_file.close()
                         current_file = None
                     else:
                         logger.warning(f'Asking to close file that is not open: {j.filename}')
 
-                    self.o_q.put(WriterTaskResult(success=True, **j.__dict__))
+                    results.append(_result(j, True))
                     continue
                 elif j.flags & TaskFlags.RENAME_FILE:
                     if current_file:
@@ -226,17 +387,42 @@ class FileWorker(Process):
                             os.remove(full_path)
                         except OSError as e:
                             logger.error(f'Removing file failed: {e!r}')
-                            self.o_q.put(WriterTaskResult(success=False, **j.__dict__))
+                            results.append(_result(j, False))
                             continue
 
                     try:
                         os.rename(os.path.join(self.base_path, j.old_file), full_path)
                     except OSError as e:
                         logger.error(f'Renaming file failed: {e!r}')
-                        self.o_q.put(WriterTaskResult(success=False, **j.__dict__))
+                        results.append(_result(j, False))
+                        continue
+
+                    results.append(_result(j, True))
+                    continue
+                elif j.flags & (TaskFlags.COPY_FILE | TaskFlags.LINK_FILE):
+                    if current_file:
+                        logger.warning('Trying to copy file without closing first!')
+                        current_file.close()
+                        current_file = None
+
+                    source_path = os.path.join(self.base_path, j.old_file)
+                    try:
+                        if os.path.lexists(full_path):
+                            os.remove(full_path)
+                        if j.flags & TaskFlags.LINK_FILE:
+                            try:
+                                os.link(source_path, full_path)
+                            except OSError as e:
+                                logger.debug(f'Creating hardlink failed with {e!r}, copying file instead.')
+                                copy_file(source_path, full_path)
+                        else:
+                            copy_file(source_path, full_path)
+                    except OSError as e:
+                        logger.error(f'Copying file failed: {e!r}')
+                        results.append(_result(j, False))
                         continue
 
-                    self.o_q.put(WriterTaskResult(success=True, **j.__dict__))
+                    results.append(_result(j, True))
                     continue
                 elif j.flags & TaskFlags.DELETE_FILE:
                     if current_file:
@@ -250,7 +436,7 @@ class FileWorker(Process):
                         if not j.flags & TaskFlags.SILENT:
                             logger.error(f'Removing file failed: {e!r}')
 
-                    self.o_q.put(WriterTaskResult(success=True, **j.__dict__))
+                    results.append(_result(j, True))
                     continue
                 elif j.flags & TaskFlags.MAKE_EXECUTABLE:
                     if current_file:
@@ -265,32 +451,57 @@ class FileWorker(Process):
                         if not j.flags & TaskFlags.SILENT:
                             logger.error(f'chmod\'ing file failed: {e!r}')
 
-                    self.o_q.put(WriterTaskResult(success=True, **j.__dict__))
+                    results.append(_result(j, True))
                     continue
 
                 try:
-                    if j.shared_memory:
+                    if j.file_offset is not None:
+                        current_file.seek(j.file_offset)
+
+                    data = None
+                    if j.flags & TaskFlags.ZERO_FILL:
+                        pass
+                    elif j.shared_memory:
                         shm_offset = j.shared_memory.offset + j.chunk_offset
                         shm_end = shm_offset + j.chunk_size
-                        current_file.write(self.shm.buf[shm_offset:shm_end])
+                        data = self.shm.buf[shm_offset:shm_end]
                     elif j.cache_file:
                         with open(os.path.join(self.cache_path, j.cache_file), 'rb') as f:
                             if j.chunk_offset:
                                 f.seek(j.chunk_offset)
-                            current_file.write(f.read(j.chunk_size))
+                            data = f.read(j.chunk_size)
                     elif j.old_file:
                         with open(os.path.join(self.base_path, j.old_file), 'rb') as f:
                             if j.chunk_offset:
                                 f.seek(j.chunk_offset)
-                            current_file.write(f.read(j.chunk_size))
+                            data = f.read(j.chunk_size)
+
+                    # seek over zero-filled ranges instead of writing them so the filesystem can leave a hole
+                    if sparse and j.chunk_size >= SPARSE_MIN_SIZE and (data is None or is_zero(data)):
+                        flush_writes()
+                        current_file.seek(j.chunk_size, os.SEEK_CUR)
+                        sparse_tail = True
+                        results.append(_result(j, True, size=j.chunk_size, skipped=j.chunk_size))
+                        continue
+
+                    if data is None:
+                        zeros = memoryview(_zeros)
+                        pending.extend(zeros[:j.chunk_size - i] for i in range(0, j.chunk_size, len(_zeros)))
+                    else:
+                        pending.append(data)
+                    pending_results.append(_result(j, True, size=j.chunk_size))
+                    pending_size += j.chunk_size
+                    sparse_tail = False
+
+                    if len(pending) >= MAX_WRITE_BUFFERS or pending_size >= MAX_WRITE_SIZE:
+                        flush_writes()
                 except Exception as e:
                     logger.warning(f'Something in writing a file failed: {e!r}')
-                    self.o_q.put(WriterTaskResult(success=False, size=j.chunk_size, **j.__dict__))
-                else:
-                    self.o_q.put(WriterTaskResult(success=True, size=j.chunk_size, **j.__dict__))
+                    results.append(_result(j, False, size=j.chunk_size))
             except Exception as e:
                 logger.warning(f'Job {j.filename} failed with: {e!r}, fetching next one...')
-                self.o_q.put(WriterTaskResult(success=False, **j.__dict__))
+                results.append(_result(j, False))
+                flush_writes()
 
                 try:
                     if current_file:
@@ -0,0 +1,261 @@
+# coding: utf-8
+
+import logging
+import os
+import threading
+
+from uuid import uuid4
+
+from filelock import FileLock, Timeout
+
+logger = logging.getLogger('ChunkStore')
+
+
+class ChunkStore:
+    """
+    Content-addressed on-disk store for chunk data with an optional size limit.
+
+    Entries are keyed by the chunk's rolling hash and GUID ("<hash>_<guid>", as in CDN chunk file names)
+    and stored as "<path>/<first two key chars>/<key><suffix>". When the limit is exceeded the least recently
+    used entries (by modification time, which is updated on access) are evicted.
+
+    A store holds either chunk files as served by the CDN (FORMAT_CDN, used by the chunk proxy) or the raw
+    uncompressed chunk data (FORMAT_RAW, used by installs), the format is recorded in the store's directory.
+    """
+    FORMAT_CDN = 'cdn'
+    FORMAT_RAW = 'raw'
+    _suffixes = {FORMAT_CDN: '.chunk', FORMAT_RAW: '.raw'}
+    _format_file = '.format'
+
+    def __init__(self, path, max_size=0, data_format=FORMAT_CDN):
+        self.path = path
+        self.max_size = max_size
+        self.data_format = data_format
+        self.suffix = self._suffixes[data_format]
+        self.size = 0
+
+        self._lock = threading.Lock()
+        # key -> size
+        self._entries = dict()
+        # pin files created by this instance, name -> lock held while they are valid
+        self._pins = dict()
+        self._pin_path = os.path.join(self.path, '.pins')
+
+        os.makedirs(self.path, exist_ok=True)
+        self._check_format()
+        self._scan()
+
+    def __getstate__(self):
+        # locks cannot be pickled, this is required to pass the store to other processes
+        # (pins stay with the process that created them)
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_pins'] = dict()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _check_format(self):
+        format_path = os.path.join(self.path, self._format_file)
+        try:
+            with open(format_path, 'r', encoding='utf-8') as f:
+                data_format = f.read().strip()
+        except FileNotFoundError:
+            with open(format_path, 'w', encoding='utf-8') as f:
+                f.write(self.data_format)
+            return
+
+        if data_format != self.data_format:
+            raise ValueError(f'"{self.path}" contains chunks in "{data_format}" format, '
+                             f'but "{self.data_format}" is required')
+
+    @staticmethod
+    def get_key(guid_num, rolling_hash):
+        return f'{rolling_hash:016X}_{guid_num:032X}'
+
+    def _scan(self):
+        for dirpath, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if not filename.endswith(self.suffix):
+                    # left over from an interrupted write
+                    if filename.endswith('.tmp'):
+                        try:
+                            os.remove(os.path.join(dirpath, filename))
+                        except OSError:
+                            pass
+                    continue
+                try:
+                    size = os.path.getsize(os.path.join(dirpath, filename))
+                except OSError:
+                    continue
+                self._entries[filename[:-len(self.suffix)]] = size
+                self.size += size
+
+        logger.debug(f'Chunk store "{self.path}" contains {len(self._entries)} entries '
+                     f'({self.size / 1024 / 1024:.02f} MiB)')
+
+    def get_path(self, key):
+        return os.path.join(self.path, key[:2], key + self.suffix)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get_size(self, key):
+        return self._entries.get(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def touch(self, key):
+        """Marks entry as recently used"""
+        try:
+            os.utime(self.get_path(key))
+        except OSError:
+            pass
+
+    def get(self, key):
+        """Returns the stored data for key or None"""
+        if key not in self._entries:
+            return None
+
+        try:
+            with open(self.get_path(key), 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            logger.warning(f'Reading "{key}" from chunk store failed with {e!r}')
+            with self._lock:
+                if (size := self._entries.pop(key, None)) is not None:
+                    self.size -= size
+            return None
+
+        self.touch(key)
+        return data
+
+    def put(self, key, data):
+        """Stores data under key, returns whether it was stored"""
+        if key in self._entries:
+            return True
+        if self.max_size and len(data) > self.max_size:
+            return False
+
+        path = self.get_path(key)
+        tmp_path = f'{path}.{uuid4().hex}.tmp'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f'Writing "{key}" to chunk store failed with {e!r}')
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = len(data)
+                self.size += len(data)
+
+        if self.max_size and self.size > self.max_size:
+            self.evict()
+        return True
+
+    def pin(self, keys):
+        """
+        Protects entries from being evicted, also by other processes using the store, until unpin() is called
+        or the process exits. Entries may have been evicted before they were pinned, so callers should check
+        that they still exist afterwards.
+        """
+        os.makedirs(self._pin_path, exist_ok=True)
+        name = f'{os.getpid()}-{uuid4().hex}'
+        lock = FileLock(os.path.join(self._pin_path, f'{name}.lock'))
+        lock.acquire()
+        with open(os.path.join(self._pin_path, f'{name}.pin'), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(keys))
+        self._pins[name] = lock
+
+    def unpin(self):
+        """Releases all pins created by this instance"""
+        for name, lock in self._pins.items():
+            for ext in ('pin', 'lock'):
+                try:
+                    os.remove(os.path.join(self._pin_path, f'{name}.{ext}'))
+                except OSError:
+                    pass
+            lock.release()
+        self._pins.clear()
+
+    def get_pinned(self):
+        """Returns the keys pinned by any process, pins of processes that have exited are removed"""
+        try:
+            filenames = os.listdir(self._pin_path)
+        except FileNotFoundError:
+            return set()
+
+        pinned = set()
+        for filename in filenames:
+            if not filename.endswith('.pin'):
+                continue
+            name = filename[:-4]
+            if name not in self._pins:
+                # the lock is held for as long as the pin is valid
+                lock = FileLock(os.path.join(self._pin_path, f'{name}.lock'), timeout=0)
+                try:
+                    lock.acquire()
+                except Timeout:
+                    pass
+                else:
+                    logger.debug(f'Removing stale pin "{name}"')
+                    for ext in ('pin', 'lock'):
+                        try:
+                            os.remove(os.path.join(self._pin_path, f'{name}.{ext}'))
+                        except OSError:
+                            pass
+                    lock.release()
+                    continue
+            try:
+                with open(os.path.join(self._pin_path, filename), 'r', encoding='utf-8') as f:
+                    pinned.update(f.read().split())
+            except OSError:
+                pass
+        return pinned
+
+    def evict(self, target_size=None):
+        """Removes least recently used entries until the store is below target size (default: the size limit)"""
+        if target_size is None:
+            target_size = self.max_size
+
+        with self._lock:
+            if self.size <= target_size:
+                return
+
+            ages = []
+            for key in self._entries:
+                try:
+                    ages.append((os.path.getmtime(self.get_path(key)), key))
+                except OSError:
+                    ages.append((0, key))
+            ages.sort()
+
+            pinned = self.get_pinned()
+            removed = 0
+            for _, key in ages:
+                if self.size <= target_size:
+                    break
+                if key in pinned:
+                    continue
+                try:
+                    os.remove(self.get_path(key))
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logger.warning(f'Removing "{key}" from chunk store failed with {e!r}')
+                    continue
+                self.size -= self._entries.pop(key)
+                removed += 1
+
+        logger.debug(f'Evicted {removed} entries from chunk store, new size: {self.size / 1024 / 1024:.02f} MiB')
@@ -5,7 +5,7 @@ import os
 import logging
 
 from contextlib import contextmanager
-from collections import defaultdict
+from collections import Counter
 from pathlib import Path
 from time import time
 
@@ -13,6 +13,7 @@ from filelock import FileLock
 
 from .utils import clean_filename, LockedJSONData
 
+from legendary import __version__
 from legendary.models.game import *
 from legendary.utils.aliasing import generate_aliases
 from legendary.models.config import LGDConf
@@ -22,16 +23,20 @@ from legendary.utils.env import is_windows_mac_or_pyi
 FILELOCK_DEBUG = False
 
 
+def get_config_path():
+    if config_path := os.environ.get('LEGENDARY_CONFIG_PATH'):
+        return config_path
+    elif config_path := os.environ.get('XDG_CONFIG_HOME'):
+        return os.path.join(config_path, 'legendary')
+    else:
+        return os.path.expanduser('~/.config/legendary')
+
+
 class LGDLFS:
     def __init__(self, config_file=None):
         self.log = logging.getLogger('LGDLFS')
 
-        if config_path := os.environ.get('LEGENDARY_CONFIG_PATH'):
-            self.path = config_path
-        elif config_path := os.environ.get('XDG_CONFIG_HOME'):
-            self.path = os.path.join(config_path, 'legendary')
-        else:
-            self.path = os.path.expanduser('~/.config/legendary')
+        self.path = get_config_path()
 
         # EGS user info
         self._user_data = None
@@ -97,6 +102,27 @@ class LGDLFS:
             filelock_logger = logging.getLogger('filelock')
             filelock_logger.setLevel(logging.INFO)
 
+        self._load_config()
+
+        self._installed_lock = FileLock(os.path.join(self.path, 'installed.json') + '.lock')
+
+        try:
+            self._installed = json.load(open(os.path.join(self.path, 'installed.json')))
+        except Exception as e:
+            self.log.debug(f'Loading installed games failed: {e!r}')
+            self._installed = None
+
+        # load existing app metadata
+        for gm_file in os.listdir(os.path.join(self.path, 'metadata')):
+            try:
+                _meta = json.load(open(os.path.join(self.path, 'metadata', gm_file)))
+                self._game_metadata[_meta['app_name']] = _meta
+            except Exception as e:
+                self.log.debug(f'Loading game meta file "{gm_file}" failed: {e!r}')
+
+        self.reload_aliases()
+
+    def _load_config(self):
         # try loading config
         try:
             self.config.read(self.config_path)
@@ -118,22 +144,12 @@ class LGDLFS:
             self.config.set('Legendary', '; Disables the notice about an available update on exit')
             self.config.set('Legendary', 'disable_update_notice', 'false' if is_windows_mac_or_pyi() else 'true')
 
-        self._installed_lock = FileLock(os.path.join(self.path, 'installed.json') + '.lock')
-
-        try:
-            self._installed = json.load(open(os.path.join(self.path, 'installed.json')))
-        except Exception as e:
-            self.log.debug(f'Loading installed games failed: {e!r}')
-            self._installed = None
-
-        # load existing app metadata
-        for gm_file in os.listdir(os.path.join(self.path, 'metadata')):
-            try:
-                _meta = json.load(open(os.path.join(self.path, 'metadata', gm_file)))
-                self._game_metadata[_meta['app_name']] = _meta
-            except Exception as e:
-                self.log.debug(f'Loading game meta file "{gm_file}" failed: {e!r}')
+    def reload_config(self):
+        """Re-read the config file, e.g. after it has been modified by another process"""
+        self.config = LGDConf(comment_prefixes='/', allow_no_value=True)
+        self._load_config()
 
+    def reload_aliases(self):
         # load auto-aliases if enabled
         self.aliases = dict()
         if not self.config.getboolean('Legendary', 'disable_auto_aliasing', fallback=False):
@@ -145,6 +161,12 @@ class LGDLFS:
             except Exception as e:
                 self.log.debug(f'Loading aliases failed with {e!r}')
 
+    def invalidate_cached_data(self):
+        """Drop cached user data, entitlements and assets so they are loaded from disk again when needed"""
+        self._user_data = None
+        self._entitlements = None
+        self._assets = None
+
     @property
     @contextmanager
     def userdata_lock(self) -> LockedJSONData:
@@ -311,15 +333,17 @@ class LGDLFS:
         try:
             self._installed_lock.acquire(blocking=False)
             # reload data in case it has been updated elsewhere
-            try:
-                self._installed = json.load(open(os.path.join(self.path, 'installed.json')))
-            except Exception as e:
-                self.log.debug(f'Failed to load installed game data: {e!r}')
-
+            self.reload_installed()
             return True
         except TimeoutError:
             return False
 
+    def reload_installed(self):
+        try:
+            self._installed = json.load(open(os.path.join(self.path, 'installed.json')))
+        except Exception as e:
+            self.log.debug(f'Failed to load installed game data: {e!r}')
+
     def get_installed_game(self, app_name):
         if self._installed is None:
             try:
@@ -415,6 +439,16 @@ class LGDLFS:
                   open(os.path.join(self.path, 'tmp', f'{app_name}.json'), 'w'),
                   indent=2, sort_keys=True)
 
+    def get_save_index(self, app_name):
+        try:
+            return json.load(open(os.path.join(self.path, 'tmp', f'{app_name}.saves.json')))
+        except Exception as e:
+            self.log.debug(f'Failed to load save index: {e!r}')
+            return None
+
+    def set_save_index(self, app_name, save_index):
+        json.dump(save_index, open(os.path.join(self.path, 'tmp', f'{app_name}.saves.json'), 'w'))
+
     def get_cached_overlay_version(self):
         if self._overlay_update_info:
             return self._overlay_update_info
@@ -459,33 +493,48 @@ class LGDLFS:
     def generate_aliases(self):
         self.log.debug('Generating list of aliases...')
 
-        self.aliases = dict()
-        aliases = set()
-        collisions = set()
-        alias_map = defaultdict(set)
+        # The alias index caches the generated aliases per title, so only new or changed titles
+        # have to be processed. It is invalidated when the alias generation (legendary version) changes.
+        index_path = os.path.join(self.path, 'alias_index.json')
+        try:
+            index = json.load(open(index_path))
+            if index.get('version') != __version__:
+                index = None
+        except Exception as e:
+            self.log.debug(f'Loading alias index failed with {e!r}')
+            index = None
 
-        for app_name in self._game_metadata.keys():
-            game = self.get_game_meta(app_name)
-            if game.is_dlc:
+        cached = index['apps'] if index else dict()
+        apps = dict()
+        index_changed = index is None
+
+        for app_name, _meta in self._game_metadata.items():
+            metadata = _meta.get('metadata') or dict()
+            # skip DLC (see Game.is_dlc)
+            if 'mainGameItem' in metadata:
+                continue
+            game_folder = metadata.get('customAttributes', {}).get('FolderName', {}).get('value', None)
+            key = [_meta['app_title'], game_folder]
+            if (entry := cached.get(app_name)) and entry['key'] == key:
+                apps[app_name] = entry
                 continue
-            game_folder = game.metadata.get('customAttributes', {}).get('FolderName', {}).get('value', None)
-            _aliases = generate_aliases(game.app_title, game_folder=game_folder, app_name=game.app_name)
-            for alias in _aliases:
-                if alias not in aliases:
-                    aliases.add(alias)
-                    alias_map[game.app_name].add(alias)
-                else:
-                    collisions.add(alias)
-
-        # remove colliding aliases from map and add aliases to lookup table
-        for app_name, aliases in alias_map.items():
-            alias_map[app_name] -= collisions
-            for alias in alias_map[app_name]:
-                self.aliases[alias] = app_name
-
-        def serialise_sets(obj):
-            """Turn sets into sorted lists for storage"""
-            return sorted(obj) if isinstance(obj, set) else obj
 
+            index_changed = True
+            apps[app_name] = dict(key=key, aliases=generate_aliases(_meta['app_title'], game_folder=game_folder,
+                                                                    app_name=app_name))
+
+        if index_changed or len(apps) != len(cached):
+            json.dump(dict(version=__version__, apps=apps), open(index_path, 'w'))
+
+        # aliases used by more than one title are not used at all
+        alias_counts = Counter(alias for entry in apps.values() for alias in entry['aliases'])
+        alias_map = {app_name: sorted(a for a in entry['aliases'] if alias_counts[a] == 1)
+                     for app_name, entry in apps.items()}
+
+        aliases = {alias: app_name for app_name, _aliases in alias_map.items() for alias in _aliases}
+        if aliases == self.aliases and os.path.exists(os.path.join(self.path, 'aliases.json')):
+            return
+
+        self.aliases = aliases
         json.dump(alias_map, open(os.path.join(self.path, 'aliases.json'), 'w', newline='\n'),
-                  indent=2, sort_keys=True, default=serialise_sets)
+                  indent=2, sort_keys=True)
@@ -0,0 +1,120 @@
+# coding: utf-8
+
+import hashlib
+import logging
+import os
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from legendary.utils.rolling_hash import scan
+
+logger = logging.getLogger('Salvage')
+
+# set in worker processes: window size -> (set of rolling hashes, {rolling hash: [(guid_num, sha_hash)]})
+_candidates = None
+
+
+def _init_worker(candidates):
+    global _candidates
+    _candidates = candidates
+
+
+class _RangeReader:
+    """Wraps a file object so that reads stop after a number of bytes"""
+    def __init__(self, f, size):
+        self.f = f
+        self.remaining = size
+
+    def read(self, size):
+        if self.remaining <= 0:
+            return b''
+        data = self.f.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+
+def _scan_range(path, start, end, window):
+    hashes, by_hash = _candidates[window]
+    found = dict()
+
+    with open(path, 'rb') as f, open(path, 'rb') as vf:
+        f.seek(start)
+        # windows starting within the range may extend past its end
+        for offset, h in scan(_RangeReader(f, end - start + window - 1), hashes, window):
+            vf.seek(start + offset)
+            sha_hash = hashlib.sha1(vf.read(window)).digest()
+            for guid_num, chunk_sha in by_hash[h]:
+                # windows are not necessarily found in order, keep the first occurrence
+                if sha_hash == chunk_sha and (guid_num not in found or found[guid_num] > start + offset):
+                    found[guid_num] = start + offset
+
+    return path, start, end, found
+
+
+def find_chunks(paths, chunks, max_workers=0, range_size=256 * 1024 * 1024):
+    """
+    Searches files for the data of chunks, regardless of where in the files it is located.
+
+    Candidates are found by their rolling hash and then confirmed using the SHA-1 hash,
+    only chunks that are contained in a file in their entirety can be found.
+
+    :param paths: files to search
+    :param chunks: ChunkInfo objects to look for
+    :param max_workers: number of processes to use (default: CPU count)
+    :param range_size: files are split into ranges of this size so large files can be searched in parallel
+    :return: dict of chunk GUID (num) -> list of (path, offset), with one location per file in the order of paths
+    """
+    candidates = defaultdict(lambda: (set(), defaultdict(list)))
+    for chunk in chunks:
+        hashes, by_hash = candidates[chunk.window_size]
+        hashes.add(chunk.hash)
+        by_hash[chunk.hash].append((chunk.guid_num, chunk.sha_hash))
+    candidates = {window: (hashes, dict(by_hash)) for window, (hashes, by_hash) in candidates.items()}
+
+    jobs = []
+    for path in paths:
+        try:
+            file_size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f'Cannot access "{path}": {e!r}')
+            continue
+        for window in candidates:
+            if file_size < window:
+                continue
+            last_start = file_size - window + 1
+            for start in range(0, last_start, range_size):
+                jobs.append((path, start, min(start + range_size, last_start), window))
+
+    if not jobs:
+        return dict()
+
+    total = sum(end - start for _, start, end, _ in jobs)
+    logger.info(f'Searching {len(paths)} file(s) ({total / 1024 / 1024:.02f} MiB) for usable chunk data...')
+
+    # chunk GUID -> {path: offset}
+    results = defaultdict(dict)
+    scanned = 0
+    with ProcessPoolExecutor(max_workers=max_workers or None, initializer=_init_worker,
+                             initargs=(candidates,)) as executor:
+        futures = [executor.submit(_scan_range, *job) for job in jobs]
+        for i, future in enumerate(as_completed(futures), start=1):
+            try:
+                path, start, end, found = future.result()
+            except Exception as e:
+                logger.warning(f'Searching file failed with {e!r}')
+                continue
+
+            for guid_num, offset in found.items():
+                locations = results[guid_num]
+                if path not in locations or locations[path] > offset:
+                    locations[path] = offset
+            scanned += end - start
+            logger.debug(f'[{i}/{len(jobs)}] Searched "{path}" ({scanned / 1024 / 1024:.02f} MiB done), '
+                         f'{len(results)} chunks found so far')
+
+    logger.info(f'Found {len(results)} of {len(chunks)} chunks in local files.')
+    # ranges finish in no particular order, sort locations so the result does not depend on it
+    path_order = {path: i for i, path in enumerate(paths)}
+    return {guid_num: sorted(locations.items(), key=lambda loc: path_order[loc[0]])
+            for guid_num, locations in results.items()}
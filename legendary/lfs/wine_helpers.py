@@ -2,16 +2,72 @@ import configparser
 import logging
 import os
 
+from collections import OrderedDict
+from threading import Lock
+
 logger = logging.getLogger('WineHelpers')
 
+# Both caches are LRU-bounded since they live as long as the process (e.g. the daemon)
+_REGISTRY_CACHE_SIZE = 8
+_DIR_CACHE_SIZE = 256
+# parsed registry files, keyed by path: ((mtime, size), ConfigParser)
+_registry_cache = OrderedDict()
+# directory listings (subdirectories only), keyed by path: (mtime, list of names)
+_dir_cache = OrderedDict()
+_cache_lock = Lock()
+
+
+def _cache_get(cache, key, file_id):
+    with _cache_lock:
+        if (cached := cache.get(key)) and cached[0] == file_id:
+            cache.move_to_end(key)
+            return cached[1]
+    return None
+
+
+def _cache_put(cache, max_size, key, file_id, value):
+    with _cache_lock:
+        cache[key] = (file_id, value)
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
 
 def read_registry(wine_pfx):
+    """
+    Parse the user registry of a WINE prefix.
+    The result is cached until the file changes and must be treated as read-only.
+    """
+    reg_path = os.path.join(wine_pfx, 'user.reg')
+    try:
+        st = os.stat(reg_path)
+        file_id = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        file_id = None
+
+    if file_id and (reg := _cache_get(_registry_cache, reg_path, file_id)) is not None:
+        return reg
+
     reg = configparser.ConfigParser(comment_prefixes=(';', '#', '/', 'WINE'), allow_no_value=True, strict=False)
     reg.optionxform = str
-    reg.read(os.path.join(wine_pfx, 'user.reg'))
+    reg.read(reg_path)
+    if file_id:
+        _cache_put(_registry_cache, _REGISTRY_CACHE_SIZE, reg_path, file_id, reg)
     return reg
 
 
+def _list_subdirectories(path):
+    """Returns names of subdirectories in path, cached until the directory is modified"""
+    mtime = os.stat(path).st_mtime_ns
+    if (dirs := _cache_get(_dir_cache, path, mtime)) is not None:
+        return dirs
+
+    with os.scandir(path) as it:
+        dirs = [entry.name for entry in it if entry.is_dir()]
+    _cache_put(_dir_cache, _DIR_CACHE_SIZE, path, mtime, dirs)
+    return dirs
+
+
 def get_shell_folders(registry, wine_pfx):
     folders = dict()
     for k, v in registry['Software\\\\Microsoft\\\\Windows\\\\CurrentVersion\\\\Explorer\\\\Shell Folders'].items():
@@ -75,9 +131,7 @@ def case_insensitive_path_search(path):
     # Iterate over remaining parts, find matching directories case-insensitively
     still_remaining = []
     for idx, part in enumerate(remaining_parts):
-        for item in os.listdir(os.path.join(*longest_path)):
-            if not os.path.isdir(os.path.join(*longest_path, item)):
-                continue
+        for item in _list_subdirectories(os.path.join(*longest_path)):
             if item.lower() == part.lower():
                 longest_path.append(item)
                 break
@@ -63,6 +63,21 @@ class Chunk:
         self.hash_type = 0x3
         self._data = value
 
+    @classmethod
+    def from_data(cls, data: bytes, guid, rolling_hash, sha_hash):
+        """
+        Create a chunk from data with known hashes (e.g. from a manifest's chunk info),
+        this avoids having to recalculate the (slow) rolling hash.
+        """
+        _chunk = cls()
+        _chunk.guid = guid
+        _chunk.hash = rolling_hash
+        _chunk.sha_hash = sha_hash
+        _chunk.hash_type = 0x3
+        _chunk.uncompressed_size = len(data)
+        _chunk._data = data
+        return _chunk
+
     @property
     def guid_str(self):
         if not self._guid_str:
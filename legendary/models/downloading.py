@@ -1,5 +1,7 @@
 # coding: utf-8
 
+import struct
+
 from enum import Flag, auto
 from dataclasses import dataclass
 from typing import Optional
@@ -52,6 +54,10 @@ class ChunkTask:
     cleanup: bool = False
     # Path to the file the chunk is read from (if not from memory)
     chunk_file: Optional[str] = None
+    # Position in the target file to write to (only when patching an existing file in place)
+    file_offset: Optional[int] = None
+    # Whether the chunk only contains zeros, so nothing has to be downloaded or read
+    zero: bool = False
 
 
 class TaskFlags(Flag):
@@ -64,6 +70,13 @@ class TaskFlags(Flag):
     RELEASE_MEMORY = auto()
     MAKE_EXECUTABLE = auto()
     SILENT = auto()
+    # open an existing file for in-place writes instead of truncating it
+    PATCH_FILE = auto()
+    # create file as a copy (or hardlink) of old_file
+    COPY_FILE = auto()
+    LINK_FILE = auto()
+    # chunk data is known to be all zeros and does not have to be read from anywhere
+    ZERO_FILL = auto()
 
 
 @dataclass
@@ -73,7 +86,7 @@ class FileTask:
     """
     filename: str
     flags: TaskFlags
-    # If rename is true, this is the name of the file to be renamed
+    # If rename is true, this is the name of the file to be renamed (or the source when copying)
     old_file: Optional[str] = None
 
 
@@ -88,6 +101,7 @@ class WriterTask:
     chunk_offset: int = 0
     chunk_size: int = 0
     chunk_guid: Optional[int] = None
+    file_offset: Optional[int] = None
 
     # Whether shared memory segment shall be released back to the pool on completion
     shared_memory: Optional[SharedMemorySegment] = None
@@ -104,6 +118,8 @@ class WriterTaskResult(WriterTask):
     """
     success: bool = False
     size: int = 0
+    # bytes that were zeros and skipped instead of written
+    skipped: int = 0
 
 
 @dataclass
@@ -135,6 +151,18 @@ class AnalysisResult:
     min_memory: int = 0
     num_chunks: int = 0
     num_chunks_cache: int = 0
+    store_size: int = 0
+    num_chunks_store: int = 0
+    seed_size: int = 0
+    salvage_size: int = 0
+    # files that are repaired in place and the size of the chunk parts that have to be rewritten in them
+    patched_files: int = 0
+    patch_size: int = 0
+    # files with the same contents as another file that are copied instead of written, and their size
+    dedup_files: int = 0
+    dedup_size: int = 0
+    # size of chunk parts known to be zero-filled, these are neither downloaded nor read
+    zero_size: int = 0
     num_files: int = 0
     removed: int = 0
     added: int = 0
@@ -158,3 +186,129 @@ class TerminateWorkerTask:
     """
     pass
 
+
+# Compact encoding of the messages exchanged between the download manager and its workers. Pickling the
+# dataclasses includes the class and all field names in every message, which is a significant part of the
+# manager's CPU time with many small chunk parts. Messages are lists of fixed-layout records instead,
+# the dataclasses above are what both sides work with.
+
+_HAS_GUID = 1
+_HAS_FILE_OFFSET = 2
+_HAS_SHM = 4
+_HAS_OLD_FILE = 8
+_HAS_CACHE_FILE = 16
+_SUCCESS = 32
+_IS_RESULT = 64
+_HAS_SIZES = 128
+
+# presence/success bits, flags, chunk offset, chunk size, file offset, chunk guid, shm offset, shm end,
+# size, skipped, and the lengths of the file name, old file, and cache file (which follow the record)
+_writer_record = struct.Struct('<BIQQQ16sQQQQHHH')
+# presence/success bits, chunk guid, shm offset, shm end, size downloaded, size decompressed, url length
+_downloader_record = struct.Struct('<B16sQQQQH')
+
+
+def pack_writer_tasks(tasks) -> bytes:
+    """Encodes a list of WriterTask/WriterTaskResult objects"""
+    parts = []
+    for t in tasks:
+        bits = 0
+        filename = t.filename.encode('utf-8')
+        old_file = cache_file = b''
+        if t.chunk_guid is not None:
+            bits |= _HAS_GUID
+        if t.file_offset is not None:
+            bits |= _HAS_FILE_OFFSET
+        if t.shared_memory is not None:
+            bits |= _HAS_SHM
+        if t.old_file is not None:
+            bits |= _HAS_OLD_FILE
+            old_file = t.old_file.encode('utf-8')
+        if t.cache_file is not None:
+            bits |= _HAS_CACHE_FILE
+            cache_file = t.cache_file.encode('utf-8')
+
+        size = skipped = 0
+        if isinstance(t, WriterTaskResult):
+            bits |= _IS_RESULT
+            if t.success:
+                bits |= _SUCCESS
+            size, skipped = t.size, t.skipped
+
+        shm = t.shared_memory
+        parts.append(_writer_record.pack(
+            bits, t.flags.value, t.chunk_offset, t.chunk_size, t.file_offset or 0,
+            (t.chunk_guid or 0).to_bytes(16, 'little'), shm.offset if shm else 0, shm.end if shm else 0,
+            size, skipped, len(filename), len(old_file), len(cache_file)
+        ))
+        parts.append(filename)
+        parts.append(old_file)
+        parts.append(cache_file)
+    return b''.join(parts)
+
+
+def unpack_writer_tasks(data: bytes, as_results=False) -> list:
+    """
+    Decodes a list of WriterTask/WriterTaskResult objects
+
+    :param data: encoded tasks
+    :param as_results: Decode tasks as (unsuccessful) results, so workers can fill them in and send them back
+    """
+    tasks = []
+    view = memoryview(data)
+    pos = 0
+    while pos < len(data):
+        (bits, flags, chunk_offset, chunk_size, file_offset, guid, shm_offset, shm_end,
+         size, skipped, fn_len, old_len, cache_len) = _writer_record.unpack_from(view, pos)
+        pos += _writer_record.size
+        filename = str(view[pos:pos + fn_len], 'utf-8')
+        pos += fn_len
+        old_file = str(view[pos:pos + old_len], 'utf-8') if bits & _HAS_OLD_FILE else None
+        pos += old_len
+        cache_file = str(view[pos:pos + cache_len], 'utf-8') if bits & _HAS_CACHE_FILE else None
+        pos += cache_len
+
+        kwargs = dict(
+            filename=filename, flags=TaskFlags(flags), chunk_offset=chunk_offset, chunk_size=chunk_size,
+            chunk_guid=int.from_bytes(guid, 'little') if bits & _HAS_GUID else None,
+            file_offset=file_offset if bits & _HAS_FILE_OFFSET else None,
+            shared_memory=SharedMemorySegment(shm_offset, shm_end) if bits & _HAS_SHM else None,
+            old_file=old_file, cache_file=cache_file
+        )
+        if bits & _IS_RESULT or as_results:
+            tasks.append(WriterTaskResult(success=bool(bits & _SUCCESS), size=size, skipped=skipped, **kwargs))
+        else:
+            tasks.append(WriterTask(**kwargs))
+    return tasks
+
+
+def pack_downloader_task(task: DownloaderTask) -> bytes:
+    """Encodes a DownloaderTask/DownloaderTaskResult"""
+    bits = 0
+    size_downloaded = size_decompressed = 0
+    if isinstance(task, DownloaderTaskResult):
+        bits |= _IS_RESULT
+        if task.success:
+            bits |= _SUCCESS
+        if task.size_downloaded is not None:
+            bits |= _HAS_SIZES
+            size_downloaded, size_decompressed = task.size_downloaded, task.size_decompressed or 0
+    url = task.url.encode('utf-8')
+    return _downloader_record.pack(bits, task.chunk_guid.to_bytes(16, 'little'), task.shm.offset, task.shm.end,
+                                   size_downloaded, size_decompressed, len(url)) + url
+
+
+def unpack_downloader_task(data: bytes, as_result=False):
+    """Decodes a DownloaderTask/DownloaderTaskResult (tasks as unsuccessful results if as_result is set)"""
+    bits, guid, shm_offset, shm_end, size_downloaded, size_decompressed, url_len = \
+        _downloader_record.unpack_from(data)
+    url = data[_downloader_record.size:_downloader_record.size + url_len].decode('utf-8')
+    shm = SharedMemorySegment(shm_offset, shm_end)
+    if not bits & _IS_RESULT and not as_result:
+        return DownloaderTask(url=url, chunk_guid=int.from_bytes(guid, 'little'), shm=shm)
+    elif bits & _HAS_SIZES:
+        return DownloaderTaskResult(url=url, chunk_guid=int.from_bytes(guid, 'little'), shm=shm,
+                                    success=bool(bits & _SUCCESS), size_downloaded=size_downloaded,
+                                    size_decompressed=size_decompressed)
+    return DownloaderTaskResult(url=url, chunk_guid=int.from_bytes(guid, 'little'), shm=shm,
+                                success=bool(bits & _SUCCESS))
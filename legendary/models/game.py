@@ -230,6 +230,7 @@ class SaveGameFile:
     filename: str
     manifest_name: str
     datetime: Optional[datetime] = None
+    read_link: Optional[str] = None
 
 
 class SaveGameStatus(Enum):
@@ -1,33 +1,46 @@
 # coding: utf-8
 
+import copy
 import json
 import struct
+import sys
 
-from copy import deepcopy
+from functools import lru_cache
 
 from legendary.models.manifest import (
-    Manifest, ManifestMeta, CDL, ChunkPart, ChunkInfo, FML, FileManifest, CustomFields
+    Manifest, ManifestMeta, CDL, ChunkPart, ChunkInfo, FML, FileManifest, CustomFields, guid_to_num
 )
 
 
-def blob_to_num(in_str):
+# lookup table for the three-digit groups used by blob numbers
+_blob_byte = {f'{i:03d}': i for i in range(256)}
+
+
+def blob_to_bytes(in_str):
     """
     The JSON manifest use a rather strange format for storing numbers.
 
     It's essentially %03d for each char concatenated to a string.
     ...instead of just putting the fucking number in the JSON...
 
-    Also it's still little endian so we have to bitshift it.
+    This returns the raw (little endian) bytes.
+
+    """
+    return bytes([_blob_byte[in_str[i:i + 3]] for i in range(0, len(in_str), 3)])
+
+
+@lru_cache(maxsize=65536)
+def blob_to_num(in_str):
+    """
+    Converts a blob string to a number, see blob_to_bytes().
+
+    Results are cached since offsets/sizes/groups repeat a lot within a manifest.
 
     """
-    num = 0
-    shift = 0
-    for i in range(0, len(in_str), 3):
-        num += (int(in_str[i:i + 3]) << shift)
-        shift += 8
-    return num
+    return int.from_bytes(blob_to_bytes(in_str), 'little')
 
 
+@lru_cache(maxsize=65536)
 def guid_from_json(in_str):
     return struct.unpack('>IIII', bytes.fromhex(in_str))
 
@@ -44,7 +57,8 @@ class JSONManifest(Manifest):
     @classmethod
     def read_all(cls, manifest):
         _m = cls.read(manifest)
-        _tmp = deepcopy(_m.json_data)
+        # the parsed data is consumed by the readers below, no need to keep a copy
+        _tmp = _m.json_data
 
         _m.meta = JSONManifestMeta.read(_tmp)
         _m.chunk_data_list = JSONCDL.read(_tmp, manifest_version=_m.version)
@@ -61,6 +75,16 @@ class JSONManifest(Manifest):
 
         return _m
 
+    @classmethod
+    def read_chunk_list(cls, manifest):
+        _m = cls.read(manifest)
+        _m.meta = JSONManifestMeta.read(_m.json_data)
+        _m.chunk_data_list = JSONCDL.read(_m.json_data, manifest_version=_m.version)
+        _m.data = b''
+        _m.json_data = None
+
+        return _m
+
     @classmethod
     def read(cls, manifest):
         _manifest = cls()
@@ -72,6 +96,18 @@ class JSONManifest(Manifest):
 
         return _manifest
 
+    def to_binary(self):
+        """
+        Serialises the manifest into the binary format, keeping the original feature level
+        so that chunk paths stay the same when the result is loaded again.
+
+        Writing updates the header fields and metadata of the manifest, so a copy is serialised
+        to leave this one (which may be in use for an install) untouched.
+        """
+        _m = copy.copy(self)
+        _m.meta = copy.copy(self.meta)
+        return _m.write(serialisation_version=self.meta.feature_level)
+
     def write(self, *args, **kwargs):
         # The version here only matters for the manifest header,
         # the feature level in meta determines chunk folders etc.
@@ -149,21 +185,19 @@ class JSONFML(FML):
         for _fmj in json_data.pop('FileManifestList'):
             _fm = FileManifest()
             _fm.filename = _fmj.pop('Filename', '')
-            _fm.hash = blob_to_num(_fmj.pop('FileHash')).to_bytes(160//8, 'little')
+            _fm.hash = blob_to_bytes(_fmj.pop('FileHash')).ljust(160//8, b'\x00')
             _fm.flags |= int(_fmj.pop('bIsReadOnly', False))
             _fm.flags |= int(_fmj.pop('bIsCompressed', False)) << 1
             _fm.flags |= int(_fmj.pop('bIsUnixExecutable', False)) << 2
             _fm.file_size = 0
             _fm.chunk_parts = []
-            _fm.install_tags = _fmj.pop('InstallTags', list())
+            _fm.install_tags = [sys.intern(tag) for tag in _fmj.pop('InstallTags', list())]
 
             _offset = 0
             for _cpj in _fmj.pop('FileChunkParts'):
-                _cp = ChunkPart()
-                _cp.guid = guid_from_json(_cpj.pop('Guid'))
-                _cp.offset = blob_to_num(_cpj.pop('Offset'))
-                _cp.size = blob_to_num(_cpj.pop('Size'))
-                _cp.file_offset = _offset
+                _guid = guid_from_json(_cpj.pop('Guid'))
+                _cp = ChunkPart(_guid, blob_to_num(_cpj.pop('Offset')), blob_to_num(_cpj.pop('Size')),
+                                _offset, guid_to_num(_guid))
                 _fm.file_size += _cp.size
                 if _cpj:
                     print(f'Non-read ChunkPart keys: {_cpj.keys()}')
@@ -5,6 +5,7 @@ from __future__ import annotations
 import hashlib
 import logging
 import struct
+import sys
 import zlib
 
 from base64 import b64encode
@@ -50,6 +51,10 @@ def write_fstring(bio, string):
         bio.write(b'\x00\x00')
 
 
+def guid_to_num(guid):
+    return guid[3] + (guid[2] << 32) + (guid[1] << 64) + (guid[0] << 96)
+
+
 def get_chunk_dir(version):
     # The lowest version I've ever seen was 12 (Unreal Tournament), but for completeness sake leave all of them in
     if version >= 15:
@@ -65,6 +70,8 @@ def get_chunk_dir(version):
 class Manifest:
     header_magic = 0x44BEC00C
     default_serialisation_version = 17
+    # size of compressed input fed to zlib per step when reading
+    _inflate_block_size = 4 * 1024 * 1024
 
     def __init__(self):
         self.header_size = 41
@@ -87,8 +94,7 @@ class Manifest:
 
     @classmethod
     def read_all(cls, data):
-        _m = cls.read(data)
-        _tmp = BytesIO(_m.data)
+        _m, _tmp = cls._read_body(data)
 
         _m.meta = ManifestMeta.read(_tmp)
         _m.chunk_data_list = CDL.read(_tmp, _m.meta.feature_level)
@@ -102,46 +108,81 @@ class Manifest:
         # Throw this away since the raw data is no longer needed
         _tmp.close()
         del _tmp
-        _m.data = b''
+
+        return _m
+
+    @classmethod
+    def read_chunk_list(cls, data):
+        """
+        Only reads the metadata and chunk data list, for cases where the file list is not needed
+        """
+        _m, _tmp = cls._read_body(data)
+
+        _m.meta = ManifestMeta.read(_tmp)
+        _m.chunk_data_list = CDL.read(_tmp, _m.meta.feature_level)
+
+        _tmp.close()
+        del _tmp
 
         return _m
 
     @classmethod
     def read(cls, data):
-        bio = BytesIO(data)
-        if struct.unpack('<I', bio.read(4))[0] != cls.header_magic:
+        _manifest, body = cls._read_body(data)
+        _manifest.data = body.getvalue()
+        body.close()
+        return _manifest
+
+    @classmethod
+    def _read_body(cls, data):
+        """
+        Reads the manifest header and returns the manifest along with a stream of the (decompressed) body.
+
+        The body is inflated and hashed incrementally straight into the returned stream,
+        so no additional copies of the compressed or decompressed data are kept around.
+        """
+        view = memoryview(data)
+        if struct.unpack_from('<I', view, 0)[0] != cls.header_magic:
             raise ValueError('No header magic!')
 
         _manifest = cls()
-        _manifest.header_size = struct.unpack('<I', bio.read(4))[0]
-        _manifest.size_uncompressed = struct.unpack('<I', bio.read(4))[0]
-        _manifest.size_compressed = struct.unpack('<I', bio.read(4))[0]
-        _manifest.sha_hash = bio.read(20)
-        _manifest.stored_as = struct.unpack('B', bio.read(1))[0]
-        _manifest.version = struct.unpack('<I', bio.read(4))[0]
-
-        if bio.tell() != _manifest.header_size:
-            logger.warning(f'Did not read entire header {bio.tell()} != {_manifest.header_size}! '
+        (_manifest.header_size, _manifest.size_uncompressed,
+         _manifest.size_compressed) = struct.unpack_from('<III', view, 4)
+        _manifest.sha_hash = bytes(view[16:36])
+        _manifest.stored_as, _manifest.version = struct.unpack_from('<BI', view, 36)
+
+        if _manifest.header_size != 41:
+            logger.warning(f'Did not read entire header 41 != {_manifest.header_size}! '
                            f'Header version: {_manifest.version}, please report this on '
                            f'GitHub along with a sample of the problematic manifest!')
-            bio.seek(_manifest.header_size)
-
-        data = bio.read()
-        if _manifest.compressed:
-            _manifest.data = zlib.decompress(data)
-            dec_hash = hashlib.sha1(_manifest.data).hexdigest()
-            if dec_hash != _manifest.sha_hash.hex():
-                raise ValueError('Hash does not match!')
-        else:
-            _manifest.data = data
-
-        return _manifest
 
-    def write(self, fp=None, compress=True):
+        payload = view[_manifest.header_size:]
+        if not _manifest.compressed:
+            return _manifest, BytesIO(payload)
+
+        body = BytesIO()
+        sha = hashlib.sha1()
+        decompressor = zlib.decompressobj()
+        for offset in range(0, len(payload), cls._inflate_block_size):
+            chunk = decompressor.decompress(payload[offset:offset + cls._inflate_block_size])
+            sha.update(chunk)
+            body.write(chunk)
+        chunk = decompressor.flush()
+        sha.update(chunk)
+        body.write(chunk)
+        del chunk
+
+        if sha.digest() != _manifest.sha_hash:
+            raise ValueError('Hash does not match!')
+
+        body.seek(0)
+        return _manifest, body
+
+    def write(self, fp=None, compress=True, serialisation_version=None):
         body_bio = BytesIO()
 
         # set serialisation version based on enabled features or original version
-        target_version = max(self.default_serialisation_version, self.meta.feature_level)
+        target_version = max(serialisation_version or self.default_serialisation_version, self.meta.feature_level)
         if self.meta.data_version == 2:
             target_version = max(21, target_version)
         elif self.file_manifest_list.version == 2:
@@ -468,6 +509,9 @@ class CDL:
 
 
 class ChunkInfo:
+    __slots__ = ('guid', 'hash', 'sha_hash', 'window_size', 'file_size',
+                 '_manifest_version', '_group_num', '_guid_str', '_guid_num')
+
     def __init__(self, manifest_version=18):
         self.guid = None
         self.hash = 0
@@ -495,8 +539,8 @@ class ChunkInfo:
 
     @property
     def guid_num(self):
-        if not self._guid_num:
-            self._guid_num = self.guid[3] + (self.guid[2] << 32) + (self.guid[1] << 64) + (self.guid[0] << 96)
+        if self._guid_num is None:
+            self._guid_num = guid_to_num(self.guid)
         return self._guid_num
 
     @property
@@ -573,22 +617,23 @@ class FML:
         for fm in _fml.elements:
             _elem = struct.unpack('<I', bio.read(4))[0]
             for _ in range(_elem):
-                fm.install_tags.append(read_fstring(bio))
+                fm.install_tags.append(sys.intern(read_fstring(bio)))
 
-        # Each file is made up of "Chunk Parts" that can be spread across the "chunk stream"
+        # Each file is made up of "Chunk Parts" that can be spread across the "chunk stream",
+        # parts referencing the same chunk share the guid tuple/number.
+        _guids = dict()
         for fm in _fml.elements:
             _elem = struct.unpack('<I', bio.read(4))[0]
             _offset = 0
             for _ in range(_elem):
-                chunkp = ChunkPart()
                 _start = bio.tell()
-                _size = struct.unpack('<I', bio.read(4))[0]
-                chunkp.guid = struct.unpack('<IIII', bio.read(16))
-                chunkp.offset = struct.unpack('<I', bio.read(4))[0]
-                chunkp.size = struct.unpack('<I', bio.read(4))[0]
-                chunkp.file_offset = _offset
+                _size, _guid_bytes, _chunk_offset, _chunk_size = struct.unpack('<I16sII', bio.read(28))
+                if not (_guid := _guids.get(_guid_bytes)):
+                    _guid_tuple = struct.unpack('<IIII', _guid_bytes)
+                    _guid = _guids[_guid_bytes] = (_guid_tuple, guid_to_num(_guid_tuple))
+                chunkp = ChunkPart(_guid[0], _chunk_offset, _chunk_size, _offset, _guid[1])
                 fm.chunk_parts.append(chunkp)
-                _offset += chunkp.size
+                _offset += _chunk_size
                 if (diff := (bio.tell() - _start - _size)) > 0:
                     logger.warning(f'Did not read {diff} bytes from chunk part!')
                     bio.seek(diff)
@@ -601,7 +646,7 @@ class FML:
                     fm.hash_md5 = bio.read(16)
 
             for fm in _fml.elements:
-                fm.mime_type = read_fstring(bio)
+                fm.mime_type = sys.intern(read_fstring(bio))
 
         # SHA256 hash (Manifest feature level 20)
         if _fml.version >= 2:
@@ -671,6 +716,9 @@ class FML:
 
 
 class FileManifest:
+    __slots__ = ('filename', 'symlink_target', 'hash', 'flags', 'install_tags', 'chunk_parts',
+                 'file_size', 'hash_md5', 'mime_type', 'hash_sha256')
+
     def __init__(self):
         self.filename = ''
         self.symlink_target = ''
@@ -716,14 +764,17 @@ class FileManifest:
 
 
 class ChunkPart:
-    def __init__(self, guid=None, offset=0, size=0, file_offset=0):
+    # there can be millions of these in a manifest, so avoid per-instance dicts
+    __slots__ = ('guid', 'offset', 'size', 'file_offset', '_guid_str', '_guid_num')
+
+    def __init__(self, guid=None, offset=0, size=0, file_offset=0, guid_num=None):
         self.guid = guid
         self.offset = offset
         self.size = size
         self.file_offset = file_offset
         # caches for things that are "expensive" to compute
         self._guid_str = None
-        self._guid_num = None
+        self._guid_num = guid_num
 
     @property
     def guid_str(self):
@@ -733,8 +784,8 @@ class ChunkPart:
 
     @property
     def guid_num(self):
-        if not self._guid_num:
-            self._guid_num = self.guid[3] + (self.guid[2] << 32) + (self.guid[1] << 64) + (self.guid[0] << 96)
+        if self._guid_num is None:
+            self._guid_num = guid_to_num(self.guid)
         return self._guid_num
 
     def __repr__(self):
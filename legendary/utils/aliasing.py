@@ -1,3 +1,4 @@
+from collections import defaultdict
 from string import ascii_lowercase, digits
 
 # Aliases generated:
@@ -99,3 +100,58 @@ def generate_aliases(game_name, game_folder=None, split_words=True, app_name=Non
 
     # return sorted uniques
     return sorted(set(_aliases))
+
+
+def get_trigrams(name):
+    # pad so that short names and word starts produce distinct trigrams
+    padded = f'  {name} '
+    return {padded[i:i+3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Inverted trigram index for fuzzy lookup of names (aliases, app names) to app names
+    """
+    def __init__(self, names: dict):
+        """
+        :param names: dict mapping lowercase names to app names
+        """
+        self.names = names
+        self._trigrams = defaultdict(list)
+        self._trigram_count = dict()
+
+        for name in names:
+            trigrams = get_trigrams(name)
+            self._trigram_count[name] = len(trigrams)
+            for trigram in trigrams:
+                self._trigrams[trigram].append(name)
+
+    def search(self, query, limit=5, min_score=0.35):
+        """
+        Find names similar to query, ranked by trigram similarity (Sørensen–Dice coefficient)
+
+        :param query: name to search for
+        :param limit: maximum number of results
+        :param min_score: minimum similarity score (0.0 - 1.0)
+        :return: list of tuples in format (app name, matched name, score), best match first,
+                 only the best matching name is returned for each app name
+        """
+        query = query.strip().lower()
+        query_trigrams = get_trigrams(query)
+        common = defaultdict(int)
+        for trigram in query_trigrams:
+            for name in self._trigrams.get(trigram, ()):
+                common[name] += 1
+
+        best = dict()
+        for name, num in common.items():
+            score = 2 * num / (len(query_trigrams) + self._trigram_count[name])
+            if score < min_score:
+                continue
+            app_name = self.names[name]
+            if app_name not in best or score > best[app_name][1]:
+                best[app_name] = (name, score)
+
+        results = sorted(((app_name, name, score) for app_name, (name, score) in best.items()),
+                         key=lambda r: (-r[2], r[1]))
+        return results[:limit]
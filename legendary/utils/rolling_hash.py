@@ -1,5 +1,7 @@
 # this is the rolling hash Epic uses, it appears to be a variation on CRC-64-ECMA
 
+from io import BytesIO
+
 hash_poly = 0xC96C5795D7870F42
 hash_table = []
 
@@ -19,7 +21,311 @@ def get_hash(data):
     if not hash_table:
         _init()
 
+    # each byte's table value ends up rotated by the number of bytes following it, and the table is linear
+    # (T[a ^ b] == T[a] ^ T[b]), so the bytes at the same position modulo 64 can be combined before the lookup
+    if not (size := len(data)):
+        return 0
+    rows = -(-size // 64)
+    folded = int.from_bytes(data, 'little')
+    while rows > 1:
+        half = rows // 2
+        bits = half * 512
+        folded = (folded >> bits) ^ (folded & ((1 << bits) - 1))
+        rows -= half
+
     h = 0
-    for i in range(len(data)):
-        h = ((h << 1 | h >> 63) ^ hash_table[data[i]]) & 0xffffffffffffffff
+    for i, b in enumerate(folded.to_bytes(64, 'little')):
+        h ^= _rotl(hash_table[b], size - 1 - i)
     return h
+
+
+def find_boundary(data, min_size, max_size, mask, window=64):
+    """
+    Finds a content-defined chunk boundary using a sliding window version of the rolling hash,
+    a boundary is placed after the first byte where the window hash has none of the bits in mask set.
+
+    :param data: bytes-like object to search
+    :param min_size: minimum chunk size
+    :param max_size: maximum chunk size
+    :param mask: bit mask to test the hash against (its bit count determines the average chunk size)
+    :param window: number of bytes in the sliding window
+    :return: length of the chunk, max_size (or len(data) if smaller) if no boundary was found
+    """
+    end = min(len(data), max_size)
+    if end <= min_size:
+        return end
+    if not (cols := _get_columns(window)):
+        return _find_boundary_slow(data, min_size, max_size, mask, window)
+
+    # hash the windows in blocks using the lane-based approach of scan(), only bytes after start are
+    # part of the first windows, and the first possible boundary is after min_size
+    start = max(min_size - window, 0)
+    first = min_size - start
+    zero = bytes(8)
+    mask_lanes = None
+    block_base = 0
+    found = None
+    for base, size, c, rows, diff in _lane_window_hashes(BytesIO(data[start:end]).read, window, cols, 64 * 1024):
+        if base != block_base:
+            # columns are processed in order, but a boundary in a later column may precede one in an earlier
+            # column, so only the end of a block is conclusive
+            if found is not None:
+                break
+            block_base = base
+        if mask_lanes is None:
+            mask_lanes = int.from_bytes((mask & 0xffffffffffffffff).to_bytes(8, 'little') * rows, 'little')
+
+        masked = (diff & mask_lanes).to_bytes(8 * rows, 'little')
+        pos = masked.find(zero)
+        while pos != -1:
+            if pos % 8 == 0:
+                i = base + (pos // 8) * cols + c
+                if i >= base + size:
+                    break
+                if i >= first:
+                    if found is None or i < found:
+                        found = i
+                    break
+            pos = masked.find(zero, pos + 1)
+
+    return start + found + 1 if found is not None else end
+
+
+def _find_boundary_slow(data, min_size, max_size, mask, window):
+    if not hash_table:
+        _init()
+
+    end = min(len(data), max_size)
+
+    # each byte's table value is rotated once per following byte, so a byte leaving
+    # the window has to be removed rotated by the window size
+    shift = window % 64
+    out_table = [((t << shift | t >> (64 - shift)) & 0xffffffffffffffff) if shift else t for t in hash_table]
+
+    h = 0
+    start = max(min_size - window, 0)
+    for i in range(start, end):
+        h = ((h << 1 | h >> 63) ^ hash_table[data[i]]) & 0xffffffffffffffff
+        if i - start >= window:
+            h ^= out_table[data[i - window]]
+        if i >= min_size and not h & mask:
+            return i + 1
+    return end
+
+
+def _rotl(value, n):
+    n %= 64
+    return ((value << n) | (value >> (64 - n))) & 0xffffffffffffffff if n else value
+
+
+# translation tables for each rotation (0-63) and byte (0-7) of the rotated table values
+_lane_tables = []
+
+
+def _init_lane_tables():
+    if not hash_table:
+        _init()
+    for r in range(64):
+        rotated = [_rotl(t, 64 - r) for t in hash_table]
+        _lane_tables.append([bytes((t >> (8 * k)) & 0xff for t in rotated) for k in range(8)])
+
+
+def _scan_slow(f, hashes, window, block_size):
+    # plain sliding window, used if the window size is not a multiple of 64
+    shift = window % 64
+    out_table = [_rotl(t, shift) for t in hash_table]
+    buf = bytearray()
+    base = h = 0
+    while block := f.read(block_size):
+        # keep the bytes that are still part of the window
+        if len(buf) > window:
+            base += len(buf) - window
+            del buf[:-window]
+        start = len(buf)
+        buf += block
+        for i in range(start, len(buf)):
+            h = ((h << 1 | h >> 63) ^ hash_table[buf[i]]) & 0xffffffffffffffff
+            if i >= window:
+                h ^= out_table[buf[i - window]]
+            if i >= window - 1 and h in hashes:
+                yield base + i - window + 1, h
+
+
+def _get_numpy():
+    try:
+        import numpy
+        return numpy
+    except ImportError:
+        return None
+
+
+def _scan_numpy(np, f, hashes, window, block_size):
+    # same approach as scan() below, but numpy can do the prefix XOR and rotations on all positions at once
+    rotated_tables = np.array([[_rotl(t, 64 - r) for t in hash_table] for r in range(64)], dtype=np.uint64).ravel()
+    needles = np.array(sorted(hashes), dtype=np.uint64)
+    # looking up every position in needles is slow, a bitmap of the top bits of all hashes filters most of them out
+    bitmap = np.zeros(1 << 20, dtype=np.bool_)
+    bitmap[needles >> np.uint64(44)] = True
+
+    # blocks are a multiple of the window size, so the preceding prefix values are always the end of the last block
+    block_size = window * max(block_size // window, 1)
+    positions = np.arange(block_size, dtype=np.uint64)
+    rotations = positions & np.uint64(63)
+    table_offsets = rotations << np.uint64(8)
+    right_rotations = np.uint64(63) - rotations
+    # rotations only have to be recalculated for every block if blocks don't start at a multiple of 64
+    fixed_rotations = block_size % 64 == 0
+    diff = np.empty(block_size, dtype=np.uint64)
+    tmp = np.empty(block_size, dtype=np.uint64)
+    # prefix values of the preceding window, positions before the start of the file are zero
+    history = np.zeros(window, dtype=np.uint64)
+    carry = np.uint64(0)
+    base = 0
+
+    while block := f.read(block_size):
+        size = len(block)
+        rot, right_rot, d, t = rotations[:size], right_rotations[:size], diff[:size], tmp[:size]
+        if not fixed_rotations:
+            np.add(positions[:size], np.uint64(base % 64), out=rot)
+            np.bitwise_and(rot, np.uint64(63), out=rot)
+            np.subtract(np.uint64(63), rot, out=right_rot)
+            np.left_shift(rot, np.uint64(8), out=table_offsets[:size])
+        np.bitwise_or(table_offsets[:size], np.frombuffer(block, dtype=np.uint8), out=t)
+        prefix = np.bitwise_xor.accumulate(rotated_tables.take(t))
+        prefix ^= carry
+        carry = prefix[-1]
+
+        # XOR with the prefix value one window earlier
+        np.bitwise_xor(prefix[:window], history[:size], out=d[:window])
+        if size > window:
+            np.bitwise_xor(prefix[window:], prefix[:-window], out=d[window:])
+        history = prefix[-window:]
+
+        # rotate left, shifting right in two steps avoids a shift by 64 for a rotation of 0
+        np.right_shift(d, np.uint64(1), out=t)
+        np.left_shift(d, rot, out=d)
+        np.right_shift(t, right_rot, out=t)
+        np.bitwise_or(d, t, out=d)
+
+        candidates = np.flatnonzero(bitmap.take(d >> np.uint64(44)))
+        values = d[candidates]
+        idx = np.searchsorted(needles, values)
+        idx[idx == len(needles)] = 0
+        for i in candidates[needles[idx] == values]:
+            end = base + int(i)
+            if end >= window - 1:
+                yield end - window + 1, int(d[i])
+
+        base += size
+
+
+def _get_columns(window):
+    """Returns the number of columns for the lane-based window hash, 0 if the window size is not supported"""
+    return next((c for c in (1024, 512, 256, 128, 64) if window % c == 0), 0)
+
+
+def _lane_window_hashes(read, window, cols, block_size):
+    """
+    Calculates the hashes of all windows in a stream, see scan() for how this works.
+
+    :param read: function returning the next block of data when called with the block size
+    :return: generator of (block offset, block size, column, rows, lanes), with lanes being a Python integer
+             whose 64-bit lanes are the hashes of the windows ending at block offset + row * cols + column
+             (positions beyond the end of the data have to be ignored)
+    """
+    if not _lane_tables:
+        _init_lane_tables()
+
+    rows = max(block_size // cols, 1)
+    block_size = rows * cols
+    # window difference in rows
+    lag = window // cols
+    lag_bits = 64 * lag
+    row_mask = (1 << (64 * rows)) - 1
+    # masks selecting the low r bits of every lane, used for rotating all lanes at once
+    low_masks = [int.from_bytes(((1 << r) - 1).to_bytes(8, 'little') * rows, 'little') for r in range(64)]
+
+    tails = [0] * cols
+    carry = 0
+    base = 0
+    lane_buf = bytearray(8 * rows)
+
+    while block := read(block_size):
+        size = len(block)
+        if size < block_size:
+            block += bytes(block_size - size)
+
+        # prefix XOR over the columns within each row
+        prefix = []
+        acc = 0
+        for c in range(cols):
+            tables = _lane_tables[c % 64]
+            column = block[c::cols]
+            for k in range(8):
+                lane_buf[k::8] = column.translate(tables[k])
+            acc ^= int.from_bytes(lane_buf, 'little')
+            prefix.append(acc)
+
+        # XOR of all preceding rows (and blocks) for every row
+        row_totals = memoryview(acc.to_bytes(8 * rows, 'little')).cast('Q')
+        row_prefix = [carry]
+        for total in row_totals[:-1]:
+            row_prefix.append(row_prefix[-1] ^ total)
+        carry = row_prefix[-1] ^ row_totals[-1]
+        row_prefix = int.from_bytes(b''.join(v.to_bytes(8, 'little') for v in row_prefix), 'little')
+
+        for c in range(cols):
+            ext = tails[c] | ((prefix[c] ^ row_prefix) << lag_bits)
+            tails[c] = ext >> (64 * rows)
+            diff = (ext >> lag_bits) ^ (ext & row_mask)
+            if r := c % 64:
+                low = low_masks[r]
+                diff = ((diff << r) & ~low & row_mask) | ((diff >> (64 - r)) & low)
+            yield base, size, c, rows, diff
+
+        base += block_size
+
+
+def scan(f, hashes, window, block_size=4 * 1024 * 1024):
+    """
+    Finds all windows of data in a file whose rolling hash is in hashes, similar to rsync's rolling checksum search.
+
+    The hash of a window ending at position e can be expressed as rotl(S[e] ^ S[e - window], e), with S being
+    the running XOR over every byte's table value rotated right by its position. Positions are processed as
+    a matrix of "columns" (position modulo the column count) that are stored as Python integers with one
+    64-bit lane per row, so the prefix XOR, the window difference, and the rotation are done on many positions
+    per operation instead of byte by byte.
+
+    If numpy is installed it is used instead, which is several times faster.
+
+    :param f: file object opened in binary mode
+    :param hashes: set of rolling hashes to look for
+    :param window: window (chunk) size
+    :param block_size: number of bytes to process at once
+    :return: generator of (offset, hash) tuples, with the offset being the start of the window
+    """
+    if not hash_table:
+        _init()
+    if not hashes:
+        return
+
+    if np := _get_numpy():
+        yield from _scan_numpy(np, f, hashes, window, block_size)
+        return
+
+    if not (cols := _get_columns(window)):
+        yield from _scan_slow(f, hashes, window, block_size)
+        return
+
+    for base, size, c, rows, diff in _lane_window_hashes(f.read, window, cols, block_size):
+        lanes = diff.to_bytes(8 * rows, 'little')
+        if hits := hashes.intersection(memoryview(lanes).cast('Q')):
+            for h in hits:
+                needle = h.to_bytes(8, 'little')
+                pos = lanes.find(needle)
+                while pos != -1:
+                    if pos % 8 == 0:
+                        end = base + (pos // 8) * cols + c
+                        if window - 1 <= end < base + size:
+                            yield end - window + 1, h
+                    pos = lanes.find(needle, pos + 1)
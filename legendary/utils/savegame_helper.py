@@ -8,6 +8,7 @@ from io import BytesIO
 from tempfile import TemporaryFile
 
 from legendary.models.chunk import Chunk
+from legendary.utils.rolling_hash import find_boundary
 from legendary.models.manifest import \
     Manifest, ManifestMeta, CDL, FML, CustomFields, FileManifest, ChunkPart, ChunkInfo
 
@@ -35,6 +36,83 @@ def _filename_matches(filename, patterns):
     return False
 
 
+def get_file_sha1(path):
+    """
+    Calculate SHA-1 hash of a file
+
+    :param path: path to the file
+    :return: digest (bytes)
+    """
+    fhash = sha1()
+    with open(path, 'rb') as f:
+        while data := f.read(1024 * 1024):
+            fhash.update(data)
+    return fhash.digest()
+
+
+class _ContentDefinedPacker:
+    """
+    Packs a stream of file data into chunks with content-defined boundaries, so that inserting or
+    resizing a file only affects the chunks around the change. Chunks with the same content as
+    an existing remote chunk (e.g. from the previous save) are reused instead of being uploaded again.
+    """
+    min_size = 256 * 1024
+    max_size = 1024 * 1024
+    # 18 bits => boundary on average every 256 KiB after the minimum size
+    mask = (1 << 18) - 1
+
+    def __init__(self, helper, manifest, reusable=None, reused=None):
+        self.helper = helper
+        self.manifest = manifest
+        # padded sha1 hash => ChunkInfo of remote chunks
+        self.reusable = reusable or dict()
+        # guid_num of remote chunks that have already been added to the manifest
+        self.reused = reused if reused is not None else set()
+        self.buffer = bytearray()
+        # file data in buffer that has not been assigned to a chunk yet: [FileManifest, file offset, offset, size]
+        self.segments = []
+        self.num_chunks = 0
+
+    def add(self, fm, file_offset, data):
+        self.segments.append([fm, file_offset, len(self.buffer), len(data)])
+        self.buffer += data
+        while len(self.buffer) >= self.max_size:
+            self._cut(find_boundary(self.buffer, self.min_size, self.max_size, self.mask))
+
+    def flush(self):
+        while self.buffer:
+            self._cut(find_boundary(self.buffer, self.min_size, self.max_size, self.mask))
+
+    def _cut(self, length):
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        self.num_chunks += 1
+
+        # chunk hashes are calculated over the data padded to 1 MiB
+        if ci := self.reusable.get(sha1(data + b'\x00' * (self.max_size - length)).digest()):
+            self.helper.log.debug(f'Chunk #{self.num_chunks} matches existing chunk "{ci.path}"')
+            if ci.guid_num not in self.reused:
+                self.reused.add(ci.guid_num)
+                self.manifest.chunk_data_list.elements.append(ci)
+        else:
+            chunk = Chunk()
+            chunk.data = data
+            ci = self.helper.finalize_chunk(chunk)
+            self.helper.log.info(f'Chunk #{self.num_chunks} "{ci.path}" created')
+            self.manifest.chunk_data_list.elements.append(ci)
+
+        remaining = []
+        for fm, file_offset, offset, size in self.segments:
+            if offset >= length:
+                remaining.append([fm, file_offset, offset - length, size])
+                continue
+            part_size = min(size, length - offset)
+            fm.chunk_parts.append(ChunkPart(guid=ci.guid, offset=offset, size=part_size, file_offset=file_offset))
+            if part_size < size:
+                remaining.append([fm, file_offset + part_size, 0, size - part_size])
+        self.segments = remaining
+
+
 class SaveGameHelper:
     def __init__(self):
         self.files = dict()
@@ -58,7 +136,10 @@ class SaveGameHelper:
                          cloud_folder: str = '', cloud_folder_mac: str = '',
                          include_filter: list = None,
                          exclude_filter: list = None,
-                         manifest_dt: datetime = None):
+                         manifest_dt: datetime = None,
+                         previous_manifest: Manifest = None,
+                         previous_chunks: set = None,
+                         content_defined_chunking: bool = False):
         """
         :param input_folder: Folder to be packaged into chunks/manifest
         :param app_name: App name for savegame being stored
@@ -68,6 +149,11 @@ class SaveGameHelper:
         :param include_filter: list of patterns for files to include (excludes all others)
         :param exclude_filter: list of patterns for files to exclude (includes all others)
         :param manifest_dt: datetime for the manifest name (optional)
+        :param previous_manifest: manifest of the latest remote save, unchanged files will reference
+                                  its chunks instead of being packed into new ones (optional)
+        :param previous_chunks: chunk paths (ChunkInfo.path) of the previous manifest that exist remotely,
+                                only these will be reused (required if previous_manifest is set)
+        :param content_defined_chunking: place chunk boundaries based on content instead of every 1 MiB
         :return:
         """
         m = Manifest()
@@ -108,6 +194,20 @@ class SaveGameHelper:
         chunk_num = 0
         cur_chunk = None
         cur_buffer = None
+        reused_chunks = set()
+        reused_size = 0
+        previous_files = dict()
+        previous_chunks = previous_chunks or set()
+        if previous_manifest:
+            previous_files = {fm.filename: fm for fm in previous_manifest.file_manifest_list.elements}
+
+        cdc_packer = None
+        if content_defined_chunking:
+            reusable = dict()
+            if previous_manifest:
+                reusable = {c.sha_hash: c for c in previous_manifest.chunk_data_list.elements
+                            if c.path in previous_chunks}
+            cdc_packer = _ContentDefinedPacker(self, m, reusable, reused_chunks)
 
         for _file in sorted(files, key=str.casefold):
             s = os.stat(_file)
@@ -116,8 +216,39 @@ class SaveGameHelper:
             f.filename = os.path.relpath(_file, input_folder).replace('\\', '/')
             self.log.debug(f'Processing file "{f.filename}"')
             f.file_size = s.st_size
+
+            # reference chunks of the previous save if the file is unchanged and all its chunks still exist
+            if (old_fm := previous_files.get(f.filename)) and old_fm.file_size == s.st_size:
+                old_chunks = [previous_manifest.chunk_data_list.get_chunk_by_guid_num(cp.guid_num)
+                              for cp in old_fm.chunk_parts]
+                if all(c and c.path in previous_chunks for c in old_chunks) and \
+                        get_file_sha1(_file) == old_fm.hash:
+                    self.log.debug(f'Reusing {len(old_chunks)} chunk part(s) for unchanged file "{f.filename}"')
+                    f.hash = old_fm.hash
+                    f.chunk_parts = old_fm.chunk_parts
+                    for c in old_chunks:
+                        if c.guid_num not in reused_chunks:
+                            reused_chunks.add(c.guid_num)
+                            m.chunk_data_list.elements.append(c)
+                    m.file_manifest_list.elements.append(f)
+                    reused_size += s.st_size
+                    continue
+
             fhash = sha1()
 
+            if cdc_packer:
+                with open(_file, 'rb') as cf:
+                    while data := cf.read(min(s.st_size - cf.tell(), 1024 * 1024)):
+                        fhash.update(data)
+                        cdc_packer.add(f, cf.tell() - len(data), data)
+                    if cf.tell() < s.st_size:
+                        self.log.warning(f'Got EOF for "{f.filename}" with {s.st_size - cf.tell()} bytes '
+                                         f'remaining! File may have been corrupted/modified.')
+
+                f.hash = fhash.digest()
+                m.file_manifest_list.elements.append(f)
+                continue
+
             with open(_file, 'rb') as cf:
                 while remaining := s.st_size - cf.tell():
                     if not cur_chunk:  # create new chunk
@@ -152,14 +283,20 @@ class SaveGameHelper:
             f.hash = fhash.digest()
             m.file_manifest_list.elements.append(f)
 
-        # write remaining chunk if it exists
-        if cur_chunk:
+        # write remaining chunk(s) if they exist
+        if cdc_packer:
+            cdc_packer.flush()
+        elif cur_chunk:
             cur_chunk.data = cur_buffer.getvalue()
             ci = self.finalize_chunk(cur_chunk)
             self.log.info(f'Chunk #{chunk_num} "{ci.path}" created')
             m.chunk_data_list.elements.append(ci)
             cur_buffer.close()
 
+        if reused_chunks:
+            self.log.info(f'Reused {len(reused_chunks)} chunk(s) from previous save '
+                          f'({reused_size / 1024 / 1024:.02f} MiB of unchanged files)')
+
         # Finally write/serialize manifest into another temporary file
         _m_filename = f'manifests/{m.meta.build_version}.manifest'
         _tmp_file = TemporaryFile()
@@ -176,15 +313,21 @@ class SaveGameHelper:
         for _dir, _, _files in os.walk(save_folder):
             for _file in _files:
                 _file_path = os.path.join(_dir, _file)
-                _file_path_rel = os.path.relpath(_file_path, save_folder).replace('\\', '/')
+                files.append(os.path.relpath(_file_path, save_folder).replace('\\', '/'))
 
-                if include_filter and not _filename_matches(_file_path_rel, include_filter):
-                    self.log.debug(f'Excluding "{_file_path_rel}" (does not match include filter)')
-                    continue
-                elif exclude_filter and _filename_matches(_file_path_rel, exclude_filter):
-                    self.log.debug(f'Excluding "{_file_path_rel}" (does match exclude filter)')
-                    continue
+        return self.filter_files(files, include_filter, exclude_filter)
+
+    def filter_files(self, files, include_filter=None, exclude_filter=None):
+        """Returns the relative file paths in files that match the include/exclude filters"""
+        filtered = []
+        for _file_path_rel in files:
+            if include_filter and not _filename_matches(_file_path_rel, include_filter):
+                self.log.debug(f'Excluding "{_file_path_rel}" (does not match include filter)')
+                continue
+            elif exclude_filter and _filename_matches(_file_path_rel, exclude_filter):
+                self.log.debug(f'Excluding "{_file_path_rel}" (does match exclude filter)')
+                continue
 
-                files.append(_file_path_rel)
+            filtered.append(_file_path_rel)
 
-        return files
+        return filtered
@@ -42,7 +42,8 @@ setup(
     ],
     extras_require=dict(
         webview=['pywebview>=3.4'],
-        webview_gtk=['pywebview>=3.4', 'PyGObject']
+        webview_gtk=['pywebview>=3.4', 'PyGObject'],
+        salvage=['numpy']
     ),
     url='https://github.com/derrod/legendary',
     description='Free and open-source replacement for the Epic Games Launcher application',
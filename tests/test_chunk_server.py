@@ -0,0 +1,140 @@
+# coding: utf-8
+
+"""
+Tests for the caching chunk proxy ("legendary serve --proxy") against a local stub upstream server.
+Run with: python -m unittest -v tests.test_chunk_server
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from legendary.chunk_server import ChunkServer, ProxyChunkSource
+from legendary.lfs.chunk_store import ChunkStore
+from legendary.models.chunk import Chunk
+
+
+def make_chunk(corrupt=False):
+    """Returns (chunk name, chunk file data), optionally with a damaged body but intact header"""
+    chunk = Chunk()
+    chunk.data = os.urandom(1024 * 1024)
+    data = bytearray(chunk.write())
+    if corrupt:
+        data[-1] ^= 0xff
+    return ChunkStore.get_key(chunk.guid_num, chunk.hash), bytes(data)
+
+
+class _StubUpstream(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, delay=0.0):
+        self.files = dict()
+        self.requests = []
+        self.delay = delay
+        super().__init__(('127.0.0.1', 0), _StubHandler)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    server: _StubUpstream
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        # keep the request open for a bit so concurrent proxy requests overlap
+        time.sleep(self.server.delay)
+        if (data := self.server.files.get(self.path)) is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class TestChunkProxy(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.upstream = _start(_StubUpstream(delay=0.5))
+        self.upstream_host = f'127.0.0.1:{self.upstream.server_port}'
+
+    def tearDown(self):
+        for server in (self.upstream, getattr(self, 'server', None)):
+            if server:
+                server.shutdown()
+                server.server_close()
+        self.tmp.cleanup()
+
+    def start_proxy(self, **kwargs):
+        kwargs.setdefault('upstream_url', f'http://{self.upstream_host}')
+        self.store = ChunkStore(os.path.join(self.tmp.name, 'store'))
+        self.proxy = ProxyChunkSource(self.store, upstream_scheme='http', **kwargs)
+        self.server = _start(ChunkServer([self.proxy], '127.0.0.1', 0))
+
+    def fetch(self, path):
+        url = f'http://127.0.0.1:{self.server.server_port}{path}'
+        try:
+            with urllib.request.urlopen(url, timeout=10) as r:
+                return r.read()
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def test_cache_and_concurrent_requests(self):
+        name, data = make_chunk()
+        path = f'/ChunksV4/42/{name}.chunk'
+        self.upstream.files[path] = data
+        self.start_proxy()
+
+        # first fetch, requested by several clients at once
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(self.fetch, [path] * 8))
+        self.assertTrue(all(r == data for r in results))
+        self.assertEqual(len(self.upstream.requests), 1)
+        self.assertEqual(self.proxy.fetched, 1)
+        self.assertIn(name, self.store)
+
+        # second fetch is answered from the store (bypassing the server's in-memory cache)
+        self.assertEqual(self.proxy.get_chunk(name, path), data)
+        self.assertEqual(self.proxy.hits, 1)
+        self.assertEqual(len(self.upstream.requests), 1)
+        self.assertEqual(self.server.served, 8)
+
+    def test_corrupted_upstream_chunk(self):
+        name, data = make_chunk(corrupt=True)
+        path = f'/ChunksV4/42/{name}.chunk'
+        self.upstream.files[path] = data
+        self.start_proxy()
+
+        self.assertEqual(self.fetch(path), 404)
+        self.assertNotIn(name, self.store)
+        self.assertEqual(self.server.misses, 1)
+
+    def test_upstream_host_allowlist(self):
+        name, data = make_chunk()
+        path = f'/ChunksV4/42/{name}.chunk'
+        self.upstream.files[path] = data
+
+        # without a fixed upstream the host comes from the request path and has to be allowed
+        self.start_proxy(upstream_url=None, allowed_hosts={self.upstream_host})
+        self.assertEqual(self.fetch(f'/127.0.0.2:{self.upstream.server_port}{path}'), 404)
+        self.assertEqual(self.fetch(f'/user@{self.upstream_host}{path}'), 404)
+        self.assertEqual(self.upstream.requests, [])
+        self.assertEqual(self.fetch(f'/{self.upstream_host}{path}'), data)
+        self.assertEqual(len(self.upstream.requests), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# coding: utf-8
+
+"""
+Import-time check for CLI cold starts.
+
+Runs subcommands that don't need the network with "python -X importtime" and makes sure they don't pull in
+the API clients (requests) or the downloader. The cumulative import time per subcommand is printed so it can
+be tracked, run with: python -m unittest -v tests.test_import_time
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# modules that only commands talking to Epic's API or downloading something should import
+HEAVY_MODULES = {'requests', 'urllib3', 'legendary.api.egs', 'legendary.downloader.mp.manager',
+                 'multiprocessing.shared_memory'}
+
+OFFLINE_COMMANDS = [
+    ['--version'],
+    ['--help'],
+    ['list-installed'],
+    ['status', '--offline'],
+    ['launch', '--offline', 'NonExistentApp'],
+]
+
+
+def get_import_times(args, config_dir):
+    """
+    Runs the CLI with args
+
+    :return: {module: cumulative import time in µs}, total import time in µs
+    """
+    env = dict(os.environ, LEGENDARY_CONFIG_PATH=config_dir, PYTHONPATH=REPO_DIR)
+    p = subprocess.run([sys.executable, '-X', 'importtime', '-m', 'legendary.cli'] + args,
+                       env=env, cwd=config_dir, capture_output=True, text=True, timeout=60)
+
+    times = dict()
+    total = 0
+    for line in p.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+        # nested imports are indented, only count top-level ones towards the total
+        if not name.startswith('  '):
+            total += int(cumulative)
+    return times, total
+
+
+class TestImportTime(unittest.TestCase):
+    def test_offline_commands(self):
+        with tempfile.TemporaryDirectory() as config_dir:
+            # first run creates the config and caches bytecode, so the measured runs are comparable
+            get_import_times(['--version'], config_dir)
+
+            for args in OFFLINE_COMMANDS:
+                with self.subTest(command=' '.join(args)):
+                    times, total = get_import_times(args, config_dir)
+                    self.assertIn('legendary', times)
+                    print(f'\n{" ".join(args)}: {total / 1000:.1f} ms of imports '
+                          f'({times.get("legendary.core", 0) / 1000:.1f} ms legendary.core)', end='')
+                    self.assertFalse(HEAVY_MODULES & times.keys(),
+                                     f'"{" ".join(args)}" imports {sorted(HEAVY_MODULES & times.keys())}')
+
+
+if __name__ == '__main__':
+    unittest.main()
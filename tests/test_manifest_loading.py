@@ -0,0 +1,146 @@
+# coding: utf-8
+
+"""
+Parsing benchmark and peak memory check for binary manifest loading, using a synthetic manifest with many
+chunk parts. Run with: python -m unittest -v tests.test_manifest_loading
+
+The parsing benchmark uses 2 million chunk parts (about the size of a large game's manifest), set
+LEGENDARY_BENCH_PARTS to use a different number, e.g. LEGENDARY_BENCH_PARTS=200000 for a quicker run.
+"""
+
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+from legendary.models.manifest import Manifest, ManifestMeta, CDL, ChunkInfo, FML, FileManifest, ChunkPart, \
+    CustomFields
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NUM_PARTS = int(os.environ.get('LEGENDARY_BENCH_PARTS', 2000000))
+PARTS_PER_FILE = 20
+NUM_FILES = max(NUM_PARTS // PARTS_PER_FILE, 1)
+NUM_CHUNKS = max(NUM_PARTS // 8, 1)
+
+
+def make_manifest(num_files=NUM_FILES, parts_per_file=PARTS_PER_FILE, num_chunks=NUM_CHUNKS, seed=0):
+    """Returns a serialised (compressed) manifest with random chunks and files made up of random chunk parts"""
+    rng = random.Random(seed)
+    m = Manifest()
+    m.meta = ManifestMeta()
+    m.meta.app_name = 'Synthetic'
+    m.meta.build_version = '1.0'
+    m.chunk_data_list = CDL()
+    m.file_manifest_list = FML()
+    m.custom_fields = CustomFields()
+
+    chunks = []
+    for _ in range(num_chunks):
+        ci = ChunkInfo()
+        ci.guid = tuple(rng.getrandbits(32) for _ in range(4))
+        ci.hash = rng.getrandbits(64)
+        ci.sha_hash = rng.randbytes(20)
+        ci.group_num = rng.randrange(100)
+        ci.window_size = 1024 * 1024
+        ci.file_size = rng.randrange(1024, 1024 * 1024)
+        chunks.append(ci)
+    m.chunk_data_list.elements = chunks
+
+    for i in range(num_files):
+        fm = FileManifest()
+        fm.filename = f'Content/Dir{i % 100}/File{i}.pak'
+        fm.hash = rng.randbytes(20)
+        fm.install_tags = ['en'] if i % 3 else []
+        for j in range(parts_per_file):
+            fm.chunk_parts.append(ChunkPart(guid=rng.choice(chunks).guid, offset=rng.randrange(1024 * 1024),
+                                            size=4096, file_offset=j * 4096))
+        fm.file_size = parts_per_file * 4096
+        m.file_manifest_list.elements.append(fm)
+
+    return m.write()
+
+
+class TestManifestParsing(unittest.TestCase):
+    def test_read_all(self):
+        data = make_manifest()
+        start = time.perf_counter()
+        Manifest.read_all(data)
+        duration = time.perf_counter() - start
+
+        # parse again to measure memory, tracemalloc slows parsing down too much to do both at once
+        tracemalloc.start()
+        m = Manifest.read_all(data)
+        parsed_size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        num_parts = sum(len(fm.chunk_parts) for fm in m.file_manifest_list.elements)
+        self.assertEqual(num_parts, NUM_FILES * PARTS_PER_FILE)
+        self.assertEqual(len(m.chunk_data_list.elements), NUM_CHUNKS)
+        print(f'\n{num_parts} chunk parts: {duration:.2f} s, parsed size: {parsed_size / 1024 / 1024:.1f} MiB '
+              f'({parsed_size / num_parts:.0f} bytes per chunk part), peak: {peak / 1024 / 1024:.1f} MiB', end='')
+
+        # chunk parts referencing the same chunk share their GUID
+        guids = {cp.guid_num: cp.guid for fm in m.file_manifest_list.elements for cp in fm.chunk_parts}
+        for fm in m.file_manifest_list.elements[:100]:
+            for cp in fm.chunk_parts:
+                self.assertIs(cp.guid, guids[cp.guid_num])
+        # including the files and chunks this is about 285 bytes per chunk part,
+        # before slotted classes and shared GUIDs it was about 510
+        self.assertLess(parsed_size / num_parts, 380)
+
+
+# loads only the chunk list of the manifest given as argument, so that memory use is dominated by handling the
+# manifest body rather than the parsed objects. Prints: uncompressed body size, peak RSS increase, RSS increase
+_MEASURE_SCRIPT = '''
+import sys
+from legendary.models.manifest import Manifest
+
+def memory_status():
+    # VmHWM (peak RSS) is reset by exec, unlike ru_maxrss which would include the parent's peak
+    with open('/proc/self/status') as f:
+        status = dict(line.split(':', 1) for line in f)
+    return int(status['VmRSS'].split()[0]) * 1024, int(status['VmHWM'].split()[0]) * 1024
+
+with open(sys.argv[1], 'rb') as f:
+    data = f.read()
+before = memory_status()[0]
+m = Manifest.read_chunk_list(data)
+rss, peak = memory_status()
+print(m.size_uncompressed, peak - before, rss - before)
+'''
+
+
+@unittest.skipUnless(sys.platform == 'linux', 'RSS measurement requires /proc')
+class TestManifestMemory(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.manifest_path = os.path.join(cls.tmp.name, 'synthetic.manifest')
+        with open(cls.manifest_path, 'wb') as f:
+            # a large file list with few chunks
+            f.write(make_manifest(num_files=20000, parts_per_file=80, num_chunks=5000))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_peak_rss(self):
+        # make glibc return freed large buffers to the OS immediately so they don't count towards the RSS
+        env = dict(os.environ, MALLOC_MMAP_THRESHOLD_='131072')
+        p = subprocess.run([sys.executable, '-c', _MEASURE_SCRIPT, self.manifest_path], cwd=REPO_DIR, env=env,
+                           capture_output=True, text=True, check=True, timeout=300)
+        body_size, peak, retained = (int(v) for v in p.stdout.split())
+        print(f'\nbody: {body_size / 1024 / 1024:.1f} MiB, peak RSS increase: {peak / 1024 / 1024:.1f} MiB, '
+              f'retained: {retained / 1024 / 1024:.1f} MiB', end='')
+        # the body is inflated straight into the stream that is parsed, previously a copy of the compressed
+        # data and the decompressed data were alive alongside it (about 2.6x the body size here)
+        self.assertLess(peak, 1.5 * body_size)
+
+
+if __name__ == '__main__':
+    unittest.main()
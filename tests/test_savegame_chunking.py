@@ -0,0 +1,91 @@
+# coding: utf-8
+
+"""
+Benchmark for savegame packaging with fixed-size and content-defined chunking.
+
+A save file is packaged, then 100 bytes are inserted in the middle and it is packaged again with the first
+result as the previous (remote) save. Prints packaging throughput and the number of new chunks that would have
+to be uploaded for both modes, run with: python -m unittest -v tests.test_savegame_chunking
+"""
+
+import os
+import random
+import tempfile
+import time
+import unittest
+
+from legendary.models.chunk import Chunk
+from legendary.models.manifest import Manifest
+from legendary.utils.savegame_helper import SaveGameHelper
+
+FILE_SIZE = 8 * 1024 * 1024
+INSERT_OFFSET = 3 * 1024 * 1024
+INSERT_SIZE = 100
+
+
+def package(save_dir, content_defined_chunking, previous=None):
+    """
+    Packages save_dir, treating all chunks of previous (if set) as existing remotely
+
+    :return: Manifest, {chunk path: data} of new chunks, time taken in seconds
+    """
+    previous_manifest, previous_chunks = previous or (None, dict())
+    start = time.perf_counter()
+    files = SaveGameHelper().package_savegame(save_dir, 'app', 'id', 'folder',
+                                              previous_manifest=previous_manifest,
+                                              previous_chunks=set(previous_chunks),
+                                              content_defined_chunking=content_defined_chunking)
+    duration = time.perf_counter() - start
+
+    manifest = None
+    chunks = dict()
+    for path, f in files.items():
+        if path.endswith('.manifest'):
+            manifest = Manifest.read_all(f.read())
+        else:
+            chunks[path] = Chunk.read_buffer(f.read()).data
+        f.close()
+    return manifest, chunks, duration
+
+
+def reassemble(manifest, chunks):
+    """Returns {filename: data} of all files in manifest"""
+    by_guid = {c.guid_num: chunks[c.path] for c in manifest.chunk_data_list.elements}
+    return {fm.filename: b''.join(by_guid[cp.guid_num][cp.offset:cp.offset + cp.size] for cp in fm.chunk_parts)
+            for fm in manifest.file_manifest_list.elements}
+
+
+class TestSavegameChunking(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.save_file = os.path.join(self.tmp.name, 'save.dat')
+        self.data = random.Random(0).randbytes(FILE_SIZE)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_mode(self, content_defined_chunking):
+        with open(self.save_file, 'wb') as f:
+            f.write(self.data)
+        first = package(self.tmp.name, content_defined_chunking)
+
+        modified = self.data[:INSERT_OFFSET] + os.urandom(INSERT_SIZE) + self.data[INSERT_OFFSET:]
+        with open(self.save_file, 'wb') as f:
+            f.write(modified)
+        manifest, chunks, duration = package(self.tmp.name, content_defined_chunking, first[:2])
+
+        self.assertEqual(reassemble(manifest, {**first[1], **chunks}), {'save.dat': modified})
+        mode = 'content-defined' if content_defined_chunking else 'fixed'
+        print(f'\n{mode}: {FILE_SIZE / 1024 / 1024 / first[2]:.1f} MiB/s, '
+              f'{len(chunks)} of {len(manifest.chunk_data_list.elements)} chunks new after insert', end='')
+        return len(chunks)
+
+    def test_insert(self):
+        fixed = self.run_mode(False)
+        cdc = self.run_mode(True)
+        # with fixed chunks everything after the insertion point changes
+        self.assertLess(cdc, fixed)
+
+
+if __name__ == '__main__':
+    unittest.main()